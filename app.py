@@ -1,25 +1,106 @@
 import streamlit as st
 from datetime import datetime, timedelta, time
 
-from db import init_db, get_db_connection
-from verification import verify_uchicago, generate_token, verify_email
-from cta_api import compute_fastest, red_line_stations
-from matching import find_matches
+from db import init_db, get_db_connection, shared_provider
+from verification import verify_uchicago, generate_token
+from cta_api import compute_fastest, candidate_runs, red_line_stations, use_timetable
+from matching import claim_best, find_matches, find_run_matches, record_trip_runs
+from live_matcher import LiveMatcher
+from topics import TOPICS
+from metrics import configure_logging, gauge, span
 
-from PIL import Image
+# PIL, the mailer (smtplib/ssl), the station poller and the metrics server are imported where first
+# used, so a cold start only loads what the login page and the planner need
 
-VERBOSE = True
+# Log level from $LOG_LEVEL (default WARNING); DEBUG traces every CTA lookup
+configure_logging()
 
-TOPICS=['Food','Sports','Music','Tech','Art','Movies','Books','Travel','Fitness','Gaming','Photography','Science','Politics','History','Comedy']
 STATIONS=list(red_line_stations.keys())
 
 db_config=st.secrets['mysql']
 cta_key=st.secrets['cta']['api_key']
 email_sender=st.secrets['email']['sender_address']
-email_pass=st.secrets['email']['sender_password']
 
 init_db(db_config)
 
+@st.cache_resource
+def get_db_provider(_config):
+    # Warm connection pool kept across reruns; each rerun borrows one connection from it
+    return shared_provider(_config)
+
+db_provider = get_db_provider(db_config)
+
+# Trips added or matched by other app processes, batch workers or the CLI import reach the live
+# matcher when it next syncs with MySQL, at most this many seconds after the last sync
+INDEX_SYNC_SECONDS = 60
+
+@st.cache_resource
+def get_live_matcher(_config):
+    # One resident index of open trips per server process, shared by every session; keeps every open
+    # trip's top 3 current as new trips arrive, so earlier riders see better partners. It is built and
+    # re-synced on a background thread; until the first build is done, matches come from MySQL.
+    # Only today's windows can be requested, so trips that ended before today are never loaded
+    return LiveMatcher().start(lambda: get_db_connection(_config), interval=INDEX_SYNC_SECONDS,
+                               now=lambda: datetime.combine(datetime.now().date(), time.min))
+
+@st.cache_resource
+def start_station_poller(api_key, interval):
+    # One background poller per server process; requests then read the live timetable
+    from station_poller import StationPoller
+    from travel_matrix import schedule_recorder
+    # Approaching trains go to the schedule table, which `travel_matrix.py rebuild` turns into the
+    # offline travel-time matrix behind compute_fastest
+    poller = StationPoller(api_key, interval=interval, on_update=schedule_recorder(db_provider.get)).start()
+    use_timetable(poller.timetable)
+    return poller
+
+# Opt-in via [cta] poll_interval = 30 in secrets.toml
+if st.secrets['cta'].get('poll_interval'):
+    start_station_poller(cta_key, float(st.secrets['cta']['poll_interval']))
+
+@st.cache_resource
+def get_mailer(_email_config):
+    # One SMTP login per server process, started when the first code is sent; the login handler only enqueues
+    from mailer import shared_mailer
+    mailer = shared_mailer(_email_config.get('smtp_host', 'smtp.gmail.com'), int(_email_config.get('smtp_port', 465)),
+                           _email_config['sender_address'], _email_config['sender_password'],
+                           use_ssl=_email_config.get('smtp_ssl', True))
+    gauge('mail_queue_depth', lambda: mailer.stats()['queued'], 'Verification emails waiting to be sent')
+    return mailer
+
+@st.cache_resource
+def start_metrics_server(port):
+    # Prometheus text at /metrics, JSON at /metrics.json, for a local scraper
+    from metrics import MetricsServer
+    return MetricsServer(port=port).start()
+
+# Opt-in via [metrics] port = 9108 in secrets.toml
+if st.secrets.get('metrics', {}).get('port'):
+    start_metrics_server(int(st.secrets['metrics']['port']))
+
+# Opt-in via [matching] by_run = true: match riders who can board the same train run
+MATCH_BY_RUN = bool(st.secrets.get('matching', {}).get('by_run'))
+
+@st.cache_resource
+def load_avatar(path):
+    # Decoded once per server process instead of on every match
+    from PIL import Image
+    img = Image.open(path)
+    img.load()
+    return img
+
+class NoTrainFound(LookupError):
+    pass
+
+@st.cache_data(ttl=60, show_spinner=False)
+def plan_fastest(origin, dest, minute, _api_key):
+    # Shared by every session asking for the same trip in the same minute; a failed plan raises so
+    # it is not cached
+    fastest, dep, arr = compute_fastest(origin, dest, _api_key, minute)
+    if fastest is None:
+        raise NoTrainFound(f"{origin} -> {dest} at {minute}")
+    return fastest, dep, arr
+
 # Logout only when logged in
 if st.session_state.get('logged_in'):
     if st.sidebar.button('Logout'):
@@ -44,9 +125,10 @@ if not st.session_state.get("logged_in"):
             if not verify_uchicago(email):
                 st.error("Use your @uchicago.edu email.")
             else:
+                from mailer import verification_message
                 token = generate_token()
                 st.session_state["verification_code"] = token
-                verify_email(email, token, email_sender, email_pass)
+                get_mailer(st.secrets['email']).send(verification_message(email, token, email_sender))
                 st.session_state["email"] = email
                 st.session_state["code_sent"] = True
                 st.success("Code sent!")
@@ -62,10 +144,16 @@ if not st.session_state.get("logged_in"):
         st.stop()
 
 # Onboarding interests
-conn=get_db_connection(db_config)
-cursor=conn.cursor(dictionary=True)
-cursor.execute('SELECT * FROM profiles WHERE email=%s',(st.session_state.email,))
-profile=cursor.fetchone()
+# The profile row is read once per session; a rerun that does not write needs no connection
+conn=cursor=None
+profile=st.session_state.get('profile')
+if profile is None:
+    conn=db_provider.get()
+    cursor=conn.cursor(dictionary=True)
+    cursor.execute('SELECT * FROM profiles WHERE email=%s',(st.session_state.email,))
+    profile=cursor.fetchone()
+    if profile:
+        st.session_state['profile']=profile
 if not profile:
     st.header('Select Your Interests')
     cols=st.columns(2)
@@ -78,12 +166,21 @@ if not profile:
         cursor.execute('INSERT INTO profiles (email,origin,destination,interests) VALUES (%s,%s,%s,%s)',
                        (st.session_state.email,'','',','.join(sel)))
         conn.commit()
+        # Re-read on the next run
+        st.session_state.pop('profile', None)
         st.success('Interests saved! Reload.')
         st.stop()
     st.stop()
 
 # Ride request
 st.sidebar.write(f"Logged in as: {st.session_state.email}")
+# Started once a rider reaches the planner, so the login page never pays for it
+live_matcher=get_live_matcher(db_config)
+# Best partner for the rider's last request, kept current as other riders join
+trip_id=st.session_state.get('trip_id')
+current=live_matcher.matches(trip_id) if trip_id and live_matcher.ready else []
+if current:
+    st.sidebar.markdown(f"Current best match: **{current[0]['email']}**")
 st.header('Plan Your Ride')
 mode=st.radio('Plan to',['Depart by','Arrive by'], horizontal=True)
 origin=st.selectbox('Origin',STATIONS)
@@ -98,46 +195,77 @@ if st.button('Find Matches'):
         earliest, latest = dt, dt+timedelta(minutes=15)
     else:
         latest, earliest = dt, dt-timedelta(minutes=15)
-    fastest, dep, arr = compute_fastest(origin, dest, cta_key, earliest)
+    with span('plan_trip'):
+        try:
+            fastest, dep, arr = plan_fastest(origin, dest, earliest.replace(second=0, microsecond=0), cta_key)
+        except NoTrainFound:
+            fastest = None
     if fastest is None:
         st.error("No upcoming Red Line train found at that time – please choose an earlier departure or later arrival.")
         st.stop()
 
-    cursor.execute(
-        """
-        INSERT INTO trips (profile_id, origin, destination, earliest, latest, fastest_seconds)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """,
-        (profile['id'], origin, dest, earliest, latest, fastest or 0)
-    )
-    conn.commit()
-    trip_id = cursor.lastrowid
-
+    runs = candidate_runs(origin, dest, cta_key, earliest, latest) if MATCH_BY_RUN else []
+    if conn is None:
+        conn=db_provider.get()
+        cursor=conn.cursor(dictionary=True)
+    # Only today's windows can be requested, so anything that ended before today is dropped
+    live_matcher.expire(datetime.combine(today, time.min))
+    with span('db_query'):
+        cursor.execute(
+            """
+            INSERT INTO trips (profile_id, origin, destination, earliest, latest, fastest_seconds)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            (profile['id'], origin, dest, earliest, latest, fastest or 0)
+        )
+        trip_id = cursor.lastrowid
+        if runs:
+            record_trip_runs(conn, trip_id, runs)
+        conn.commit()
+    st.session_state.trip_id = trip_id
 
     with st.spinner('Matching riders...'):
-        matches = find_matches(
-            conn, trip_id,
-            origin, dest,
-            earliest, latest,
-            fastest, profile['interests'],
-            verbose=VERBOSE
-        )
-    if not matches: st.info('No rides found.')
-    else:
-        m=matches[0]
-        st.success('Matched!')
-        c=st.columns([1,3])
-        img = Image.open("pfp.jpeg")
-        c[0].image(img, width=80)
-        email = m['email']
-
-        if email == "admin@uchicago.edu" or email == "kyler@uchicago.edu":
-            email = "bstoller@uchicago.edu"
-        c[1].markdown(f"**{email}**")
-        common=set(profile['interests'].split(','))&set(m['interests'].split(','))
-        c[1].markdown(f"Shared: {', '.join(list(common)[:3])}")
-
-        if st.button("Contact the person"):
-            st.info("Calling email...")
-cursor.close()
-conn.close()
+        # Scores the new trip once and updates the riders it could join
+        with span('scoring'):
+            matches = live_matcher.add({
+                'id': trip_id, 'cand_origin': origin, 'cand_dest': dest,
+                'earliest': earliest, 'latest': latest, 'fastest_seconds': fastest or 0,
+                'email': st.session_state.email, 'interests': profile['interests']
+            })
+        if not live_matcher.ready:
+            # The first build is still loading open trips in the background
+            matches = find_matches(conn, trip_id, origin, dest, earliest, latest, fastest, profile['interests'])
+        if runs:
+            # Riders on the same trains; falls back to window matches when no trip shares a run
+            matches = find_run_matches(conn, trip_id, origin, dest, fastest, profile['interests'], runs) or matches
+        def rescore():
+            # The live matcher refills after a taken partner is evicted; once its cached partners are
+            # all gone, MySQL may still know open trips this process has not synced yet
+            return live_matcher.matches(trip_id) or find_matches(conn, trip_id, origin, dest, earliest, latest,
+                                                                 fastest, profile['interests'])
+        # Books the best partner no other session has taken yet; both trips then leave the pool
+        claimed = claim_best(conn, trip_id, matches, on_taken=live_matcher.remove, rescore=rescore)
+        if claimed:
+            live_matcher.remove(trip_id)
+            live_matcher.remove(claimed['trip_id'])
+        matches = [claimed] if claimed else []
+    with span('render'):
+        if not matches: st.info('No rides found.')
+        else:
+            m=matches[0]
+            st.success('Matched!')
+            c=st.columns([1,3])
+            c[0].image(load_avatar("pfp.jpeg"), width=80)
+            email = m['email']
+
+            if email == "admin@uchicago.edu" or email == "kyler@uchicago.edu":
+                email = "bstoller@uchicago.edu"
+            c[1].markdown(f"**{email}**")
+            common=set(profile['interests'].split(','))&set(m['interests'].split(','))
+            c[1].markdown(f"Shared: {', '.join(list(common)[:3])}")
+
+            if st.button("Contact the person"):
+                st.info("Calling email...")
+if conn is not None:
+    cursor.close()
+    conn.close()
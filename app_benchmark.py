@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Cold-start and rerun latency benchmark for the Streamlit app.
+
+Runs app.py headless (streamlit.testing AppTest) against the offline stand-ins: the SQLite store
+(sqlite_store.py) seeded with N synthetic riders in place of MySQL, and the fake CTA endpoint
+(fake_cta.py). Scenarios:
+
+  cold_start    a fresh Python process, from spawn to the first rendered planner page
+  rerun         a widget change on the planner page (Streamlit re-runs the whole script)
+  first_find    the first "Find Matches" of a server process: plans the trip with the CTA while the
+                live matcher may still be loading in the background (one run per benchmark)
+  find_matches  pressing "Find Matches" again for the same trip minute
+
+For each it reports p50/p99 latency and the database checkouts and CTA requests per run, and
+writes everything to a JSON file. As with benchmark.py, pass an earlier results file as
+--baseline; the exit status is 1 when a p50 regressed by more than --threshold.
+
+Usage:
+    python app_benchmark.py [--trips 5000] [--reruns 50] [--finds 20] [--cold-runs 5] [--seed 7]
+                            [--out app_benchmark.json] [--baseline old.json] [--threshold 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+ADMIN = 'admin@uchicago.edu'
+SECRETS = {
+    'mysql': {'host': 'localhost', 'user': 'bench', 'password': '', 'database': 'bench'},
+    'cta': {'api_key': 'bench'},
+    'email': {'sender_address': 'bench@uchicago.edu', 'sender_password': '', 'smtp_host': '127.0.0.1',
+              'smtp_port': 8025, 'smtp_ssl': False},
+}
+
+
+class SQLiteProvider:
+    """db.ConnectionProvider stand-in over one SQLite file; counts checkouts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.checkouts = 0
+
+    def get(self):
+        import sqlite_store
+        self.checkouts += 1
+        return sqlite_store.connect(self.path, timeout=30)
+
+
+def seed_database(path, trips, seed):
+    """Fresh SQLite file with `trips` riders departing today and a profile for the benchmark user."""
+    import sqlite_store
+    from benchmark import generate_riders
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    conn = sqlite_store.connect(path)
+    sqlite_store.insert_riders(conn, list(generate_riders(trips, seed, start=today, days=1)))
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO profiles (email, origin, destination, interests) VALUES (%s, %s, %s, %s)",
+                   (ADMIN, '', '', 'Food,Music,Tech'))
+    conn.commit()
+    conn.close()
+
+
+@contextmanager
+def offline_app(path, cta_url):
+    """Points db (MySQL) at the SQLite file and cta_api at `cta_url` while app.py runs in this process."""
+    import streamlit as st
+    import cta_api
+    import db
+    import sqlite_store
+    provider = SQLiteProvider(path)
+    saved = {name: getattr(db, name) for name in ('init_db', 'shared_provider', 'get_db_connection')}
+    saved_url = cta_api.CTA_URL
+    db.init_db = lambda _config: None
+    db.shared_provider = lambda _config: provider
+    # The live matcher syncs on its own thread; those connections are not checkouts of a request
+    db.get_db_connection = lambda _config: sqlite_store.connect(path, timeout=30)
+    cta_api.CTA_URL = cta_url
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    try:
+        yield provider
+    finally:
+        for name, value in saved.items():
+            setattr(db, name, value)
+        cta_api.CTA_URL = saved_url
+        cta_api.ARRIVALS_CACHE.invalidate()
+
+
+def new_session():
+    """A logged-in AppTest session for the benchmark user (the admin login skips email)."""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=120)
+    for section, values in SECRETS.items():
+        at.secrets[section] = values
+    at.session_state['email'] = ADMIN
+    at.session_state['logged_in'] = True
+    return at
+
+
+def _check(at):
+    if at.exception:
+        raise RuntimeError(f"app.py raised: {at.exception[0].value}")
+    return at
+
+
+def _summary(scenario, seconds, checkouts=None, cta_requests=None):
+    seconds = np.asarray(seconds)
+    out = {
+        'scenario': scenario,
+        'runs': len(seconds),
+        'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(seconds, 99)) * 1000, 2),
+        'mean_ms': round(float(seconds.mean()) * 1000, 2),
+    }
+    if checkouts is not None:
+        out['db_checkouts_per_run'] = round(checkouts / len(seconds), 2)
+        out['cta_requests_per_run'] = round(cta_requests / len(seconds), 2)
+    return out
+
+
+def bench_session(provider, fake, reruns=50, finds=20):
+    """rerun, first_find and find_matches results for one session."""
+    at = _check(new_session().run())
+    results = []
+
+    checkouts, requests = provider.checkouts, fake.requests
+    seconds = []
+    for i in range(reruns):
+        at.radio[0].set_value(['Depart by', 'Arrive by'][i % 2])
+        start = time.perf_counter()
+        _check(at.run())
+        seconds.append(time.perf_counter() - start)
+    results.append(_summary('rerun', seconds, provider.checkouts - checkouts, fake.requests - requests))
+
+    # The first press plans with the CTA (and may find the live matcher still loading); later ones reuse the plan
+    at.radio[0].set_value('Depart by')
+    find = next(b for b in at.button if b.label == 'Find Matches')
+    checkouts, requests = provider.checkouts, fake.requests
+    start = time.perf_counter()
+    _check(find.click().run())
+    results.append(_summary('first_find', [time.perf_counter() - start], provider.checkouts - checkouts,
+                            fake.requests - requests))
+    checkouts, requests = provider.checkouts, fake.requests
+    seconds = []
+    for _ in range(finds):
+        find = next(b for b in at.button if b.label == 'Find Matches')
+        start = time.perf_counter()
+        _check(find.click().run())
+        seconds.append(time.perf_counter() - start)
+    results.append(_summary('find_matches', seconds, provider.checkouts - checkouts, fake.requests - requests))
+    return results
+
+
+def cold_start(path, cta_url):
+    """Seconds from spawning a fresh interpreter to the first rendered planner page."""
+    spawned = time.time()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', path, cta_url],
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])['rendered'] - spawned
+
+
+def _child(path, cta_url):
+    with offline_app(path, cta_url):
+        _check(new_session().run())
+    print(json.dumps({'rendered': time.time()}))
+
+
+def run(trips=5000, reruns=50, finds=20, cold_runs=5, seed=7):
+    """All scenarios against a fresh seeded database. Returns the list of result dicts."""
+    from fake_cta import FakeCTA, FakeCTAServer
+    # A whole day of predictions, so any requested time of day finds a train
+    fake = FakeCTA(runs=300, horizon=24 * 3600)
+    with tempfile.TemporaryDirectory() as tmp, FakeCTAServer(fake) as server:
+        path = os.path.join(tmp, 'rides.db')
+        seed_database(path, trips, seed)
+        results = []
+        if cold_runs:
+            results.append(_summary('cold_start', [cold_start(path, server.url) for _ in range(cold_runs)]))
+        with offline_app(path, server.url) as provider:
+            results += bench_session(provider, fake, reruns, finds)
+    return results
+
+
+def compare(baseline, results, threshold=0.2):
+    """Returns (scenario, old p50, new p50) for scenarios whose p50 grew by more than `threshold`."""
+    old = {r['scenario']: r for r in baseline['results']}
+    return [(r['scenario'], old[r['scenario']]['p50_ms'], r['p50_ms']) for r in results['results']
+            if r['scenario'] in old and r['p50_ms'] > old[r['scenario']]['p50_ms'] * (1 + threshold)]
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        _child(sys.argv[2], sys.argv[3])
+        return
+    parser = argparse.ArgumentParser(description="Benchmark app.py cold start and rerun latency offline.")
+    parser.add_argument('--trips', type=int, default=5000, help='Synthetic open trips in the database')
+    parser.add_argument('--reruns', type=int, default=50, help='Planner-page reruns to time')
+    parser.add_argument('--finds', type=int, default=20, help='"Find Matches" presses to time')
+    parser.add_argument('--cold-runs', type=int, default=5, help='Fresh processes to time (0 skips)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', default='app_benchmark.json')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative p50 slowdown')
+    args = parser.parse_args()
+
+    from benchmark import _git_commit
+    results = {
+        'meta': {'commit': _git_commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'trips': args.trips, 'seed': args.seed},
+        'results': run(args.trips, args.reruns, args.finds, args.cold_runs, args.seed),
+    }
+    for r in results['results']:
+        extra = (f" db={r['db_checkouts_per_run']:.2f}/run cta={r['cta_requests_per_run']:.2f}/run"
+                 if 'db_checkouts_per_run' in r else "")
+        print(f"{r['scenario']:12s} p50={r['p50_ms']:.1f}ms p99={r['p99_ms']:.1f}ms ({r['runs']} runs){extra}")
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for scenario, before, after in regressions:
+            print(f"REGRESSION {scenario}: p50 {before:.1f}ms -> {after:.1f}ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import threading
+import time
+
+
+class _Flight:
+    """One upstream fetch that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ArrivalsCache:
+    """
+    Shared TTL cache for CTA arrivals keyed by station map_id.
+
+    - Fresh entries (younger than ttl) are served directly.
+    - Stale entries (up to ttl + stale_ttl old) are served immediately while one background
+      refresh runs (stale-while-revalidate).
+    - Concurrent misses for the same key are coalesced into a single upstream call.
+    - A fetch that returns None is treated as a failure and never cached.
+
+    Counters (hits, stale_hits, misses, coalesced, refreshes, errors, fetches, fetch latency)
+    are available from stats().
+    """
+
+    def __init__(self, ttl=20.0, stale_ttl=60.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0,
+                          'refreshes': 0, 'errors': 0, 'fetches': 0}
+        self._fetch_seconds = 0.0
+        self._fetch_max = 0.0
+
+    def get(self, key, fetch):
+        """
+        Returns the cached value for `key`, calling `fetch()` (a zero-argument callable) on a miss.
+        Returns None if the value is not cached and the fetch failed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            age = self.clock() - entry[1] if entry else None
+            if entry and age < self.ttl:
+                self._counters['hits'] += 1
+                return entry[0]
+            if entry and age < self.ttl + self.stale_ttl:
+                self._counters['stale_hits'] += 1
+                if key not in self._inflight:
+                    self._counters['refreshes'] += 1
+                    flight = self._inflight[key] = _Flight()
+                    threading.Thread(target=self._run, args=(key, fetch, flight), daemon=True).start()
+                return entry[0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._counters['misses'] += 1
+            else:
+                self._counters['coalesced'] += 1
+        if leader:
+            self._run(key, fetch, flight)
+        else:
+            flight.done.wait()
+        return flight.value
+
+    def put(self, key, value):
+        """Stores a value fetched elsewhere (e.g. by a background poller)."""
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+
+    def peek(self, key):
+        """Last stored value for `key` regardless of age, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Snapshot of hit/miss counters and upstream latency (seconds)."""
+        with self._lock:
+            out = dict(self._counters)
+            out['entries'] = len(self._entries)
+            out['fetch_seconds_total'] = self._fetch_seconds
+            out['fetch_seconds_max'] = self._fetch_max
+            out['fetch_seconds_avg'] = self._fetch_seconds / out['fetches'] if out['fetches'] else 0.0
+            lookups = out['hits'] + out['stale_hits'] + out['misses'] + out['coalesced']
+            out['hit_ratio'] = (out['hits'] + out['stale_hits']) / lookups if lookups else 0.0
+        return out
+
+    def _run(self, key, fetch, flight):
+        start = time.perf_counter()
+        value = None
+        try:
+            value = fetch()
+        except Exception:
+            value = None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._counters['fetches'] += 1
+            self._fetch_seconds += elapsed
+            self._fetch_max = max(self._fetch_max, elapsed)
+            if value is None:
+                self._counters['errors'] += 1
+            else:
+                self._entries[key] = (value, self.clock())
+            self._inflight.pop(key, None)
+        flight.value = value if value is not None else self._stale_value(key)
+        flight.done.set()
+
+    def _stale_value(self, key):
+        """Value to hand back after a failed fetch: whatever is still within the stale window."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self.clock() - entry[1] < self.ttl + self.stale_ttl:
+                return entry[0]
+        return None
@@ -0,0 +1,288 @@
+"""
+Global batch matching: pairs every unmatched trip in a departure window so that the total
+match score is maximised and no rider is promised to more than one partner.
+
+Usable from cli_match.py (--batch) or from a scheduler via run_batch().
+"""
+import time as _time
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+from matching import lock_open_trips
+from network import NETWORK
+from scoring import CandidateBatch, pair_scores
+
+# Upper bound on pairs scored at once while sweeping, to keep memory flat for dense windows
+PAIR_CHUNK = 2_000_000
+# Integer resolution of edge weights handed to the assignment solver
+COST_SCALE = 1_000_000_000
+# Default per-trip edge cap for batch runs; bounds the solver input on dense windows
+MAX_DEGREE = 10
+
+# Open trips of one batch window (parameters: window end, window start); migrations.check_query_plans
+# EXPLAINs this same statement
+OPEN_TRIPS_SQL = """
+    SELECT t.id,
+           t.origin AS cand_origin, t.destination AS cand_dest,
+           t.earliest, t.latest, t.fastest_seconds,
+           p.email, p.interests
+    FROM trips t
+    JOIN profiles p ON t.profile_id = p.id
+    WHERE t.matched = FALSE
+      AND t.earliest < %s
+      AND t.latest > %s
+    ORDER BY t.earliest, t.id
+"""
+
+
+def fetch_open_trips(db_conn, window_start, window_end):
+    """All unmatched trips whose window intersects [window_start, window_end], oldest first."""
+    cursor = db_conn.cursor(dictionary=True)
+    cursor.execute(OPEN_TRIPS_SQL, (window_end, window_start))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def candidate_pairs(batch, max_degree=None):
+    """
+    Builds the compatibility graph with sort-and-sweep on window start.
+
+    After sorting by start, trip p can only overlap the trips whose start falls before p's end, which
+    is a contiguous run found with one binary search. Only those pairs are scored, so the cost follows
+    the number of overlapping pairs rather than n^2.
+
+    Parameters:
+      batch: CandidateBatch of open trips (built with the network so routes are checked)
+      max_degree: if set, keep only each trip's best max_degree edges (an edge survives if either
+                  endpoint ranks it), which bounds the graph handed to the solver
+
+    Returns:
+      (a, b, w): int64 row indices into the batch and float64 positive scores, one entry per edge
+    """
+    n = len(batch)
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    order = np.argsort(batch.start, kind='stable')
+    starts = batch.start[order]
+    ends = batch.end[order]
+    # Sweep limit: first sorted position whose start is not before p's end
+    hi = np.searchsorted(starts, ends, side='left')
+    counts = np.maximum(hi - np.arange(n) - 1, 0)
+    sizes = batch.sizes
+
+    a_out, b_out, w_out = [], [], []
+    p = 0
+    while p < n:
+        # Grow the chunk of sweep positions until it holds about PAIR_CHUNK pairs
+        q, total = p, 0
+        while q < n and (total == 0 or total + counts[q] <= PAIR_CHUNK):
+            total += counts[q]
+            q += 1
+        c = counts[p:q]
+        if total:
+            left = np.repeat(np.arange(p, q), c)
+            # Offsets 1..count within each run, vectorized
+            run_starts = np.repeat(np.cumsum(c) - c, c)
+            right = left + 1 + (np.arange(total) - run_starts)
+            a, b = order[left], order[right]
+            res = pair_scores(batch, a, b, sizes=sizes)
+            keep = res['valid'] & (res['score'] > 0)
+            a_out.append(a[keep]); b_out.append(b[keep]); w_out.append(res['score'][keep])
+        p = q
+
+    a = np.concatenate(a_out) if a_out else np.zeros(0, dtype=np.int64)
+    b = np.concatenate(b_out) if b_out else np.zeros(0, dtype=np.int64)
+    w = np.concatenate(w_out) if w_out else np.zeros(0)
+    if max_degree is not None and len(w):
+        a, b, w = _prune_degree(n, a, b, w, max_degree)
+    return a, b, w
+
+
+def _prune_degree(n, a, b, w, max_degree):
+    """Keeps each edge that is among the max_degree heaviest edges of at least one endpoint."""
+    m = len(w)
+    by_weight = np.argsort(-w)
+    # Interleave both endpoints so slot order is weight order for every trip
+    ends = np.empty(2 * m, dtype=np.int64)
+    ends[0::2], ends[1::2] = a[by_weight], b[by_weight]
+    slots = np.arange(2 * m)
+    # Group edge slots by endpoint with a linear-time CSR build; slots stay heaviest-first per trip
+    grouped = coo_matrix((np.ones(2 * m, dtype=np.int8), (ends, slots)), shape=(n, 2 * m)).tocsr()
+    grouped.sort_indices()
+    per_trip = np.diff(grouped.indptr)
+    rank = slots - np.repeat(grouped.indptr[:-1], per_trip)
+    top = grouped.indices[rank < max_degree]
+    keep = np.zeros(m, dtype=bool)
+    keep[by_weight[top // 2]] = True
+    return a[keep], b[keep], w[keep]
+
+
+def solve_matching(n, a, b, w):
+    """
+    Max-weight matching on the compatibility graph.
+
+    The graph is solved as a sparse assignment problem (scipy's LAPJVsp) on the symmetric weight
+    matrix, with a zero-weight self-loop on every trip so staying unmatched is always feasible. That is the
+    standard relaxation of general matching: its optimum is a set of disjoint cycles whose weight is
+    an upper bound. Two-cycles are matches as they stand; longer cycles are rounded to their best
+    alternating edge set, and any riders left free are then paired greedily on the remaining edges.
+    When the relaxation is integral (the common case here) the result is an exact optimum.
+
+    Returns:
+      list of (i, j) index pairs with i < j
+    """
+    if len(w) == 0:
+        return []
+    weight = {}
+    for i, j, s in zip(a.tolist(), b.tolist(), w.tolist()):
+        key = (i, j) if i < j else (j, i)
+        if s > weight.get(key, 0):
+            weight[key] = s
+
+    # Every row is assigned exactly once, so maximising sum(w) is minimising sum(top - w). Costs are
+    # quantised to integers: LAPJVsp can fail to terminate on large float instances with near-ties.
+    quantised = np.rint(w / w.max() * COST_SCALE).astype(np.int64) + 1
+    top = int(quantised.max()) + 1
+    diag = np.arange(n)
+    rows = np.concatenate([a, b, diag])
+    cols = np.concatenate([b, a, diag])
+    data = np.concatenate([top - quantised, top - quantised, np.full(n, top, dtype=np.int64)])
+    graph = coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+    _, perm = min_weight_full_bipartite_matching(graph)
+
+    def edge(i, j):
+        return weight.get((i, j) if i < j else (j, i), 0)
+
+    pairs = []
+    seen = np.zeros(n, dtype=bool)
+    for s in range(n):
+        if seen[s]:
+            continue
+        cycle = [s]
+        seen[s] = True
+        nxt = perm[s]
+        while not seen[nxt]:
+            cycle.append(nxt)
+            seen[nxt] = True
+            nxt = perm[nxt]
+        size = len(cycle)
+        if size == 2:
+            pairs.append(tuple(sorted(cycle)))
+        elif size > 2:
+            # Best alternating edge set around the cycle; odd cycles leave one rider out
+            best, best_w = [], 0
+            for r in (range(2) if size % 2 == 0 else range(size)):
+                chosen = [(cycle[(r + 2 * t) % size], cycle[(r + 2 * t + 1) % size]) for t in range(size // 2)]
+                total = sum(edge(i, j) for i, j in chosen)
+                if total > best_w:
+                    best, best_w = chosen, total
+            pairs.extend(tuple(sorted(p)) for p in best if edge(*p) > 0)
+
+    # Greedy fill for riders the rounding left free
+    used = np.zeros(n, dtype=bool)
+    for i, j in pairs:
+        used[i] = used[j] = True
+    for (i, j), _ in sorted(weight.items(), key=lambda kv: kv[1], reverse=True):
+        if not used[i] and not used[j]:
+            pairs.append((i, j))
+            used[i] = used[j] = True
+    return pairs
+
+
+def write_matches(db_conn, results):
+    """
+    Records every match and flags both trips as matched in a single transaction.
+
+    Trips are locked first with SKIP LOCKED (matching.lock_open_trips); a match whose trip was
+    claimed or is being claimed by another worker meanwhile is dropped, so parallel workers never
+    double-book a rider.
+
+    results: list of dicts with keys trip_a, trip_b, departure, arrival, score
+    Returns the number of matches written.
+    """
+    if not results:
+        return 0
+    cursor = db_conn.cursor()
+    try:
+        open_ids = lock_open_trips(cursor, [tid for r in results for tid in (r['trip_a'], r['trip_b'])])
+        results = [r for r in results if r['trip_a'] in open_ids and r['trip_b'] in open_ids]
+        if not results:
+            db_conn.rollback()
+            return 0
+        cursor.executemany(
+            "INSERT INTO matches (trip_a, trip_b, departure, arrival, score) VALUES (%s, %s, %s, %s, %s)",
+            [(r['trip_a'], r['trip_b'], r['departure'], r['arrival'], r['score']) for r in results]
+        )
+        cursor.executemany(
+            "UPDATE trips SET matched = TRUE WHERE id = %s",
+            [(tid,) for r in results for tid in (r['trip_a'], r['trip_b'])]
+        )
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(results)
+
+
+def match_trips(trips, max_degree=None, stats=None):
+    """
+    Computes the global matching for a list of open-trip rows (the fetch_open_trips shape).
+
+    Returns:
+      list of dicts with keys trip_a, trip_b, departure, arrival, score, highest score first
+    """
+    batch = CandidateBatch(trips, network=NETWORK)
+    a, b, w = candidate_pairs(batch, max_degree=max_degree)
+    if stats is not None:
+        stats['edges'] = len(w)
+    pairs = solve_matching(len(trips), a, b, w)
+    if not pairs:
+        return []
+    left = np.array([i for i, _ in pairs]); right = np.array([j for _, j in pairs])
+    scores = pair_scores(batch, left, right)['score']
+    results = []
+    for (i, j), score in zip(pairs, scores.tolist()):
+        ti, tj = trips[i], trips[j]
+        results.append({
+            'trip_a': ti['id'],
+            'trip_b': tj['id'],
+            'departure': max(ti['earliest'], tj['earliest']),
+            'arrival': min(ti['latest'], tj['latest']),
+            'score': score
+        })
+    results.sort(key=lambda r: r['score'], reverse=True)
+    return results
+
+
+def run_batch(db_conn, window_start=None, window_end=None, max_degree=None, dry_run=False):
+    """
+    Matches every unmatched trip departing in [window_start, window_end] and writes the results.
+
+    Defaults to the next 30 minutes, so a scheduler can simply call run_batch(conn) on a timer.
+
+    Returns:
+      summary dict: trips, edges, matches, written (0 on a dry run), total_score, matched (list of
+      result dicts), seconds
+    """
+    window_start = window_start or datetime.now()
+    window_end = window_end or window_start + timedelta(minutes=30)
+    t0 = _time.perf_counter()
+    trips = fetch_open_trips(db_conn, window_start, window_end)
+    stats = {'edges': 0}
+    results = match_trips(trips, max_degree=max_degree, stats=stats)
+    written = 0 if dry_run else write_matches(db_conn, results)
+    return {
+        'trips': len(trips),
+        'edges': stats['edges'],
+        'matches': len(results),
+        'written': written,
+        'total_score': sum(r['score'] for r in results),
+        'matched': results,
+        'seconds': _time.perf_counter() - t0,
+    }
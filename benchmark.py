@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Synthetic-load benchmark for the matching path.
+
+Fills an in-process backend with N seeded synthetic open trips and times single-rider match
+requests against it:
+
+  sqlite  find_matches over the SQLite stand-in (sqlite_store.py), same SQL as MySQL
+  index   find_matches served by the resident OpenTripIndex
+  cli     cli_match.fetch_candidates + score_candidates over SQLite
+
+For every backend and size it reports p50/p99 latency, the Python heap peak during a request
+(tracemalloc) and rows fetched per request, and writes everything to a JSON file. Pass an
+earlier results file as --baseline to compare; the exit status is 1 when a p50 regressed by
+more than --threshold.
+
+Usage:
+    python benchmark.py [--sizes 1000,10000,100000,1000000] [--requests 200] [--backends sqlite,index,cli]
+                        [--seed 7] [--network] [--out benchmark_results.json] [--baseline old.json]
+                        [--threshold 0.2]
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+
+import sqlite_store
+from cli_match import fetch_candidates, score_candidates
+from matching import STATION_LIST, find_matches
+from network import HOP_SECONDS, NETWORK
+from topics import TOPICS
+from trip_index import OpenTripIndex
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BACKENDS = ['sqlite', 'index', 'cli']
+# Relative popularity of each station for UChicago riders (Garfield is the campus stop)
+STATION_WEIGHTS = {'Howard': 3, 'Belmont': 3, 'Fullerton': 3, 'Chicago': 4, 'Grand': 3, 'Monroe': 4, 'Jackson': 5,
+                   'Roosevelt': 4, 'Sox-35th': 2, 'Garfield': 8, '63rd': 2, '95th/Dan Ryan': 3}
+# Departure-time mixture: (weight, mean hour, sd hours)
+DEPARTURE_PEAKS = [(0.4, 8.5, 1.0), (0.4, 17.5, 1.25), (0.2, 13.0, 3.0)]
+INSERT_CHUNK = 50_000
+MEMORY_SAMPLES = 20
+
+
+def generate_riders(n, seed=7, start=datetime(2025, 4, 28), days=7, stations=STATION_LIST):
+    """
+    Yields n synthetic riders with trips over `days` days from `start`: origins/destinations weighted
+    towards busy stations, 15-minute windows around the commute peaks, and 1-4 Zipf-weighted topics.
+    Stations are the Red Line's by default; pass NETWORK.names for riders across every 'L' line.
+    """
+    rng = random.Random(seed)
+    stations = list(stations)
+    weights = [STATION_WEIGHTS.get(s, 1) for s in stations]
+    topic_weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    peaks = [p[0] for p in DEPARTURE_PEAKS]
+    for i in range(n):
+        origin, destination = rng.choices(stations, weights, k=2)
+        while destination == origin:
+            destination = rng.choices(stations, weights)[0]
+        _, mean, sd = rng.choices(DEPARTURE_PEAKS, peaks)[0]
+        hour = min(max(rng.gauss(mean, sd), 5.0), 23.5)
+        earliest = (start + timedelta(days=rng.randrange(days), hours=hour)).replace(second=0, microsecond=0)
+        hops = len(NETWORK.route_edges(origin, destination))
+        topics = set(rng.choices(TOPICS, topic_weights, k=rng.randint(1, 4)))
+        yield {
+            'email': f"rider{seed}-{i}@uchicago.edu",
+            'origin': origin,
+            'destination': destination,
+            'interests': ",".join(sorted(topics)),
+            'earliest': earliest,
+            'latest': earliest + timedelta(minutes=15),
+            'fastest_seconds': max(60, int(hops * HOP_SECONDS + rng.gauss(60, 20))),
+        }
+
+
+class _CountingIndex:
+    """OpenTripIndex proxy that records how many candidate rows each lookup returned."""
+
+    def __init__(self, index):
+        self.index = index
+        self.rows = 0
+
+    def candidates(self, *args):
+        rows = self.index.candidates(*args)
+        self.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+def build_backend(backend, n, seed, stations=STATION_LIST):
+    """Loads n riders into a fresh backend; returns (state, seconds)."""
+    start = time.perf_counter()
+    riders = generate_riders(n, seed, stations=stations)
+    if backend == 'index':
+        index = OpenTripIndex()
+        for trip_id, r in enumerate(riders, 1):
+            index.add({'id': trip_id, 'cand_origin': r['origin'], 'cand_dest': r['destination'],
+                       'earliest': r['earliest'], 'latest': r['latest'],
+                       'fastest_seconds': r['fastest_seconds'], 'email': r['email'], 'interests': r['interests']})
+        state = _CountingIndex(index)
+    else:
+        state = sqlite_store.connect()
+        while True:
+            chunk = list(islice(riders, INSERT_CHUNK))
+            if not chunk:
+                break
+            sqlite_store.insert_riders(state, chunk)
+    return state, time.perf_counter() - start
+
+
+def run_request(backend, state, rider):
+    """One match request for `rider` (not itself stored; trip id 0). Returns the number of matches."""
+    if backend == 'cli':
+        cursor = state.cursor(dictionary=True)
+        candidates = fetch_candidates(cursor, 0, rider['origin'], rider['destination'],
+                                      rider['earliest'], rider['latest'])
+        cursor.close()
+        return len(score_candidates(candidates, rider['earliest'], rider['latest'],
+                                    rider['fastest_seconds'], rider['interests']))
+    db_conn, index = (None, state) if backend == 'index' else (state, None)
+    return len(find_matches(db_conn, 0, rider['origin'], rider['destination'], rider['earliest'], rider['latest'],
+                            rider['fastest_seconds'], rider['interests'], index=index))
+
+
+def cli_queries(conn, queries, seed):
+    """
+    The CLI path only looks at riders whose profile has exactly the same origin and destination,
+    which random stations almost never share with a stored rider. Each query takes the profile
+    stations and the window (shifted by up to 10 minutes) of one stored rider instead.
+    """
+    rng = random.Random(seed + 2)
+    # Read on the raw connection so the lookup is not counted as rows fetched by the requests
+    stored = conn.raw.execute(
+        "SELECT p.origin, p.destination, t.earliest FROM trips t JOIN profiles p ON t.profile_id = p.id "
+        "ORDER BY t.id").fetchall()
+    out = []
+    for rider in queries:
+        origin, destination, earliest = rng.choice(stored)
+        earliest += timedelta(minutes=rng.randint(-10, 10))
+        out.append(dict(rider, origin=origin, destination=destination, earliest=earliest,
+                        latest=earliest + (rider['latest'] - rider['earliest'])))
+    return out
+
+
+def _rows(state):
+    return state.rows if isinstance(state, _CountingIndex) else state.rows_fetched
+
+
+def bench(backend, n, requests=200, seed=7, stations=STATION_LIST):
+    """Times `requests` match requests against `n` open trips. Returns one result dict."""
+    state, load_seconds = build_backend(backend, n, seed, stations)
+    queries = list(generate_riders(requests, seed + 1, stations=stations))
+    if backend == 'cli':
+        queries = cli_queries(state, queries, seed)
+    run_request(backend, state, queries[0])   # warm caches (prepared statements, imports)
+
+    rows_before = _rows(state)
+    latencies = np.empty(len(queries))
+    matched = 0
+    for i, rider in enumerate(queries):
+        start = time.perf_counter()
+        matched += run_request(backend, state, rider) > 0
+        latencies[i] = time.perf_counter() - start
+    rows = _rows(state) - rows_before
+
+    # Heap peak measured separately: tracemalloc slows allocation-heavy code down
+    peak = 0
+    for rider in queries[:MEMORY_SAMPLES]:
+        tracemalloc.start()
+        run_request(backend, state, rider)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    if backend != 'index':
+        state.close()
+    return {
+        'backend': backend,
+        'trips': n,
+        'requests': len(queries),
+        'load_seconds': round(load_seconds, 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        'mean_ms': round(float(latencies.mean()) * 1000, 3),
+        'rows_per_request': round(rows / len(queries), 1),
+        'peak_request_mb': round(peak / 2**20, 2),
+        'matched_fraction': round(matched / len(queries), 3),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, threshold=0.2):
+    """Returns (backend, trips, old p50, new p50) for results whose p50 grew by more than `threshold`."""
+    old = {(r['backend'], r['trips']): r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        before = old.get((r['backend'], r['trips']))
+        if before and r['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append((r['backend'], r['trips'], before['p50_ms'], r['p50_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matching path on synthetic open trips.")
+    parser.add_argument('--sizes', default=",".join(map(str, DEFAULT_SIZES)), help='Comma-separated trip counts')
+    parser.add_argument('--requests', type=int, default=200, help='Match requests per backend and size')
+    parser.add_argument('--backends', default=",".join(BACKENDS), help=f"Subset of {','.join(BACKENDS)}")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--network', action='store_true', help="Riders across every 'L' line, not just the Red Line")
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative p50 slowdown')
+    args = parser.parse_args()
+
+    backends = [b for b in args.backends.split(',') if b]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backend(s): {', '.join(sorted(unknown))}")
+
+    results = {
+        'meta': {'commit': _git_commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'numpy': np.__version__, 'sqlite': sqlite_store.sqlite3.sqlite_version,
+                 'seed': args.seed, 'requests': args.requests, 'network': args.network},
+        'results': [],
+    }
+    for n in (int(s) for s in args.sizes.split(',') if s):
+        for backend in backends:
+            r = bench(backend, n, args.requests, args.seed, NETWORK.names if args.network else STATION_LIST)
+            results['results'].append(r)
+            print(f"{backend:6s} {n:>9,d} trips: p50={r['p50_ms']:.2f}ms p99={r['p99_ms']:.2f}ms "
+                  f"rows/req={r['rows_per_request']:.0f} peak={r['peak_request_mb']:.1f}MB "
+                  f"(load {r['load_seconds']:.1f}s)")
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for backend, n, before, after in regressions:
+            print(f"REGRESSION {backend} @ {n:,d} trips: p50 {before:.2f}ms -> {after:.2f}ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
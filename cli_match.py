@@ -6,26 +6,50 @@ Usage:
        --origin Howard --destination "Bryn Mawr" \
        --interests Food,Music,Tech \
        [--earliest 2025-04-26T08:00] [--latest 2025-04-26T08:30]
+
+Batch mode (e.g. from cron) matches every unmatched trip in the window at once:
+  python cli_match.py --batch [--earliest ...] [--latest ...] [--dry-run]
+  python cli_match.py --batch --group-size 4 ...   # parties of up to 4 instead of pairs
+
+Bulk mode imports ride requests from a JSONL file ('-' for stdin), one object per line:
+  {"email": "alice@uchicago.edu", "origin": "Howard", "destination": "Garfield",
+   "interests": "Food,Music", "earliest": "2025-04-26T08:00", "latest": "2025-04-26T08:15"}
+  python cli_match.py --bulk rides.jsonl [--chunk-size 5000] [--match [--max-degree N] [--dry-run]]
+
+Any mode takes --profile (per-stage wall/CPU breakdown on stderr) with --trace FILE.json and
+--cprofile FILE.prof to keep it; --record-cta FILE saves the CTA responses, and --replay-cta FILE
+reruns against them offline at the recorded time:
+  python cli_match.py --email ... --profile --record-cta cta.json --trace before.json
+  python cli_match.py --email ... --profile --replay-cta cta.json --trace after.json
+  python profiler.py diff before.json after.json
 """
 import os
+import sys
+import json
+import time
 import argparse
+import logging
+from contextlib import nullcontext
 from datetime import datetime, timedelta
+from itertools import islice
 from dotenv import load_dotenv
-import mysql.connector
-from math import sqrt
-from cta_api import compute_fastest
+import db
+import cta_api
+from cta_api import central, compute_fastest
+from metrics import configure_logging, span
+from profiler import CTARecording, Profiler
+from topics import interest_mask, is_canonical
+from scoring import CandidateBatch, score_batch, top_k, SKIP_NONE
+from batch_match import run_batch, MAX_DEGREE
+from group_match import run_groups
 
 # Load environment variables from .env
 load_dotenv()
 
 # DB connection helper
 def get_db_connection():
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_NAME')
-    )
+    # Pooled, validated connection shared with the app (see db.py)
+    return db.get_db_connection(db.config_from_env())
 
 # Fetch existing profiles or create new one
 def ensure_profile(cursor, email, origin, destination, interests):
@@ -51,19 +75,22 @@ def ensure_profile(cursor, email, origin, destination, interests):
     return pid
 
 # Insert a trip request
-def insert_trip(cursor, profile_id, earliest, latest, fastest_seconds):
+def insert_trip(cursor, profile_id, origin, destination, earliest, latest, fastest_seconds):
     cursor.execute(
-        "INSERT INTO trips (profile_id, earliest, latest, fastest_seconds) VALUES (%s,%s,%s,%s)",
-        (profile_id, earliest, latest, fastest_seconds)
+        "INSERT INTO trips (profile_id, origin, destination, earliest, latest, fastest_seconds) "
+        "VALUES (%s,%s,%s,%s,%s,%s)",
+        (profile_id, origin, destination, earliest, latest, fastest_seconds)
     )
     tid = cursor.lastrowid
     print(f"Inserted trip (ID {tid}): earliest={earliest}, latest={latest}, fastest={fastest_seconds}s")
     return tid
 
 # Fetch candidate trips for matching
-def fetch_candidates(cursor, trip_id, origin, destination, earliest, latest):
+# (shared_mask: only candidates sharing a registry topic with this interest bitmask)
+def fetch_candidates(cursor, trip_id, origin, destination, earliest, latest, shared_mask=None):
+    shared = "AND BIT_COUNT(p.interest_mask & %s) > 0" if shared_mask is not None else ""
     cursor.execute(
-        """
+        f"""
         SELECT t.id, t.earliest, t.latest, t.fastest_seconds, p.email, p.interests
         FROM trips t JOIN profiles p ON t.profile_id = p.id
         WHERE t.matched = FALSE
@@ -72,81 +99,210 @@ def fetch_candidates(cursor, trip_id, origin, destination, earliest, latest):
           AND p.destination = %s
           AND t.earliest < %s
           AND t.latest > %s
+          {shared}
         """,
-        (trip_id, origin, destination, latest, earliest)
+        (trip_id, origin, destination, latest, earliest) + ((shared_mask,) if shared_mask is not None else ())
     )
     return cursor.fetchall()
 
-# Compute similarity metrics and score
-def compute_metrics(candidate, origin_earliest, origin_latest, origin_fastest, origin_interests):
-    b_earliest = candidate['earliest']
-    b_latest = candidate['latest']
-    overlap = min(origin_latest, b_latest) - max(origin_earliest, b_earliest)
-    overlap_sec = overlap.total_seconds()
-    if overlap_sec <= 0:
-        return None
-    closeness = overlap_sec / max(origin_fastest, candidate['fastest_seconds'])
-    set_a = set(origin_interests.split(','))
-    set_b = set(candidate['interests'].split(','))
-    sim = (len(set_a & set_b) / sqrt(len(set_a) * len(set_b))) if set_a and set_b else 0
-    score = overlap_sec * closeness * sim
-    return {
-        'email': candidate['email'],
-        'overlap_s': overlap_sec,
-        'closeness': closeness,
-        'similarity': sim,
-        'score': score,
-        'departure': max(origin_earliest, b_earliest),
-        'arrival': min(origin_latest, b_latest),
-    }
+# Bulk ingestion: requests per executemany transaction
+BULK_CHUNK = 5000
+# fastest_seconds is looked up once per (origin, destination, departure bucket)
+FASTEST_BUCKET = timedelta(minutes=15)
+# Train Tracker only predicts about half an hour ahead; later departures use the offline estimate
+LIVE_HORIZON = timedelta(minutes=30)
 
-# Main CLI
-def main():
-    parser = argparse.ArgumentParser(description="Test CTA rider matching logic.")
-    parser.add_argument('--email', required=True, help='User email')
-    parser.add_argument('--origin', required=True, help='Origin station')
-    parser.add_argument('--destination', required=True, help='Destination station')
-    parser.add_argument('--interests', required=True, help='Comma-separated interests')
-    parser.add_argument('--earliest', help='Earliest departure (YYYY-MM-DDTHH:MM)', default=None)
-    parser.add_argument('--latest', help='Latest arrival   (YYYY-MM-DDTHH:MM)', default=None)
-    args = parser.parse_args()
+# Parse ride requests from JSONL lines, skipping (and reporting) malformed ones
+def read_requests(lines):
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            req = json.loads(line)
+            missing = [k for k in ('email', 'origin', 'destination') if not req.get(k)]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            interests = req.get('interests') or ''
+            if isinstance(interests, list):
+                interests = ','.join(interests)
+            earliest = datetime.fromisoformat(req['earliest']) if req.get('earliest') else datetime.now()
+            latest = datetime.fromisoformat(req['latest']) if req.get('latest') else earliest + timedelta(minutes=30)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Skipping line {lineno}: {e}", file=sys.stderr)
+            continue
+        yield {'email': req['email'], 'origin': req['origin'], 'destination': req['destination'],
+               'interests': interests, 'earliest': earliest, 'latest': latest}
 
-    # Parse times
-    now = datetime.now()
-    origin_earliest = datetime.fromisoformat(args.earliest) if args.earliest else now
-    origin_latest = datetime.fromisoformat(args.latest) if args.latest else origin_earliest + timedelta(minutes=30)
+# fastest_seconds for a departure, memoised per time bucket
+def bucket_fastest(memo, origin, destination, when, api_key, now):
+    bucket = datetime.min + (when - datetime.min) // FASTEST_BUCKET * FASTEST_BUCKET
+    key = (origin, destination, bucket)
+    if key not in memo:
+        memo[key] = compute_fastest(origin, destination, api_key, bucket,
+                                    estimate_only=bucket > now + LIVE_HORIZON)[0]
+    return memo[key]
 
-    # Compute fastest travel
-    fastest_s, dep_time, arr_time = compute_fastest(
-        args.origin, args.destination, os.getenv('CTA_API_KEY')
+# Insert one chunk of requests: missing profiles, then every trip, each as one executemany
+def ingest_chunk(cursor, chunk):
+    def profile_ids(emails):
+        cursor.execute(f"SELECT id, email FROM profiles WHERE email IN ({','.join(['%s'] * len(emails))})",
+                       emails)
+        return {row['email']: row['id'] for row in cursor.fetchall()}
+
+    ids = profile_ids(list({r['email'] for r in chunk}))
+    new = {}
+    for r in chunk:
+        # Like ensure_profile: existing profiles are reused, new ones take the first request's details
+        if r['email'] not in ids:
+            new.setdefault(r['email'], r)
+    if new:
+        cursor.executemany(
+            "INSERT INTO profiles (email, origin, destination, interests) VALUES (%s,%s,%s,%s)",
+            [(r['email'], r['origin'], r['destination'], r['interests']) for r in new.values()]
+        )
+        ids.update(profile_ids(list(new)))
+    cursor.executemany(
+        "INSERT INTO trips (profile_id, origin, destination, earliest, latest, fastest_seconds) "
+        "VALUES (%s,%s,%s,%s,%s,%s)",
+        [(ids[r['email']], r['origin'], r['destination'], r['earliest'], r['latest'], r['fastest_seconds'])
+         for r in chunk]
     )
+    return len(new)
+
+# Stream requests into the database in chunked transactions; returns import stats
+def ingest_requests(conn, requests, api_key, chunk_size=BULK_CHUNK, now=None):
+    now = now or datetime.now()
+    memo = {}
+    stats = {'requests': 0, 'profiles_created': 0, 'fastest_lookups': 0, 'earliest': None, 'latest': None}
+    requests = iter(requests)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        while True:
+            chunk = list(islice(requests, chunk_size))
+            if not chunk:
+                break
+            for r in chunk:
+                r['fastest_seconds'] = bucket_fastest(memo, r['origin'], r['destination'], r['earliest'],
+                                                      api_key, now) or 0
+            try:
+                stats['profiles_created'] += ingest_chunk(cursor, chunk)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            stats['requests'] += len(chunk)
+            first = min(r['earliest'] for r in chunk)
+            last = max(r['latest'] for r in chunk)
+            stats['earliest'] = min(stats['earliest'] or first, first)
+            stats['latest'] = max(stats['latest'] or last, last)
+    finally:
+        cursor.close()
+    stats['fastest_lookups'] = len(memo)
+    return stats
+
+# Bulk mode: import a JSONL file (or stdin), optionally batch-match the imported window
+def run_bulk_mode(path, chunk_size, match, max_degree, dry_run):
+    # One line per lookup would drown the import summary
+    logging.getLogger('cta_api').setLevel(logging.WARNING)
+    start = time.perf_counter()
+    stream = sys.stdin if path == '-' else open(path)
+    conn = get_db_connection()
+    try:
+        stats = ingest_requests(conn, read_requests(stream), os.getenv('CTA_API_KEY'), chunk_size)
+    finally:
+        conn.close()
+        if stream is not sys.stdin:
+            stream.close()
+    print(f"Imported {stats['requests']} ride requests ({stats['profiles_created']} new profiles, "
+          f"{stats['fastest_lookups']} travel-time lookups) in {time.perf_counter() - start:.2f}s")
+    if match and stats['requests']:
+        run_batch_mode(stats['earliest'], stats['latest'], max_degree, dry_run)
+
+# Compute similarity metrics and scores for all candidates at once
+def score_candidates(candidates, origin_earliest, origin_latest, origin_fastest, origin_interests, k=5):
+    # Interests are tokenized exactly as in find_matches, so both paths score a pair the same way
+    batch = CandidateBatch(candidates)
+    res = score_batch(batch, origin_earliest, origin_latest, origin_fastest, origin_interests,
+                      require_fastest=False)
+    results = []
+    for i in top_k(res['score'], res['skip'] == SKIP_NONE, k):
+        cand = candidates[i]
+        results.append({
+            'email': cand['email'],
+            'overlap_s': float(res['overlap'][i]),
+            'closeness': float(res['closeness'][i]),
+            'similarity': float(res['similarity'][i]),
+            'score': float(res['score'][i]),
+            'departure': max(origin_earliest, cand['earliest']),
+            'arrival': min(origin_latest, cand['latest']),
+        })
+    return results
+
+# Batch mode: globally match every open trip in the window
+def run_batch_mode(window_start, window_end, max_degree, dry_run):
+    conn = get_db_connection()
+    summary = run_batch(conn, window_start, window_end, max_degree=max_degree, dry_run=dry_run)
+    conn.close()
+    print(f"Batch window {window_start} -> {window_end}: {summary['trips']} open trips, "
+          f"{summary['edges']} compatible pairs, {summary['matches']} matches "
+          f"(total score {summary['total_score']:.3f}) in {summary['seconds']:.2f}s"
+          + (" [dry run]" if dry_run else ""))
+    for r in summary['matched'][:5]:
+        print(f"  trip {r['trip_a']} + trip {r['trip_b']}: score={r['score']:.3f}, "
+              f"{r['departure']} -> {r['arrival']}")
+
+# Group mode: batch matching into parties of up to max_size riders
+def run_group_mode(window_start, window_end, max_size, max_degree, dry_run):
+    conn = get_db_connection()
+    summary = run_groups(conn, window_start, window_end, max_size=max_size, max_degree=max_degree,
+                         dry_run=dry_run)
+    conn.close()
+    print(f"Group window {window_start} -> {window_end}: {summary['trips']} open trips, "
+          f"{summary['edges']} compatible pairs, {summary['groups']} groups of up to {max_size} "
+          f"({summary['riders']} riders, total score {summary['total_score']:.3f}) in {summary['seconds']:.2f}s"
+          + (" [dry run]" if dry_run else ""))
+    for g in summary['grouped'][:5]:
+        print(f"  trips {', '.join(map(str, g['trip_ids']))}: score={g['score']:.3f}, "
+              f"{g['departure']} -> {g['arrival']}")
+
+# Single-trip mode: plan, insert and score one rider's request, printing every candidate
+def run_match_mode(args, origin_earliest, origin_latest, user_time=None):
+    # Compute fastest travel
+    with span('plan_trip'):
+        fastest_s, dep_time, arr_time = compute_fastest(
+            args.origin, args.destination, os.getenv('CTA_API_KEY'), user_time
+        )
     print(f"Fastest travel: {fastest_s}s (dep: {dep_time}, arr: {arr_time})")
 
     # Connect DB and setup
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    pid = ensure_profile(cursor, args.email, args.origin, args.destination, args.interests)
-    conn.commit()
+    with span('db_write'):
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        pid = ensure_profile(cursor, args.email, args.origin, args.destination, args.interests)
+        conn.commit()
 
-    # Insert trip
-    tid = insert_trip(cursor, pid, origin_earliest, origin_latest, fastest_s or 0)
-    conn.commit()
+        # Insert trip
+        tid = insert_trip(cursor, pid, args.origin, args.destination, origin_earliest, origin_latest, fastest_s or 0)
+        conn.commit()
 
     # Fetch candidates
-    candidates = fetch_candidates(cursor, tid, args.origin, args.destination, origin_earliest, origin_latest)
+    # The SQL prefilter is exact only when every interest is a registry topic
+    shared_mask = interest_mask(args.interests) if args.shared_only and is_canonical(args.interests) else None
+    with span('db_query'):
+        candidates = fetch_candidates(cursor, tid, args.origin, args.destination, origin_earliest, origin_latest,
+                                      shared_mask)
     print(f"Found {len(candidates)} candidate trips")
 
     # Score candidates
-    results = []
-    for cand in candidates:
-        m = compute_metrics(cand, origin_earliest, origin_latest, fastest_s or 0, args.interests)
-        if m:
-            results.append(m)
-    results.sort(key=lambda x: x['score'], reverse=True)
+    with span('scoring'):
+        results = score_candidates(candidates, origin_earliest, origin_latest, fastest_s or 0, args.interests)
+    if args.shared_only:
+        results = [r for r in results if r['similarity'] > 0]
 
     # Display verbose metrics
     print("\n=== Top Matches ===")
-    for r in results[:5]:
+    for r in results:
         print(f"Email: {r['email']}")
         print(f"  Overlap: {r['overlap_s']}s")
         print(f"  Closeness: {r['closeness']:.3f}")
@@ -159,5 +315,83 @@ def main():
     cursor.close()
     conn.close()
 
+# Main CLI
+def main():
+    parser = argparse.ArgumentParser(description="Test CTA rider matching logic.")
+    parser.add_argument('--email', help='User email')
+    parser.add_argument('--origin', help='Origin station')
+    parser.add_argument('--destination', help='Destination station')
+    parser.add_argument('--interests', help='Comma-separated interests')
+    parser.add_argument('--earliest', help='Earliest departure (YYYY-MM-DDTHH:MM)', default=None)
+    parser.add_argument('--latest', help='Latest arrival   (YYYY-MM-DDTHH:MM)', default=None)
+    parser.add_argument('--batch', action='store_true',
+                        help='Match all unmatched trips in the [earliest, latest] window at once')
+    parser.add_argument('--max-degree', type=int, default=MAX_DEGREE,
+                        help='Batch mode: best edges kept per trip (0 keeps all)')
+    parser.add_argument('--group-size', type=int, default=2,
+                        help='Batch mode: form parties of up to this many riders (2 pairs riders)')
+    parser.add_argument('--dry-run', action='store_true', help='Batch mode: compute matches without writing them')
+    parser.add_argument('--shared-only', action='store_true',
+                        help='Only list riders sharing at least one interest (prefiltered in SQL)')
+    parser.add_argument('--bulk', metavar='FILE', help="Import ride requests from a JSONL file ('-' for stdin)")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK, help='Bulk mode: requests per transaction')
+    parser.add_argument('--match', action='store_true', help='Bulk mode: batch-match the imported window afterwards')
+    parser.add_argument('--log-level', default=os.getenv('LOG_LEVEL', 'DEBUG'),
+                        help='DEBUG traces every CTA lookup and stage timing; INFO or WARNING for quieter runs')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print a per-stage wall/CPU breakdown (CTA, MySQL, scoring) to stderr')
+    parser.add_argument('--trace', metavar='FILE', help='Profile: also save the breakdown as JSON (see profiler.py)')
+    parser.add_argument('--cprofile', metavar='FILE', help='Profile: also write a cProfile dump (python -m pstats)')
+    cta = parser.add_mutually_exclusive_group()
+    cta.add_argument('--record-cta', metavar='FILE', help='Save every CTA arrivals response to FILE')
+    cta.add_argument('--replay-cta', metavar='FILE',
+                     help='Answer CTA lookups from a --record-cta file, at the time it was recorded (offline)')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    # Parse times; a replay plans against the moment its arrivals were recorded
+    recording = None
+    if args.replay_cta:
+        recording = CTARecording.load(args.replay_cta)
+    elif args.record_cta:
+        recording = CTARecording(datetime.now(central).replace(tzinfo=None))
+    user_time = recording.recorded_at if recording else None
+    now = user_time or datetime.now()
+    origin_earliest = datetime.fromisoformat(args.earliest) if args.earliest else now
+    origin_latest = datetime.fromisoformat(args.latest) if args.latest else origin_earliest + timedelta(minutes=30)
+
+    single = not (args.bulk or args.batch)
+    if single:
+        missing = [f"--{name}" for name in ('email', 'origin', 'destination', 'interests') if not getattr(args, name)]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    profiler = None
+    if args.profile or args.trace or args.cprofile:
+        profiler = Profiler(cprofile=bool(args.cprofile), label=' '.join(sys.argv[1:]))
+    cta_api.use_recording(recording)
+    try:
+        with profiler or nullcontext():
+            if args.bulk:
+                run_bulk_mode(args.bulk, args.chunk_size, args.match, args.max_degree or None, args.dry_run)
+            elif args.batch and args.group_size > 2:
+                run_group_mode(origin_earliest, origin_latest, args.group_size, args.max_degree or None,
+                               args.dry_run)
+            elif args.batch:
+                run_batch_mode(origin_earliest, origin_latest, args.max_degree or None, args.dry_run)
+            else:
+                run_match_mode(args, origin_earliest, origin_latest, user_time)
+    finally:
+        cta_api.use_recording(None)
+        if args.record_cta:
+            recording.save(args.record_cta)
+            print(f"Recorded {len(recording.responses)} CTA responses to {args.record_cta}", file=sys.stderr)
+        if profiler:
+            print(profiler.format_report(), file=sys.stderr)
+            if args.trace:
+                profiler.save(args.trace)
+            if args.cprofile:
+                profiler.dump_cprofile(args.cprofile)
+
 if __name__ == '__main__':
     main()
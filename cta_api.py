@@ -1,143 +1,246 @@
+import logging
+import os
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-import streamlit as st
-
-# Verbose debug flag
-VERBOSE = True
-
-# Map station names to CTA map IDs
-red_line_stations = {
-    "Howard": "40900", "Jarvis": "41190", "Morse": "40100",
-    "Loyola": "41300", "Bryn Mawr": "41380", "Berwyn": "40340",
-    "Argyle": "41200", "Lawrence": "40770", "Sheridan": "40080",
-    "Addison": "41420", "Belmont": "41320", "Fullerton": "41220",
-    "North/Clybourn": "40650", "Chicago": "41450", "Grand": "40330",
-    "Monroe": "41090", "Jackson": "40560", "Roosevelt": "41400",
-    "Sox-35th": "40190", "47th": "41230", "Garfield": "41170",
-    "63rd": "40910", "69th": "40990", "79th": "40240",
-    "87th": "41430", "95th/Dan Ryan": "40450"
-}
-
-CTA_URL = "http://lapi.transitchicago.com/api/1.0/ttarrivals.aspx"
+from arrivals_cache import ArrivalsCache
+from cta_client import CircuitBreaker, CTAClient, Deadline
+from eta_table import arrivals_table, to_datetime
+from metrics import counter, gauge
+from network import NETWORK
+
+log = logging.getLogger(__name__)
+CTA_REQUESTS = counter('cta_requests_total', 'Train Tracker API calls, by outcome')
+CTA_FALLBACKS = counter('cta_fallbacks_total', 'Lookups answered with last known arrivals after a failed fetch')
+
+# Map station names to CTA map IDs; trip planning covers the Red Line (network.py has every 'L' line)
+red_line_stations = NETWORK.line_stations('Red')
+
+# Override with a local fake_cta.py endpoint for offline development
+CTA_URL = os.getenv('CTA_URL', "http://lapi.transitchicago.com/api/1.0/ttarrivals.aspx")
 central = pytz.timezone('America/Chicago')
 
+# Shared across sessions: riders ask about the same stations within seconds of each other
+ARRIVALS_CACHE = ArrivalsCache(
+    ttl=float(os.getenv('CTA_ARRIVALS_TTL', '20')),
+    stale_ttl=float(os.getenv('CTA_ARRIVALS_STALE_TTL', '60'))
+)
+
+# Live timetable kept current by a station_poller.StationPoller; None means fetch on demand
+LIVE_TIMETABLE = None
+
+# Time budget for all CTA lookups of one request (plan_trip splits it between origin and destination)
+CTA_DEADLINE = float(os.getenv('CTA_DEADLINE', '3'))
+
+# profiler.CTARecording capturing (or, when replaying, answering) every arrivals lookup; None = off
+RECORDING = None
+
+# Offline travel-time matrix (travel_matrix.TravelMatrix), loaded on first use
+TRAVEL_MATRIX = None
+
+
+def use_timetable(timetable):
+    """Serves arrivals from a polled LiveTimetable (or stops doing so when passed None)."""
+    global LIVE_TIMETABLE
+    LIVE_TIMETABLE = timetable
+
+
+def use_recording(recording):
+    """Records arrivals lookups into a profiler.CTARecording, or replays from it (None stops)."""
+    global RECORDING
+    RECORDING = recording
+
+
+def get_arrivals(map_id: str, api_key: str, deadline: Deadline = None):
+    """
+    Arrivals for one station: live timetable, then the shared cache, then one CTA lookup bounded
+    by `deadline` (default: a fresh CTA_DEADLINE budget). If the lookup fails or the circuit is
+    open, the last arrivals seen for the station are served instead.
+    """
+    if RECORDING is not None:
+        if RECORDING.replaying:
+            return RECORDING.arrivals(map_id)
+        etas = _get_arrivals(map_id, api_key, deadline)
+        RECORDING.add(map_id, etas)
+        return etas
+    return _get_arrivals(map_id, api_key, deadline)
+
+
+def _get_arrivals(map_id: str, api_key: str, deadline: Deadline = None):
+    if LIVE_TIMETABLE is not None:
+        etas = LIVE_TIMETABLE.arrivals(map_id)
+        if etas is not None:
+            log.debug("Serving %s ETA entries for map_id %s from live timetable", len(etas), map_id)
+            return etas
+    etas = ARRIVALS_CACHE.get(map_id, lambda: CTA_CLIENT.fetch(map_id, api_key, deadline))
+    if etas is None:
+        etas = ARRIVALS_CACHE.peek(map_id)
+        if etas is None:
+            return []
+        CTA_FALLBACKS.inc()
+        log.info("CTA unavailable; serving last known arrivals for map_id %s", map_id)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Serving %s ETA entries for map_id %s (cache: %s)", len(etas), map_id, ARRIVALS_CACHE.stats())
+    return etas
 
-def get_arrivals(map_id: str, api_key: str):
-    if VERBOSE:
-        print(f"Calling CTA API URL: {CTA_URL}?key={api_key}&mapid={map_id}&outputType=JSON")
+
+def _fetch_arrivals(map_id: str, api_key: str, session=None, url: str = None, timeout: float = None):
+    """
+    Calls the CTA Train Tracker API once; returns the ETA list, or None on a bad response.
+    Raises requests.RequestException when the call fails or takes longer than `timeout` seconds.
+    """
+    url = url or CTA_URL
+    log.debug("Calling CTA API %s for map_id %s", url, map_id)
     params = {"key": api_key, "mapid": map_id, "outputType": "JSON"}
-    res = requests.get(CTA_URL, params=params)
-    if VERBOSE:
-        print(f"Response status code: {res.status_code}")
+    res = (session or requests).get(url, params=params, timeout=timeout)
+    log.debug("Response status code: %s", res.status_code)
     try:
         payload = res.json()
-        if VERBOSE:
-            print(f"Payload keys: {list(payload.keys())}")
     except Exception as e:
-        st.error(f"CTA JSON error: {e}")
-        if VERBOSE:
-            print(f"Raw response text: {res.text}")
-        return []
+        CTA_REQUESTS.inc(outcome='bad_json')
+        log.warning("CTA JSON error for map_id %s (status %s): %s", map_id, res.status_code, e)
+        log.debug("Raw response text: %s", res.text)
+        return None
+    CTA_REQUESTS.inc(outcome='ok')
     etas = payload.get('ctatt', {}).get('eta', []) or []
-    if VERBOSE:
-        print(f"Found {len(etas)} ETA entries for map_id {map_id}")
+    log.debug("Found %s ETA entries for map_id %s", len(etas), map_id)
     return etas
 
 
-def find_next_train(arrivals: list, route: str, after_time: datetime = None):
-    if VERBOSE:
-        print(f"Filtering {len(arrivals)} arrivals for route {route}")
-        print(f"After_time filter: {after_time}")
-    trains = []
-    for eta in arrivals:
-        if eta.get('rt') != route:
-            if VERBOSE:
-                print(f"Skipping route {eta.get('rt')} != {route}")
-            continue
-        try:
-            arr_raw = datetime.strptime(eta['arrT'], "%Y-%m-%dT%H:%M:%S")
-        except Exception as e:
-            if VERBOSE:
-                print(f"Failed to parse arrT '{eta.get('arrT')}' for run {eta.get('rn')}")
-            continue
-        arr_central = central.localize(arr_raw).replace(tzinfo=None)
-        if after_time is None or arr_central >= after_time:
-            trains.append({'arrival': arr_central, 'run_number': eta['rn']})
-            if VERBOSE:
-                print(f"Accepting train run {eta['rn']} at {arr_central}")
-        else:
-            if VERBOSE:
-                print(f"Discarding train run {eta['rn']} at {arr_central} < {after_time}")
-    if trains:
-        sorted_trains = sorted(trains, key=lambda t: t['arrival'])
-        if VERBOSE:
-            print(f"Next train: {sorted_trains[0]}")
-        return sorted_trains[0]
-    if VERBOSE:
-        print("No trains found after filter.")
-    return None
-
-
-def track_train_to_destination(arrivals: list, run_number: str):
-    if VERBOSE:
-        print(f"Tracking run {run_number} to destination among {len(arrivals)} arrivals")
-    for eta in arrivals:
-        if eta.get('rn') == run_number:
-            try:
-                arr_raw = datetime.strptime(eta['arrT'], "%Y-%m-%dT%H:%M:%S")
-            except Exception as e:
-                if VERBOSE:
-                    print(f"Error parsing arrival for rn {run_number}: {e}")
-                return None
-            arr_central = central.localize(arr_raw).replace(tzinfo=None)
-            if VERBOSE:
-                print(f"Arrival at destination: {arr_central}")
-            return arr_central
-    if VERBOSE:
-        print(f"Run number {run_number} not found in arrivals.")
-    return None
+
+# Pooled, hedged, circuit-broken lookups for the request path (the station poller has its own session)
+CTA_CLIENT = CTAClient(lambda map_id, api_key, session, timeout: _fetch_arrivals(map_id, api_key, session,
+                                                                                 timeout=timeout),
+                       budget=CTA_DEADLINE, breaker=CircuitBreaker(
+                           failure_threshold=int(os.getenv('CTA_BREAKER_FAILURES', '5')),
+                           reset_timeout=float(os.getenv('CTA_BREAKER_RESET', '30'))))
+gauge('cta_circuit_open', lambda: int(CTA_CLIENT.breaker.state != CircuitBreaker.CLOSED),
+      'CTA circuit breaker open or probing')
+
+
+def find_next_train(arrivals, route: str, after_time: datetime = None):
+    """
+    Soonest `route` train arriving at or after after_time, as {'arrival', 'run_number'}, or None.
+    `arrivals` is an ETA list (decoded once into an eta_table.ArrivalsTable) or such a table.
+    """
+    table = arrivals_table(arrivals)
+    train = table.next_train(route, after_time)
+    log.debug("Next %s train after %s among %s arrivals: %s", route, after_time, len(table), train)
+    return train
+
+
+def track_train_to_destination(arrivals, run_number: str):
+    """Arrival time of run `run_number` in an ETA list (or ArrivalsTable), or None."""
+    table = arrivals_table(arrivals)
+    arrival = table.track(run_number)
+    log.debug("Run %s among %s arrivals at destination: %s", run_number, len(table), arrival)
+    return arrival
 
 
 def plan_trip(orig: str, dest: str, api_key: str, user_time: datetime = None):
-    if VERBOSE:
-        print(f"Planning trip from {orig} to {dest} at user_time {user_time}")
+    log.debug("Planning trip from %s to %s at user_time %s", orig, dest, user_time)
     start_id = red_line_stations.get(orig)
     end_id = red_line_stations.get(dest)
     if not start_id or not end_id:
-        if VERBOSE:
-            print(f"Invalid station names: {orig}->{dest}")
+        log.debug("Invalid station names: %s->%s", orig, dest)
         return None, None
 
     if user_time:
         ref = user_time.astimezone(central).replace(tzinfo=None) if user_time.tzinfo else user_time
     else:
         ref = datetime.now(central).replace(tzinfo=None)
-    if VERBOSE:
-        print(f"Reference time (central naive): {ref}")
+    log.debug("Reference time (central naive): %s", ref)
 
-    arrivals_start = get_arrivals(start_id, api_key)
+    # Half of the budget for the origin lookup, whatever is left for the destination
+    deadline = Deadline(CTA_DEADLINE)
+    arrivals_start = get_arrivals(start_id, api_key, deadline.portion(0.5))
     next_train = find_next_train(arrivals_start, 'Red', ref)
     if not next_train:
-        if VERBOSE:
-            print("No next train found at origin.")
+        log.debug("No next train found at origin.")
         return None, None
     dep_time = next_train['arrival']
 
-    arrivals_dest = get_arrivals(end_id, api_key)
+    if LIVE_TIMETABLE is not None and LIVE_TIMETABLE.is_fresh(end_id):
+        # Direct run-number lookup in the polled timetable
+        eta = LIVE_TIMETABLE.run_arrival(next_train['run_number'], end_id)
+        arrivals_dest = [eta] if eta else []
+    else:
+        arrivals_dest = get_arrivals(end_id, api_key, deadline)
     arr_time = track_train_to_destination(arrivals_dest, next_train['run_number'])
-    if VERBOSE:
-        print(f"Departure: {dep_time}, Arrival: {arr_time}")
+    log.debug("Departure: %s, Arrival: %s", dep_time, arr_time)
     return dep_time, arr_time
 
 
-def compute_fastest(orig: str, dest: str, api_key: str, user_time: datetime = None):
-    dep, arr = plan_trip(orig, dest, api_key, user_time)
-    if dep and arr:
-        fastest = int((arr - dep).total_seconds())
-        if VERBOSE:
-            print(f"Fastest travel time: {fastest}s")
-        return fastest, dep, arr
-    if VERBOSE:
-        print("Cannot compute fastest: missing dep or arr.")
-    return None, None, None
\ No newline at end of file
+# Train Tracker trDr codes on the Red Line: 5 runs toward 95th/Dan Ryan, 1 toward Howard
+TRDR_SOUTHBOUND, TRDR_NORTHBOUND = '5', '1'
+
+
+def candidate_runs(orig: str, dest: str, api_key: str, earliest: datetime, latest: datetime):
+    """
+    Every Red Line run a rider could board at `orig` within [earliest, latest] heading toward `dest`.
+
+    Returns a list of dicts: run_number, trdr (direction code), board_time and alight_time (the first
+    arrival listed for that run at `dest`, or None when it is beyond the prediction horizon), soonest
+    first.
+    """
+    names = list(red_line_stations)
+    if orig not in red_line_stations or dest not in red_line_stations or orig == dest:
+        return []
+    trdr = TRDR_SOUTHBOUND if names.index(dest) > names.index(orig) else TRDR_NORTHBOUND
+    end_id = red_line_stations[dest]
+
+    table = arrivals_table(get_arrivals(red_line_stations[orig], api_key))
+    runs = []
+    dest_table = None
+    for row in table.window('Red', trdr, earliest, latest):
+        rn, board = table.run[row], to_datetime(table.arrival[row])
+        if LIVE_TIMETABLE is not None and LIVE_TIMETABLE.is_fresh(end_id):
+            at_dest = LIVE_TIMETABLE.run_arrival(rn, end_id)
+            alight = track_train_to_destination([at_dest] if at_dest else [], rn)
+        else:
+            if dest_table is None:
+                dest_table = arrivals_table(get_arrivals(end_id, api_key))
+            alight = dest_table.track(rn, trdr)
+        if alight is not None and alight <= board:
+            # The run reaches the destination first: it is heading the other way on this leg
+            continue
+        runs.append({'run_number': rn, 'trdr': trdr, 'board_time': board, 'alight_time': alight})
+    runs.sort(key=lambda r: r['board_time'])
+    return runs
+
+
+def estimate_fastest(orig: str, dest: str, user_time: datetime = None):
+    """Travel time from the offline matrix, or None if there is no matrix or no samples for the pair."""
+    global TRAVEL_MATRIX
+    if TRAVEL_MATRIX is None:
+        # Imported here: travel_matrix reads the station table from this module
+        from travel_matrix import TravelMatrix
+        TRAVEL_MATRIX = TravelMatrix.load() or False
+    if not TRAVEL_MATRIX:
+        return None
+    return TRAVEL_MATRIX.estimate(orig, dest, user_time)
+
+
+def compute_fastest(orig: str, dest: str, api_key: str, user_time: datetime = None, estimate_only: bool = False):
+    if not estimate_only:
+        dep, arr = plan_trip(orig, dest, api_key, user_time)
+        if dep and arr:
+            fastest = int((arr - dep).total_seconds())
+            log.debug("Fastest travel: %ss", fastest)
+            return fastest, dep, arr
+    if user_time:
+        ref = user_time.astimezone(central).replace(tzinfo=None) if user_time.tzinfo else user_time
+    else:
+        ref = datetime.now(central).replace(tzinfo=None)
+    fastest = estimate_fastest(orig, dest, ref)
+    if fastest is not None:
+        log.debug("Estimated travel time from matrix: %ss", fastest)
+        return fastest, ref, ref + timedelta(seconds=fastest)
+    if orig not in red_line_stations or dest not in red_line_stations:
+        # Arrivals are planned on the Red Line only; elsewhere the route length gives the estimate
+        fastest = NETWORK.estimate_seconds(orig, dest)
+        if fastest is not None:
+            log.debug("Estimated travel time from the network route: %ss", fastest)
+            return fastest, ref, ref + timedelta(seconds=fastest)
+    log.info("Cannot compute fastest %s -> %s: missing dep or arr.", orig, dest)
+    return None, None, None
@@ -0,0 +1,182 @@
+"""
+Bounded CTA Train Tracker calls for the request path.
+
+Every lookup runs against a Deadline, over one pooled keep-alive session. If the first attempt is
+still outstanding once it is slower than the recent p95, a second (hedged) attempt is sent and the
+first answer wins. A CircuitBreaker stops calling a degraded API for a while, so callers fail fast
+and fall back to the last arrivals they have.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import counter, span
+
+log = logging.getLogger(__name__)
+CTA_HEDGES = counter('cta_hedged_requests_total', 'Second attempts sent for slow CTA lookups, by winner')
+CTA_LOOKUPS = counter('cta_lookups_total', 'Deadline-bounded CTA lookups, by outcome')
+
+
+class Deadline:
+    """A point in time a whole operation must finish by; lookups take their timeouts from it."""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - self.clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def portion(self, share):
+        """A deadline for one step that gets `share` of the time left, e.g. 1/2 for the first of two lookups."""
+        return Deadline(self.remaining() * share, self.clock)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted. After `failure_threshold` of
+    them it opens and rejects calls for `reset_timeout` seconds, then lets one probe through
+    (half-open): success closes it again, failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state, self._probing = self.HALF_OPEN, False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info("CTA circuit closed")
+            self.state, self.failures, self._probing = self.CLOSED, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                log.warning("CTA circuit open after %s failures; failing fast for %ss", self.failures,
+                            self.reset_timeout)
+                self.state, self.opened_at, self._probing = self.OPEN, self.clock(), False
+
+
+class CTAClient:
+    """
+    Deadline-bounded, hedged lookups through `attempt(map_id, api_key, session, timeout)`, which
+    returns the ETA list or None (cta_api._fetch_arrivals in production).
+
+    hedge_after fixes the hedging delay in seconds; by default it is the p95 of the last 200
+    successful attempts (at least min_hedge, or default_hedge until 20 have been seen).
+    hedge=False turns hedging off.
+    """
+
+    def __init__(self, attempt, budget=3.0, pool_size=8, hedge=True, hedge_after=None, min_hedge=0.1,
+                 default_hedge=0.5, breaker=None):
+        self.attempt = attempt
+        self.budget = budget
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_hedge, self.default_hedge = min_hedge, default_hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Two attempts per lookup at most; a losing attempt finishes (within its timeout) in the background
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='cta-fetch')
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return self.default_hedge
+        return max(self.min_hedge, samples[int(0.95 * (len(samples) - 1))])
+
+    def fetch(self, map_id, api_key, deadline=None):
+        """ETA list for one station, or None when the breaker is open or nothing answered in time."""
+        deadline = deadline or Deadline(self.budget)
+        if not self.breaker.allow():
+            CTA_LOOKUPS.inc(outcome='rejected')
+            return None
+        # Timed on the caller's thread, so the stage nests under its plan_trip (attempts run on the pool)
+        with span('cta_fetch'):
+            return self._fetch(map_id, api_key, deadline)
+
+    def _fetch(self, map_id, api_key, deadline):
+        attempts = {self._submit(map_id, api_key, deadline): 'primary'}
+        done, _ = wait(attempts, timeout=min(self.hedge_delay(), deadline.remaining()))
+        if not done and self.hedge and not deadline.expired():
+            log.debug("Hedging CTA lookup for map_id %s", map_id)
+            attempts[self._submit(map_id, api_key, deadline)] = 'hedge'
+
+        result, winner, pending = None, None, set(attempts)
+        while pending and result is None and not deadline.expired():
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result() is not None:
+                    result, winner = future.result(), attempts[future]
+                    break
+        if len(attempts) > 1:
+            CTA_HEDGES.inc(winner=winner or 'none')
+        if result is None:
+            self.breaker.record_failure()
+            CTA_LOOKUPS.inc(outcome='timeout' if pending else 'error')
+            log.warning("CTA lookup for map_id %s failed (%s)", map_id,
+                        'deadline exceeded' if pending else 'error response')
+            return None
+        self.breaker.record_success()
+        CTA_LOOKUPS.inc(outcome='ok')
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _submit(self, map_id, api_key, deadline):
+        # requests rejects a zero timeout; an attempt submitted at the wire still gets a moment
+        timeout = max(deadline.remaining(), 0.01)
+
+        def run():
+            start = time.perf_counter()
+            try:
+                etas = self.attempt(map_id, api_key, self.session, timeout)
+            except requests.RequestException as e:
+                log.debug("CTA attempt for map_id %s failed: %s", map_id, e)
+                return None
+            if etas is not None:
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - start)
+            return etas
+        return self._pool.submit(run)
+
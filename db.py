@@ -1,13 +1,221 @@
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
 import mysql.connector
+from mysql.connector import errors, pooling
+from mysql.connector.abstracts import MySQLConnectionAbstract
 from streamlit import cache_resource
 
+from metrics import span
+from migrations import migrate
+
+# Server-side prepared cursors, per physical connection: {connection: {sql: cursor}}
+_prepared = weakref.WeakKeyDictionary()
+_providers = {}
+_providers_lock = threading.Lock()
+_pool_ids = iter(range(1, 1_000_000))
+
+
+def config_from_env():
+    """DB settings from DB_HOST/DB_USER/DB_PASSWORD/DB_NAME (the .env used by the CLI and tests)."""
+    return {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'database': os.getenv('DB_NAME'),
+    }
+
+
+class _Checkout:
+    """A pooled connection on loan; close() hands it back to the provider."""
+
+    def __init__(self, conn, provider):
+        self._conn = conn
+        self._provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._provider._release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # Streamlit reruns can st.stop() before reaching close(); don't leak the pool slot
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionProvider:
+    """
+    Pool of warm MySQL connections shared by the app, the CLI and the tests.
+
+    Connections are validated on checkout (ping, reconnecting once if the server dropped them),
+    and the time spent waiting for a free connection is recorded. Sessions are not reset between
+    checkouts so server-side prepared statements survive (see prepared_cursor).
+    """
+
+    def __init__(self, config, size=None, max_wait=10.0):
+        self.size = int(size or config.get('pool_size') or os.getenv('DB_POOL_SIZE', '5'))
+        self.max_wait = max_wait
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name=f"ridematch-{next(_pool_ids)}",
+            pool_size=self.size,
+            pool_reset_session=False,
+            host=config['host'],
+            user=config['user'],
+            password=config['password'],
+            database=config['database']
+        )
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._stats = {'checkouts': 0, 'timeouts': 0, 'reconnects': 0, 'validation_failures': 0,
+                       'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0, 'in_use': 0}
+
+    def get(self):
+        """Checks out a validated connection; close() returns it to the pool."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise errors.PoolError(f"No connection available within {self.max_wait}s")
+        waited = time.perf_counter() - start
+        try:
+            conn = self.pool.get_connection()
+            self._validate(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+        return _Checkout(conn, self)
+
+    @contextmanager
+    def connection(self):
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Pool counters, including wait-time metrics in seconds."""
+        with self._lock:
+            out = dict(self._stats)
+        out['size'] = self.size
+        out['wait_seconds_avg'] = out['wait_seconds_total'] / out['checkouts'] if out['checkouts'] else 0.0
+        return out
+
+    def _validate(self, conn):
+        raw = _raw_connection(conn)
+        try:
+            conn.ping(reconnect=False)
+            return
+        except errors.Error:
+            pass
+        try:
+            conn.ping(reconnect=True, attempts=2, delay=0)
+        except errors.Error:
+            with self._lock:
+                self._stats['validation_failures'] += 1
+            conn.close()
+            raise
+        # A new session has none of the old prepared statements
+        _prepared.pop(raw, None)
+        with self._lock:
+            self._stats['reconnects'] += 1
+
+    def _release(self, conn):
+        try:
+            # End any open (read) transaction so the next borrower sees fresh data, as a new
+            # connection would; uncommitted writes are discarded just like on a real close
+            conn.rollback()
+        except errors.Error:
+            pass
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+
+def shared_provider(config):
+    """One ConnectionProvider per database config for the whole process."""
+    key = (config['host'], config['user'], config['database'])
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = ConnectionProvider(config)
+    return provider
+
+
 def get_db_connection(config):
-    return mysql.connector.connect(
-        host=config['host'],
-        user=config['user'],
-        password=config['password'],
-        database=config['database']
-    )
+    """Checks out a pooled connection for `config`; call close() to return it."""
+    return shared_provider(config).get()
+
+
+def _raw_connection(db_conn):
+    """The physical connection behind a checkout / pooled wrapper."""
+    if isinstance(db_conn, _Checkout):
+        db_conn = db_conn._conn
+    return getattr(db_conn, '_cnx', db_conn)
+
+
+def prepared_cursor(db_conn, sql):
+    """
+    Dictionary cursor for `sql`, prepared server-side once per physical MySQL connection and
+    reused on later checkouts. Returns (cursor, reusable); non-reusable cursors should be closed.
+    Connections that cannot prepare statements (e.g. test stand-ins) get a plain cursor.
+    """
+    raw = _raw_connection(db_conn)
+    if not isinstance(raw, MySQLConnectionAbstract):
+        return db_conn.cursor(dictionary=True), False
+    cursors = _prepared.setdefault(raw, {})
+    cursor = cursors.get(sql)
+    if cursor is None:
+        cursor = cursors[sql] = raw.cursor(prepared=True, dictionary=True)
+    return cursor, True
+
+
+def fetch_all(db_conn, sql, params=()):
+    """Runs a read query through a prepared statement when possible and returns dict rows."""
+    with span('db_query'):
+        return _fetch_all(db_conn, sql, params)
+
+
+def _fetch_all(db_conn, sql, params):
+    cursor, reusable = prepared_cursor(db_conn, sql)
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except errors.DatabaseError:
+        if not reusable:
+            raise
+        # Statement lost (e.g. server restart): drop it and retry unprepared
+        _prepared.get(_raw_connection(db_conn), {}).pop(sql, None)
+        cursor = db_conn.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        if not reusable:
+            cursor.close()
+
 
 @cache_resource
 def init_db(_config):
@@ -42,6 +250,17 @@ def init_db(_config):
         FOREIGN KEY(trip_a) REFERENCES trips(id),
         FOREIGN KEY(trip_b) REFERENCES trips(id)
     )""")
+    # Recorded arrivals (station map id, run number) feeding travel_matrix.py
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schedule (
+        station_id BIGINT UNSIGNED NOT NULL,
+        run_id INT UNSIGNED NOT NULL,
+        arrival_time DATETIME NOT NULL,
+        PRIMARY KEY(station_id, run_id, arrival_time),
+        INDEX idx_schedule_arrival (arrival_time)
+    )""")
     conn.commit()
     cursor.close()
+    # Bring existing databases up to the current schema (columns, indexes)
+    migrate(conn)
     conn.close()
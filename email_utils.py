@@ -1,7 +1,8 @@
 import random
-import smtplib
 from email.mime.text import MIMEText
 
+from mailer import shared_mailer
+
 def send_verification_email(email_config, to_email, session_state):
     code = str(random.randint(100000, 999999))
     session_state['verification_code'] = code
@@ -10,7 +11,6 @@ def send_verification_email(email_config, to_email, session_state):
     msg['From'] = email_config['from_email']
     msg['To'] = to_email
 
-    with smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port']) as server:
-        server.starttls()
-        server.login(email_config['username'], email_config['password'])
-        server.send_message(msg)
\ No newline at end of file
+    # STARTTLS account; queued and delivered by the shared mailer's worker
+    shared_mailer(email_config['smtp_server'], email_config['smtp_port'], email_config['username'],
+                  email_config['password'], use_ssl=False, starttls=True).send(msg)
@@ -0,0 +1,186 @@
+"""
+Columnar view of a CTA `ctatt.eta` list, decoded once per payload.
+
+Each ETA becomes one row of parallel arrays: route code, run number, direction (trDr), station
+(staId) and arrival time as int64 seconds. Arrivals are Chicago wall-clock seconds since
+1970-01-01 00:00, i.e. the naive central time the rest of the app compares against. The arrT
+strings are parsed by numpy in one call instead of one strptime and localize per entry.
+
+Lookups reproduce cta_api's per-entry loops exactly, including which entry wins ties and how
+entries with a missing or malformed arrT are skipped.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+ARRT_FORMAT = "%Y-%m-%dT%H:%M:%S"
+MISSING = np.iinfo(np.int64).min
+
+# Character positions of 'YYYY-MM-DDTHH:MM:SS'
+_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_SEPARATORS = {4: '-', 7: '-', 10: 'T', 13: ':', 16: ':'}
+
+
+def to_seconds(when):
+    """Naive datetime -> wall-clock seconds, rounded up (an arrival at or after `when`)."""
+    micros = (when - EPOCH) // timedelta(microseconds=1)
+    return -(-micros // 1_000_000)
+
+
+def to_datetime(seconds):
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def parse_arrivals(values):
+    """
+    int64 wall-clock seconds for a list of arrT values; MISSING where strptime(ARRT_FORMAT) would fail.
+
+    Well-formed strings are checked and parsed as one numpy array; anything else (None, odd
+    padding) goes through strptime itself so the accepted set is exactly today's.
+    """
+    n = len(values)
+    out = np.full(n, MISSING, dtype=np.int64)
+    if not n:
+        return out
+    text = np.array([v if isinstance(v, str) else '' for v in values], dtype='U20')
+    codes = text.view(np.uint32).reshape(n, 20)
+    fast = (codes[:, 19] == 0) & (codes[:, 18] != 0)
+    digits = codes[:, _DIGITS]
+    fast &= ((digits >= ord('0')) & (digits <= ord('9'))).all(axis=1)
+    fast &= (digits[:, :4] != ord('0')).any(axis=1)     # strptime has no year 0
+    for pos, sep in _SEPARATORS.items():
+        fast &= codes[:, pos] == ord(sep)
+    rows = np.flatnonzero(fast)
+    try:
+        out[rows] = text[rows].astype('datetime64[s]').astype(np.int64)
+    except ValueError:
+        # An out-of-range field somewhere (e.g. Feb 30): parse this payload entry by entry
+        rows = np.array([], dtype=np.int64)
+    parsed = set(rows.tolist())
+    for i, value in enumerate(values):
+        if i in parsed or not isinstance(value, str):
+            continue
+        try:
+            out[i] = to_seconds(datetime.strptime(value, ARRT_FORMAT))
+        except ValueError:
+            pass
+    return out
+
+
+class ArrivalsTable:
+    """
+    Parallel arrays over one station's ETA list (rows in payload order).
+
+    Attributes:
+      route: int16 codes into `routes` (-1 when rt is missing)
+      run: run numbers (rn) as a list of the original strings
+      direction: int16 trDr (-1 when missing or not numeric)
+      station: int32 staId (-1 when missing or not numeric)
+      arrival: int64 wall-clock seconds, MISSING where arrT did not parse
+    """
+
+    def __init__(self, etas):
+        n = len(etas)
+        self.routes = []
+        route_codes = {}
+        route = np.empty(n, dtype=np.int16)
+        direction = np.empty(n, dtype=np.int16)
+        station = np.empty(n, dtype=np.int32)
+        self.run = [None] * n
+        arrt = [None] * n
+        self._first_row = {}        # rn -> first row, and (rn, trDr code) -> first row
+        for i, eta in enumerate(etas):
+            rt = eta.get('rt')
+            if rt is None:
+                route[i] = -1
+            else:
+                code = route_codes.get(rt)
+                if code is None:
+                    code = route_codes[rt] = len(self.routes)
+                    self.routes.append(rt)
+                route[i] = code
+            rn = self.run[i] = eta.get('rn')
+            self._first_row.setdefault(rn, i)
+            trdr = eta.get('trDr')
+            direction[i] = int(trdr) if isinstance(trdr, str) and trdr.isdigit() and len(trdr) <= 4 else -1
+            self._first_row.setdefault((rn, int(direction[i])), i)
+            sta = eta.get('staId')
+            station[i] = int(sta) if isinstance(sta, str) and sta.isdigit() and len(sta) <= 9 else -1
+            arrt[i] = eta.get('arrT')
+        self.route, self.direction, self.station = route, direction, station
+        self.arrival = parse_arrivals(arrt)
+
+    def __len__(self):
+        return len(self.run)
+
+    def route_mask(self, route):
+        code = self.routes.index(route) if route in self.routes else -2
+        return self.route == code
+
+    def next_train(self, route, after_time=None):
+        """The soonest `route` arrival at or after after_time: {'arrival', 'run_number'}, or None."""
+        mask = self.route_mask(route) & (self.arrival != MISSING)
+        if after_time is not None:
+            mask &= self.arrival >= to_seconds(after_time)
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return None
+        # argmin takes the first of equal arrivals, as the stable sort did
+        row = rows[np.argmin(self.arrival[rows])]
+        return {'arrival': to_datetime(self.arrival[row]), 'run_number': self.run[row]}
+
+    def track(self, run_number, direction=None):
+        """
+        Arrival of the first entry for `run_number` (in trDr `direction` if given); None if there
+        is none or its arrT does not parse.
+        """
+        row = self._first_row.get(run_number if direction is None else (run_number, int(direction)))
+        if row is None or self.arrival[row] == MISSING:
+            return None
+        return to_datetime(self.arrival[row])
+
+    def min_arrival(self, route=None, direction=None):
+        """Earliest parsed arrival, optionally for one route and/or trDr direction code."""
+        mask = self.arrival != MISSING
+        if route is not None:
+            mask &= self.route_mask(route)
+        if direction is not None:
+            mask &= self.direction == int(direction)
+        return to_datetime(self.arrival[mask].min()) if mask.any() else None
+
+    def window(self, route, direction, lo, hi):
+        """Rows of `route` in trDr `direction` arriving within [lo, hi], in payload order."""
+        # Whole seconds, as the arrT strings were compared before: sub-second bounds truncate
+        lo_s, hi_s = ((when - EPOCH) // timedelta(seconds=1) for when in (lo, hi))
+        mask = self.route_mask(route) & (self.direction == int(direction)) & (self.arrival != MISSING)
+        mask &= (self.arrival >= lo_s) & (self.arrival <= hi_s)
+        return np.flatnonzero(mask)
+
+
+# Tables for the ETA lists handed out recently. The cache and the live timetable return the same
+# (never mutated) list object until the next fetch, so each payload is decoded once.
+_TABLES = OrderedDict()
+_TABLES_MAX = 128
+_tables_lock = threading.Lock()
+
+
+def arrivals_table(etas):
+    """The ArrivalsTable for an ETA list (or the table itself), decoded on first use."""
+    if isinstance(etas, ArrivalsTable):
+        return etas
+    key = id(etas)
+    with _tables_lock:
+        entry = _TABLES.get(key)
+        if entry is not None and entry[0] is etas:
+            _TABLES.move_to_end(key)
+            return entry[1]
+    table = ArrivalsTable(etas)
+    with _tables_lock:
+        # Holding the list keeps its id from being reused while the entry exists
+        _TABLES[key] = (etas, table)
+        while len(_TABLES) > _TABLES_MAX:
+            _TABLES.popitem(last=False)
+    return table
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the CTA Train Tracker arrivals endpoint (ttarrivals.aspx), for offline
+development and tests.
+
+It simulates Red Line runs in both directions on a fixed headway and answers
+?mapid=...&outputType=JSON with the upcoming ETAs for that station, in the same shape as the
+real API's ctatt.eta list. Slow and failing responses can be injected to exercise timeouts.
+
+Usage:
+    python fake_cta.py [--port 8765]
+    CTA_URL=http://127.0.0.1:8765/api/1.0/ttarrivals.aspx streamlit run app.py
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytz
+
+from cta_api import red_line_stations
+
+central = pytz.timezone('America/Chicago')
+STATIONS = list(red_line_stations.items())
+STATION_NAMES = {map_id: name for name, map_id in STATIONS}
+
+
+class FakeCTA:
+    """
+    Simulated Red Line timetable.
+
+    Southbound runs (trDr 5) leave Howard and northbound runs (trDr 1) leave 95th/Dan Ryan every
+    `headway` seconds starting at `start`; each hop between adjacent stations takes `hop` seconds.
+    """
+
+    def __init__(self, start=None, headway=300, hop=120, runs=24, horizon=1800, clock=None):
+        self.clock = clock or (lambda: datetime.now(central).replace(tzinfo=None))
+        self.start = (start or self.clock()).replace(microsecond=0)
+        self.headway = headway
+        self.hop = hop
+        self.runs = runs
+        self.horizon = horizon
+        self.requests = 0
+        self.connections = 0
+        # Injected faults: every answer waits `delay` seconds, the next `slow_next` requests wait
+        # `slow_delay` instead, and the next `fail_next` get an HTTP 503
+        self.delay = 0.0
+        self.slow_next, self.slow_delay = 0, 0.0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+    def run_number(self, k, direction):
+        return str((800 if direction == '5' else 900) + k)
+
+    def arrival(self, k, direction, map_id):
+        """Arrival time of run k (direction '5' or '1') at a station."""
+        pos = [m for _, m in STATIONS].index(map_id)
+        hops = pos if direction == '5' else len(STATIONS) - 1 - pos
+        return self.start + timedelta(seconds=k * self.headway + hops * self.hop)
+
+    def etas(self, map_id):
+        now = self.clock()
+        out = []
+        for direction, dest in (('5', '95th/Dan Ryan'), ('1', 'Howard')):
+            for k in range(self.runs):
+                arr = self.arrival(k, direction, map_id)
+                if now <= arr <= now + timedelta(seconds=self.horizon):
+                    out.append({
+                        'staId': map_id, 'stpId': f"3{map_id[1:]}{direction}", 'staNm': STATION_NAMES[map_id],
+                        'stpDe': f"Service toward {dest}", 'rn': self.run_number(k, direction), 'rt': 'Red',
+                        'destSt': '30089' if direction == '5' else '30173', 'destNm': dest, 'trDr': direction,
+                        'prdt': now.strftime("%Y-%m-%dT%H:%M:%S"), 'arrT': arr.strftime("%Y-%m-%dT%H:%M:%S"),
+                        'isApp': '0', 'isSch': '0', 'isDly': '0', 'isFlt': '0', 'flags': None,
+                    })
+        out.sort(key=lambda e: e['arrT'])
+        return out
+
+    def take_fault(self):
+        """(seconds to stall, whether to fail) for the request about to be answered."""
+        with self._lock:
+            self.requests += 1
+            delay = self.delay
+            if self.slow_next:
+                self.slow_next -= 1
+                delay = self.slow_delay
+            fail = self.fail_next > 0
+            if fail:
+                self.fail_next -= 1
+        return delay, fail
+
+    def payload(self, map_id):
+        if map_id not in STATION_NAMES:
+            return {'ctatt': {'tmst': self.clock().strftime("%Y-%m-%dT%H:%M:%S"), 'errCd': '101',
+                              'errNm': f"Invalid parameter: mapid {map_id}", 'eta': None}}
+        return {'ctatt': {'tmst': self.clock().strftime("%Y-%m-%dT%H:%M:%S"), 'errCd': '0', 'errNm': None,
+                          'eta': self.etas(map_id)}}
+
+
+class FakeCTAServer:
+    """Serves a FakeCTA over HTTP on a background thread. Use port=0 for a free port."""
+
+    def __init__(self, fake=None, host='127.0.0.1', port=0):
+        self.fake = fake or FakeCTA()
+        fake = self.fake
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled clients can reuse connections
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_GET(self):
+                delay, fail = fake.take_fault()
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    body = b"Service Unavailable"
+                    self.send_response(503)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                body = json.dumps(fake.payload(query.get('mapid', [''])[0])).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/1.0/ttarrivals.aspx"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake CTA arrivals endpoint.")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    server = FakeCTAServer(port=args.port)
+    print(f"Fake CTA endpoint at {server.url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
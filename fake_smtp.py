@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the outbound SMTP server, for offline development and tests.
+
+Speaks enough plain-text SMTP for smtplib (EHLO/HELO, AUTH PLAIN/LOGIN accepting any
+credentials, MAIL, RCPT, DATA, RSET, NOOP, QUIT) and keeps every accepted message in memory.
+Connections and logins are counted, and failures can be injected to exercise retries.
+
+Usage:
+    python fake_smtp.py [--port 8025]
+    # then point [email] smtp_host/smtp_port at 127.0.0.1:8025 with smtp_ssl = false
+"""
+import argparse
+import socketserver
+import threading
+from email import message_from_bytes
+
+
+class FakeSMTP:
+    """Mailbox and counters shared by every connection."""
+
+    def __init__(self):
+        self.messages = []      # email.message.Message objects, in delivery order
+        self.connections = 0
+        self.logins = 0
+        # Injected failures: the next N DATA commands get a transient 451, or drop the connection
+        self.fail_next = 0
+        self.disconnect_next = 0
+        self._lock = threading.Lock()
+
+    def deliver(self, raw):
+        with self._lock:
+            self.messages.append(message_from_bytes(raw))
+
+    def take_failure(self):
+        """'451', 'drop' or None for the DATA command about to be answered."""
+        with self._lock:
+            if self.disconnect_next:
+                self.disconnect_next -= 1
+                return 'drop'
+            if self.fail_next:
+                self.fail_next -= 1
+                return '451'
+        return None
+
+
+class FakeSMTPServer:
+    """Serves a FakeSMTP on a background thread. Use port=0 for a free port."""
+
+    def __init__(self, fake=None, host='127.0.0.1', port=0):
+        self.fake = fake or FakeSMTP()
+        fake = self.fake
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                with fake._lock:
+                    fake.connections += 1
+                self.reply("220 fake-smtp ready")
+                auth_login = None
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    text = line.decode(errors='replace').rstrip("\r\n")
+                    if auth_login is not None:
+                        # AUTH LOGIN: username, then password, each on its own line
+                        auth_login += 1
+                        if auth_login == 1:
+                            self.reply("334 UGFzc3dvcmQ6")
+                        else:
+                            auth_login = None
+                            with fake._lock:
+                                fake.logins += 1
+                            self.reply("235 2.7.0 Authentication successful")
+                        continue
+                    verb = text.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        self.wfile.write(b"250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                    elif verb == 'HELO':
+                        self.reply("250 fake-smtp")
+                    elif verb == 'AUTH':
+                        if text.upper().startswith('AUTH LOGIN'):
+                            auth_login = 0
+                            self.reply("334 VXNlcm5hbWU6")
+                        else:
+                            with fake._lock:
+                                fake.logins += 1
+                            self.reply("235 2.7.0 Authentication successful")
+                    elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self.reply("250 OK")
+                    elif verb == 'DATA':
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if not chunk or chunk in (b".\r\n", b".\n"):
+                                break
+                            lines.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                        failure = fake.take_failure()
+                        if failure == 'drop':
+                            return
+                        if failure == '451':
+                            self.reply("451 4.3.0 Try again later")
+                            continue
+                        fake.deliver(b"".join(lines))
+                        self.reply("250 OK queued")
+                    elif verb == 'QUIT':
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server((host, port), Handler)
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake SMTP server.")
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+    server = FakeSMTPServer(port=args.port)
+    host, port = server.address
+    print(f"Fake SMTP server at {host}:{port}")
+    server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Group ride matching: forms parties of up to `max_size` riders whose trips are all pairwise
+compatible, so several students on the same trains ride together instead of in pairs.
+
+The compatibility graph is the batch matcher's (candidate_pairs, optionally capped per trip).
+Groups are cliques in it, grown greedily. Time windows are intervals, so pairwise overlap implies
+the whole group shares one interval. Routes across the network are not: three trips can share
+track pairwise with no edge common to all, so a clique only grows by trips that still share an
+edge of the route bitmap AND of its members.
+
+Usable from cli_match.py (--batch --group-size N) or from a scheduler via run_groups().
+"""
+import heapq
+import time as _time
+from datetime import datetime, timedelta
+
+from batch_match import candidate_pairs, fetch_open_trips
+from matching import lock_open_trips
+from network import NETWORK
+from scoring import CandidateBatch
+
+# Default largest party
+GROUP_SIZE = 4
+
+
+def build_graph(n, a, b, w):
+    """Adjacency as a list of {neighbour: edge score} dicts (parallel edges keep the best score)."""
+    adj = [{} for _ in range(n)]
+    for i, j, s in zip(a.tolist(), b.tolist(), w.tolist()):
+        if s > adj[i].get(j, 0):
+            adj[i][j] = adj[j][i] = s
+    return adj
+
+
+def degeneracy_order(adj):
+    """
+    Smallest-last vertex order: repeatedly removes a vertex of minimum remaining degree (bucket
+    queue, linear time). Every vertex has at most `degeneracy` neighbours later in the order.
+
+    Returns:
+      (order, degeneracy)
+    """
+    n = len(adj)
+    degree = [len(nbrs) for nbrs in adj]
+    buckets = [set() for _ in range(max(degree, default=0) + 1)]
+    for v, d in enumerate(degree):
+        buckets[d].add(v)
+    removed = [False] * n
+    order, degeneracy, low = [], 0, 0
+    for _ in range(n):
+        low = max(low - 1, 0)
+        while not buckets[low]:
+            low += 1
+        v = buckets[low].pop()
+        removed[v] = True
+        order.append(v)
+        degeneracy = max(degeneracy, low)
+        for u in adj[v]:
+            if not removed[u]:
+                buckets[degree[u]].remove(u)
+                degree[u] -= 1
+                buckets[degree[u]].add(u)
+    return order, degeneracy
+
+
+def grow_clique(seed, adj, candidates, max_size, routes=None):
+    """
+    Greedy clique growth from `seed` over `candidates` (its allowed neighbours): each step adds the
+    vertex with the largest total score to the current members (lower index on ties), among those
+    adjacent to all of them. With `routes` (a route bitmap int per vertex), only vertices sharing
+    a track edge with every member are added.
+
+    Returns:
+      (members, total pairwise score)
+    """
+    members, total = [seed], 0.0
+    shared = routes[seed] if routes is not None else -1
+    gains = {u: adj[seed][u] for u in candidates}
+    while len(members) < max_size and gains:
+        u = max(gains, key=lambda x: (gains[x], -x))
+        total += gains.pop(u)
+        members.append(u)
+        if routes is not None:
+            shared &= routes[u]
+        gains = {x: g + adj[u][x] for x, g in gains.items() if x in adj[u] and (routes is None or routes[x] & shared)}
+    return members, total
+
+
+def find_groups(adj, max_size=GROUP_SIZE, min_size=2, routes=None):
+    """
+    Disjoint high-scoring cliques of min_size..max_size vertices.
+
+    Each vertex seeds one clique grown only over its neighbours later in the degeneracy order, so
+    a seed considers at most `degeneracy` vertices. Seeds are then taken best first (lazy greedy):
+    a clique is re-grown from the free vertices only when one of its members was already placed,
+    and goes back into the queue with its new score. `routes` is passed on to grow_clique.
+
+    Returns:
+      list of (members, total pairwise score), best first
+    """
+    order, _ = degeneracy_order(adj)
+    position = {v: p for p, v in enumerate(order)}
+    later = [[u for u in adj[v] if position[u] > position[v]] for v in range(len(adj))]
+
+    heap = []
+    for v in order:
+        members, total = grow_clique(v, adj, later[v], max_size, routes)
+        if len(members) >= min_size:
+            heap.append((-total, v, members))
+    heapq.heapify(heap)
+
+    used = [False] * len(adj)
+    groups = []
+    while heap:
+        neg, seed, members = heapq.heappop(heap)
+        if used[seed]:
+            continue
+        if any(used[m] for m in members):
+            members, total = grow_clique(seed, adj, [u for u in later[seed] if not used[u]], max_size, routes)
+            if len(members) >= min_size:
+                heapq.heappush(heap, (-total, seed, members))
+            continue
+        for m in members:
+            used[m] = True
+        groups.append((sorted(members), -neg))
+    groups.sort(key=lambda g: g[1], reverse=True)
+    return groups
+
+
+def group_trips(trips, max_size=GROUP_SIZE, min_size=2, max_degree=None, stats=None):
+    """
+    Groups a list of open-trip rows (the fetch_open_trips shape).
+
+    Returns:
+      list of dicts with keys trip_ids, departure, arrival, score (sum of the pairwise scores),
+      highest score first
+    """
+    batch = CandidateBatch(trips, network=NETWORK)
+    a, b, w = candidate_pairs(batch, max_degree=max_degree)
+    adj = build_graph(len(trips), a, b, w)
+    if stats is not None:
+        stats['edges'] = len(w)
+    routes = [int.from_bytes(row.tobytes(), 'little') for row in batch.routes]
+    results = []
+    for members, total in find_groups(adj, max_size, min_size, routes):
+        rows = [trips[m] for m in members]
+        results.append({
+            'trip_ids': [r['id'] for r in rows],
+            'departure': max(r['earliest'] for r in rows),
+            'arrival': min(r['latest'] for r in rows),
+            'score': total
+        })
+    return results
+
+
+def write_groups(db_conn, groups):
+    """
+    Records every group with its members and flags their trips as matched in a single transaction.
+    Like batch_match.write_matches, a group with a member taken by another worker is dropped.
+
+    groups: list of dicts with keys trip_ids, departure, arrival, score
+    Returns the number of groups written.
+    """
+    if not groups:
+        return 0
+    cursor = db_conn.cursor()
+    try:
+        open_ids = lock_open_trips(cursor, [tid for g in groups for tid in g['trip_ids']])
+        groups = [g for g in groups if all(tid in open_ids for tid in g['trip_ids'])]
+        if not groups:
+            db_conn.rollback()
+            return 0
+        for g in groups:
+            cursor.execute(
+                "INSERT INTO ride_groups (departure, arrival, score, size) VALUES (%s, %s, %s, %s)",
+                (g['departure'], g['arrival'], g['score'], len(g['trip_ids']))
+            )
+            group_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO ride_group_members (group_id, trip_id) VALUES (%s, %s)",
+                [(group_id, tid) for tid in g['trip_ids']]
+            )
+        cursor.executemany(
+            "UPDATE trips SET matched = TRUE WHERE id = %s",
+            [(tid,) for g in groups for tid in g['trip_ids']]
+        )
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(groups)
+
+
+def run_groups(db_conn, window_start=None, window_end=None, max_size=GROUP_SIZE, min_size=2, max_degree=None,
+               dry_run=False):
+    """
+    Groups every unmatched trip departing in [window_start, window_end] and writes the results.
+
+    Defaults to the next 30 minutes, like batch_match.run_batch.
+
+    Returns:
+      summary dict: trips, edges, groups, written (0 on a dry run), riders, total_score, grouped (list of
+      result dicts), seconds
+    """
+    window_start = window_start or datetime.now()
+    window_end = window_end or window_start + timedelta(minutes=30)
+    t0 = _time.perf_counter()
+    trips = fetch_open_trips(db_conn, window_start, window_end)
+    stats = {'edges': 0}
+    results = group_trips(trips, max_size=max_size, min_size=min_size, max_degree=max_degree, stats=stats)
+    written = 0 if dry_run else write_groups(db_conn, results)
+    return {
+        'trips': len(trips),
+        'edges': stats['edges'],
+        'groups': len(results),
+        'written': written,
+        'riders': sum(len(g['trip_ids']) for g in results),
+        'total_score': sum(g['score'] for g in results),
+        'grouped': results,
+        'seconds': _time.perf_counter() - t0,
+    }
@@ -0,0 +1,169 @@
+"""
+Nearest-neighbour index over rider interests for topics.find_best_match.
+
+Each profile's topics are normalized once into a set (topics.topic_tokens), so free-form
+topics are just more vocabulary. Users with the same set share one entry. Entries are found two
+ways:
+
+  approximate  MinHash LSH: every entry gets `num_perm` min-hashes of its topics, cut into bands
+               of `band_rows`; a query only looks at entries sharing a whole band with it, then
+               ranks those by exact Jaccard similarity.
+  exact        a scipy sparse binary matrix (entries x topics); one sparse product gives every
+               entry's overlap with the query, and so its Jaccard similarity.
+
+The exact mode answers a query when the bands find no entry sharing a topic, and recall()
+compares both modes on a sample. Inserts and deletes are incremental; the sparse matrix is
+rebuilt on the next exact query after a change.
+"""
+import threading
+import zlib
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from topics import topic_tokens
+
+# Mersenne prime for the universal hash family ((a * x + b) mod P)
+_PRIME = (1 << 31) - 1
+
+
+def topic_set(topics):
+    """Normalized topic set of a list (or comma-separated string), as jaccard_similarity compares them."""
+    return frozenset(topic_tokens(topics))
+
+
+def jaccard(a, b):
+    union = len(a | b)
+    return len(a & b) / union if union else 0
+
+
+class InterestIndex:
+    """
+    Users' topic sets, for best-match queries by Jaccard similarity.
+
+    num_perm: min-hashes per entry; band_rows: hashes per LSH band (num_perm // band_rows bands).
+    With the defaults (16 bands of 4) an entry with similarity 0.75 to the query is a candidate with
+    probability 1 - (1 - 0.75**4)**16, about 0.998; at 0.5 about 0.64. Profiles are a handful of
+    topics, so the best match is nearly always close; wider bands let through too many weak ones.
+    """
+
+    def __init__(self, num_perm=64, band_rows=4, seed=1):
+        if num_perm % band_rows:
+            raise ValueError("num_perm must be a multiple of band_rows")
+        rng = np.random.default_rng(seed)
+        self.band_rows = band_rows
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self.user_sets = {}     # user id -> topic set
+        self.members = {}       # topic set -> ids of users with it
+        self.bands = [{} for _ in range(num_perm // band_rows)]     # band -> {band key: topic sets}
+        self._keys = {}         # topic set -> its band keys
+        self._matrix = None     # (entries, sizes, csr matrix, vocabulary), rebuilt after changes
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.user_sets)
+
+    def __contains__(self, user_id):
+        return user_id in self.user_sets
+
+    def add(self, user_id, topics):
+        """Adds a user, or replaces their topics if already indexed."""
+        entry = topic_set(topics)
+        with self._lock:
+            if user_id in self.user_sets:
+                self.remove(user_id)
+            self.user_sets[user_id] = entry
+            users = self.members.setdefault(entry, set())
+            users.add(user_id)
+            if len(users) == 1:
+                self._matrix = None
+                if entry:
+                    keys = self._keys[entry] = self._band_keys(entry)
+                    for band, key in zip(self.bands, keys):
+                        band.setdefault(key, set()).add(entry)
+
+    def remove(self, user_id):
+        """Drops a user. Returns True if they were indexed."""
+        with self._lock:
+            entry = self.user_sets.pop(user_id, None)
+            if entry is None:
+                return False
+            users = self.members[entry]
+            users.discard(user_id)
+            if not users:
+                del self.members[entry]
+                self._matrix = None
+                for band, key in zip(self.bands, self._keys.pop(entry, ())):
+                    band[key].discard(entry)
+                    if not band[key]:
+                        del band[key]
+            return True
+
+    def query(self, topics, exact=False, stats=None):
+        """
+        The most similar users to `topics`.
+
+        Returns:
+          (score, sorted ids of every user with that Jaccard similarity), or (None, []) when empty.
+          As with a full scan, a score of 0 means no user shares a topic and every user is returned.
+        stats: optional dict, filled with mode ('lsh' or 'exact') and candidates (entries ranked)
+        """
+        q = topic_set(topics)
+        with self._lock:
+            if not self.user_sets:
+                return None, []
+            best, entries = -1, []
+            if not exact and q:
+                candidates = set()
+                for band, key in zip(self.bands, self._band_keys(q)):
+                    candidates |= band.get(key, set())
+                for entry in candidates:
+                    score = jaccard(q, entry)
+                    if score > best:
+                        best, entries = score, [entry]
+                    elif score == best:
+                        entries.append(entry)
+                if stats is not None:
+                    stats.update(mode='lsh', candidates=len(candidates))
+            if best <= 0:
+                best, entries = self._exact(q)
+                if stats is not None:
+                    stats.update(mode='exact', candidates=len(self.members))
+            return best, sorted(u for entry in entries for u in self.members[entry])
+
+    def recall(self, queries):
+        """Share of `queries` (topic lists) whose approximate best score equals the exact one."""
+        queries = list(queries)
+        hits = sum(self.query(q)[0] == self.query(q, exact=True)[0] for q in queries)
+        return hits / len(queries) if queries else 1.0
+
+    # Internal helpers
+
+    def _band_keys(self, entry):
+        x = np.fromiter((zlib.crc32(t.encode()) for t in entry), dtype=np.uint64, count=len(entry)) % _PRIME
+        signature = ((self._a[:, None] * x[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+        return [tuple(band) for band in signature.reshape(-1, self.band_rows).tolist()]
+
+    def _exact(self, q):
+        if self._matrix is None:
+            entries = list(self.members)
+            vocabulary = {}
+            rows, cols = [], []
+            for i, entry in enumerate(entries):
+                for t in entry:
+                    rows.append(i)
+                    cols.append(vocabulary.setdefault(t, len(vocabulary)))
+            matrix = csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                shape=(len(entries), max(1, len(vocabulary))))
+            sizes = np.fromiter((len(e) for e in entries), dtype=np.int64, count=len(entries))
+            self._matrix = (entries, sizes, matrix, vocabulary)
+        entries, sizes, matrix, vocabulary = self._matrix
+        vector = np.zeros(matrix.shape[1], dtype=np.int32)
+        vector[[vocabulary[t] for t in q if t in vocabulary]] = 1
+        shared = matrix @ vector
+        union = sizes + len(q) - shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(union > 0, shared / union, 0.0)
+        best = scores.max()
+        return float(best), [entries[i] for i in np.flatnonzero(scores == best)]
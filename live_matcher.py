@@ -0,0 +1,237 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+
+from network import NETWORK
+from scoring import CandidateBatch, score_batch, SKIP_NONE
+from trip_index import OpenTripIndex, open_trips
+
+# Matches kept per trip, as returned by find_matches
+TOP_K = 3
+# Trips added per lock hold while syncing; requests are served between chunks
+SYNC_CHUNK = 500
+
+log = logging.getLogger(__name__)
+
+
+class LiveMatcher:
+    """
+    Event-driven matcher that keeps every open trip's best partners current.
+
+    Each trip has a bounded min-heap of its k best partners (worst on top). A new trip is scored once
+    against the trips the OpenTripIndex says it can overlap; that gives its own top k, and because the
+    score is symmetric, the same scores are pushed into the heaps of just those partners. When a trip
+    is matched, cancelled or expires, only the heaps that held it are refilled.
+
+    matches(trip_id) returns the cached top k in the find_matches result shape without any scoring:
+    same scores, same tie-break (lower trip id first), so it equals find_matches over the same index.
+    """
+
+    def __init__(self, index=None, k=TOP_K):
+        self.index = index if index is not None else OpenTripIndex()
+        self.k = k
+        self.heaps = {}     # trip id -> min-heap of (score, -partner id)
+        self.holders = {}   # trip id -> ids of trips whose heap holds it
+        self.tops = {}      # trip id -> cached match dicts, best first
+        self.synced_at = None   # time.monotonic() of the last sync with MySQL
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._dropped = None    # trips removed while a sync is running, so it does not re-add them
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.heaps)
+
+    def rebuild(self):
+        """Recomputes every heap from the trips already in the index (e.g. after OpenTripIndex.load)."""
+        with self._lock:
+            self.heaps.clear()
+            self.holders.clear()
+            self.tops.clear()
+            for tid in sorted(self.index.trips):
+                self.heaps[tid] = []
+                self.holders.setdefault(tid, set())
+            for tid in sorted(self.index.trips):
+                self._refill(tid)
+            return len(self.heaps)
+
+    def add(self, trip):
+        """
+        Indexes a new open trip (find_matches candidate-row shape), updates the partners it affects
+        and returns its own current matches.
+        """
+        with self._lock:
+            tid = trip['id']
+            if tid in self.heaps:
+                self.remove(tid)
+            self.index.add(trip)
+            self.heaps[tid] = []
+            self.holders.setdefault(tid, set())
+            for score, other in self._score(tid):
+                self._offer(tid, score, other)
+                if self._offer(other, score, tid):
+                    self._cache(other)
+            self._cache(tid)
+            return self.tops[tid]
+
+    def remove(self, trip_id):
+        """Evicts a matched or cancelled trip. Returns True if it was live."""
+        with self._lock:
+            if self._dropped is not None:
+                # Also when not live yet: a running sync must not add it from its snapshot
+                self._dropped.add(trip_id)
+            if trip_id not in self.heaps:
+                return False
+            self.index.remove(trip_id)
+            for _, neg in self.heaps.pop(trip_id):
+                self.holders.get(-neg, set()).discard(trip_id)
+            self.tops.pop(trip_id, None)
+            for owner in sorted(self.holders.pop(trip_id, ())):
+                # The owner lost a partner; its next best may not have been kept, so rescore it
+                if owner in self.heaps:
+                    self._refill(owner)
+            return True
+
+    def expire(self, now=None):
+        """Evicts every trip whose window has ended by `now`. Returns the number removed."""
+        with self._lock:
+            stale = self.index.expired(now or datetime.now())
+            for tid in stale:
+                self.remove(tid)
+            return len(stale)
+
+    def sync(self, db_conn, now=None, chunk=SYNC_CHUNK):
+        """
+        Reconciles with the unmatched trips in MySQL, so trips added or matched by other app processes,
+        batch workers or the CLI import are picked up. Only the difference is applied: new trips are
+        added and scored, trips no longer open are removed. New trips are added `chunk` at a time,
+        releasing the lock in between, so a first build does not hold up requests. Returns (added, removed).
+        """
+        with self._sync_lock:
+            with self._lock:
+                known = set(self.heaps)
+                self._dropped = set()
+            try:
+                rows = {row['id']: row for row in open_trips(db_conn, now)}
+                with self._lock:
+                    # Trips added by requests after the snapshot are not in `rows` but are still open
+                    gone = sorted(tid for tid in known if tid not in rows and tid in self.heaps)
+                    for tid in gone:
+                        self.remove(tid)
+                new = sorted(tid for tid in rows if tid not in known)
+                added = 0
+                for i in range(0, len(new), chunk):
+                    with self._lock:
+                        for tid in new[i:i + chunk]:
+                            # Skips trips a request added or matched since the snapshot
+                            if tid not in self.heaps and tid not in self._dropped:
+                                self.add(rows[tid])
+                                added += 1
+            finally:
+                with self._lock:
+                    self._dropped = None
+            self.synced_at = time.monotonic()
+            return added, len(gone)
+
+    @property
+    def ready(self):
+        """True once the first sync has completed; until then matches() may be missing partners."""
+        return self.synced_at is not None
+
+    def start(self, connect, interval=60.0, now=None):
+        """
+        Syncs on a background thread: right away, then every `interval` seconds. `connect()` returns
+        a connection (closed after each sync) and `now()` the cutoff for finished trips. Returns self.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, args=(connect, interval, now), name='live-matcher',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sync_due(self, max_age):
+        """True if the last sync is more than `max_age` seconds old (or there was none)."""
+        return self.synced_at is None or time.monotonic() - self.synced_at > max_age
+
+    def matches(self, trip_id):
+        """Current best matches for a trip (empty if it is not live)."""
+        return self.tops.get(trip_id, [])
+
+    # Internal helpers
+
+    def _loop(self, connect, interval, now):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                conn = connect()
+                try:
+                    added, removed = self.sync(conn, now() if now is not None else None)
+                finally:
+                    conn.close()
+                log.debug("Live matcher synced: %s added, %s removed in %.2fs", added, removed,
+                          time.monotonic() - started)
+            except Exception:
+                # A failed round (database down) is retried on the next one
+                log.exception("Live matcher sync failed")
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def _score(self, tid):
+        """(score, partner id) for every valid partner of a live trip."""
+        trip = self.index.trips[tid][0]
+        if trip['cand_origin'] not in NETWORK or trip['cand_dest'] not in NETWORK:
+            # find_matches rejects such a trip, and every other trip skips it as an unknown station
+            return []
+        candidates = self.index.candidates(tid, trip['cand_origin'], trip['cand_dest'], trip['earliest'],
+                                           trip['latest'])
+        batch = CandidateBatch(candidates, network=NETWORK)
+        res = score_batch(batch, trip['earliest'], trip['latest'], trip['fastest_seconds'], trip['interests'],
+                          route=NETWORK.route_mask(trip['cand_origin'], trip['cand_dest']))
+        valid = res['skip'] == SKIP_NONE
+        return [(float(s), c['id']) for s, c, ok in zip(res['score'], candidates, valid) if ok]
+
+    def _offer(self, owner, score, other):
+        """Pushes `other` into `owner`'s heap if it ranks in the top k. Returns True if the heap changed."""
+        heap = self.heaps[owner]
+        entry = (score, -other)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            _, dropped = heapq.heapreplace(heap, entry)
+            self.holders.get(-dropped, set()).discard(owner)
+        else:
+            return False
+        self.holders.setdefault(other, set()).add(owner)
+        return True
+
+    def _refill(self, owner):
+        for _, neg in self.heaps[owner]:
+            self.holders.get(-neg, set()).discard(owner)
+        self.heaps[owner] = []
+        for score, other in self._score(owner):
+            self._offer(owner, score, other)
+        self._cache(owner)
+
+    def _cache(self, owner):
+        trip = self.index.trips[owner][0]
+        out = []
+        for score, neg in sorted(self.heaps[owner], reverse=True):
+            other = self.index.trips[-neg][0]
+            out.append({
+                'trip_id': -neg,
+                'email': other['email'],
+                'interests': other['interests'],
+                'departure': max(trip['earliest'], other['earliest']),
+                'arrival': min(trip['latest'], other['latest']),
+                'score': score,
+            })
+        self.tops[owner] = out
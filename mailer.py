@@ -0,0 +1,266 @@
+"""
+Outbound mail: a background worker that delivers queued messages over one persistent,
+authenticated SMTP connection, so request handlers only enqueue.
+
+Messages are sent in batches over the same connection (reconnecting and logging in again only
+after the server drops it or it sat idle), paced by a rate limit, and retried with exponential
+backoff on transient failures. stats() reports the queue depth and recent send latency.
+"""
+import heapq
+import itertools
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from email.message import EmailMessage
+
+from metrics import counter, histogram
+
+MAIL_SEND_SECONDS = histogram('mail_send_seconds', 'SMTP round trip per message (connect and login included)')
+MAIL_OUTCOMES = counter('mail_messages_total', 'Delivery attempts by outcome')
+
+log = logging.getLogger(__name__)
+
+
+def verification_message(receiver_email, token, sender_address):
+    """The sign-up verification email carrying the 6-digit code."""
+    body = f"""
+Hello!
+
+Thanks for signing up for the Maroon Line RideShare app.
+
+Your 6-digit verification code is: {token}
+
+Please enter this code in the app to complete your verification.
+
+If you did not request this, you can ignore this email.
+
+Thanks,
+The Maroon Line Team
+"""
+    em = EmailMessage()
+    em['From'] = sender_address
+    em['To'] = receiver_email
+    em['Subject'] = "Maroon Line: Verify Your Email"
+    em.set_content(body)
+    return em
+
+
+class Mailer:
+    """
+    Queue plus delivery worker for one SMTP account.
+
+    host/port/use_ssl/starttls select the transport (SMTP_SSL on 465 for Gmail, STARTTLS on 587,
+    or plain SMTP for a local stand-in); username/password are used to log in once per connection.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, starttls=False, batch_size=20,
+                 rate=5.0, max_retries=5, backoff=1.0, max_backoff=60.0, idle_timeout=60.0, timeout=30.0):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.use_ssl, self.starttls = use_ssl, starttls
+        self.batch_size = batch_size
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self.max_retries = max_retries
+        self.backoff, self.max_backoff = backoff, max_backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._heap = []     # (due, seq, attempts, enqueued_at, message)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._stop = False
+        self._thread = None
+        self._smtp = None
+        self._last_send = 0.0
+        self._latencies = deque(maxlen=500)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connections = 0
+
+    # Public API
+
+    def send(self, message):
+        """Queues an email.message.EmailMessage for delivery; returns immediately."""
+        now = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._heap, (now, next(self._seq), 0, now, message))
+            self._cond.notify()
+
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, name='mailer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain=True, timeout=30.0):
+        """Stops the worker, after delivering what is queued if `drain`."""
+        if drain:
+            self.flush(timeout)
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def flush(self, timeout=30.0):
+        """Waits until every queued message was sent or given up on. Returns True if the queue drained."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._in_flight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._heap) + self._in_flight
+            latencies = sorted(self._latencies)
+            sent, failed, retries, connections = self.sent, self.failed, self.retries, self.connections
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+        return {
+            'queued': depth,
+            'sent': sent,
+            'failed': failed,
+            'retries': retries,
+            'connections': connections,
+            'latency_p50': pct(0.50),
+            'latency_p95': pct(0.95),
+            'latency_max': latencies[-1] if latencies else None,
+        }
+
+    # Worker
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if not batch:
+                # Idle: let the server forget us rather than hold a connection open
+                self._disconnect()
+                continue
+            try:
+                for job in batch:
+                    try:
+                        self._deliver(job)
+                    except Exception:
+                        # e.g. a malformed header: this message can never be sent, the next ones may
+                        log.exception("Dropping a message that could not be sent")
+                        MAIL_OUTCOMES.inc(outcome='failed')
+                        with self._cond:
+                            self.failed += 1
+            finally:
+                # Otherwise flush() would wait for these forever
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+        self._disconnect()
+
+    def _next_batch(self):
+        """Due jobs (up to batch_size), [] after idle_timeout with nothing due, None once stopped."""
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                        batch.append(heapq.heappop(self._heap))
+                    self._in_flight += len(batch)
+                    return batch
+                wait = self._heap[0][0] - now if self._heap else self.idle_timeout
+                if not self._cond.wait(min(wait, self.idle_timeout)) and not self._heap:
+                    return []
+
+    def _deliver(self, job):
+        _, _, attempts, enqueued_at, message = job
+        # Rate limit: space sends at least min_interval apart
+        gap = self._last_send + self.min_interval - time.monotonic()
+        if gap > 0:
+            time.sleep(gap)
+        started = time.monotonic()
+        try:
+            self._connection().send_message(message)
+        except (smtplib.SMTPException, OSError) as e:
+            code = getattr(e, 'smtp_code', None)
+            if isinstance(e, smtplib.SMTPResponseException):
+                # 4xx is "try again later"; 5xx will not get better
+                transient = 400 <= e.smtp_code < 500
+            elif isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException):
+                # Dropped connection or network error (SMTPException itself subclasses OSError)
+                self._disconnect()
+                transient = True
+            else:
+                # e.g. every recipient refused
+                transient = False
+            outcome = 'failed' if not transient or attempts + 1 >= self.max_retries else 'retry'
+            log.warning("Mail to %s %s on attempt %d (SMTP code %s)", message['To'],
+                        'failed' if outcome == 'failed' else 'will be retried', attempts + 1, code, exc_info=True)
+        else:
+            outcome = 'sent'
+        finally:
+            self._last_send = time.monotonic()
+            MAIL_SEND_SECONDS.observe(self._last_send - started)
+        MAIL_OUTCOMES.inc(outcome=outcome)
+        with self._cond:
+            if outcome == 'sent':
+                self.sent += 1
+                self._latencies.append(time.monotonic() - enqueued_at)
+            elif outcome == 'failed':
+                self.failed += 1
+            else:
+                self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempts)
+                heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), attempts + 1, enqueued_at,
+                                            message))
+
+    def _connection(self):
+        if self._smtp is None:
+            if self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.host, self.port, context=ssl.create_default_context(),
+                                        timeout=self.timeout)
+            else:
+                smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                if self.starttls:
+                    smtp.starttls(context=ssl.create_default_context())
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+            with self._cond:
+                self.connections += 1
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+
+_mailers = {}
+_mailers_lock = threading.Lock()
+
+
+def shared_mailer(host, port, username=None, password=None, use_ssl=True, starttls=False):
+    """The process-wide started Mailer for one SMTP account, created on first use."""
+    key = (host, port, username, use_ssl, starttls)
+    with _mailers_lock:
+        mailer = _mailers.get(key)
+        if mailer is None:
+            mailer = _mailers[key] = Mailer(host, port, username, password, use_ssl=use_ssl,
+                                            starttls=starttls).start()
+        return mailer
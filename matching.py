@@ -1,109 +1,340 @@
-from math import sqrt
-from cta_api import red_line_stations
+import logging
+from contextlib import nullcontext
+from datetime import timedelta
 
-# Pre-compute station indices for segment overlap
+from cta_api import red_line_stations, TRDR_SOUTHBOUND, TRDR_NORTHBOUND
+from db import fetch_all
+from metrics import span
+from network import NETWORK
+from migrations import SOUTHBOUND, NORTHBOUND
+from topics import interest_mask, is_canonical
+from scoring import (CandidateBatch, score_batch, bounded_top_k, top_k, SKIP_NONE, SKIP_UNKNOWN_STATION,
+                     SKIP_NO_SEGMENT_OVERLAP, SKIP_NO_TIME_OVERLAP, SKIP_NO_FASTEST)
+
+log = logging.getLogger(__name__)
+
+# Red Line positions, as stored in the generated trips.seg_start / seg_end columns (run matching
+# prefilters on them); route overlap itself is checked on network.NETWORK bitmaps
 STATION_LIST = list(red_line_stations.keys())
 INDEX_MAP = {station: idx for idx, station in enumerate(STATION_LIST)}
 
+# Candidate query for find_matches; run as a server-side prepared statement. The window and
+# segment filters are served by idx_trips_open_window (see migrations.py). The segment filter is a
+# Red Line prefilter only (see red_line_bounds): trips with a station off the Red Line have NULL
+# segments and are always returned, and shared track is checked on the network bitmaps. Ordered
+# by id so ties in top_k break the same way as with OpenTripIndex.candidates.
+_CANDIDATE_WHERE = """
+    SELECT t.id,
+           t.origin AS cand_origin, t.destination AS cand_dest,
+           t.earliest, t.latest, t.fastest_seconds,
+           p.email, p.interests
+    FROM trips t
+    JOIN profiles p ON t.profile_id = p.id
+    WHERE t.matched = FALSE
+      AND t.id != %s
+      AND t.earliest < %s
+      AND t.latest > %s
+      AND (t.seg_start IS NULL OR (t.seg_start < %s AND t.seg_end > %s))
+"""
+CANDIDATE_SQL = _CANDIDATE_WHERE + "    ORDER BY t.id\n"
+# Same, dropping candidates that share no registry topic with the rider (last parameter: rider's mask)
+SHARED_CANDIDATE_SQL = _CANDIDATE_WHERE + "      AND BIT_COUNT(p.interest_mask & %s) > 0\n    ORDER BY t.id\n"
+
+# Run-based matching: trip_runs rows of other open trips on the same trains (see migrations.py).
+# A run number is reused through the day, so rows are also bounded to the rider's boarding times
+# widened by RUN_SPAN (longer than a full end-to-end Red Line trip).
+RUN_SPAN = timedelta(minutes=75)
+RUN_DIRECTION = {TRDR_SOUTHBOUND: SOUTHBOUND, TRDR_NORTHBOUND: NORTHBOUND}
+
+
+def run_candidate_sql(n_runs):
+    """Candidate query for find_run_matches, for a rider with `n_runs` candidate runs."""
+    return """
+    SELECT t.id,
+           t.origin AS cand_origin, t.destination AS cand_dest,
+           t.earliest, t.latest, t.fastest_seconds,
+           p.email, p.interests,
+           r.run_number, r.board_time, r.alight_time
+    FROM trip_runs r
+    JOIN trips t ON r.trip_id = t.id
+    JOIN profiles p ON t.profile_id = p.id
+    WHERE t.matched = FALSE
+      AND t.id != %s
+      AND t.seg_start < %s
+      AND t.seg_end > %s
+      AND r.direction = %s
+      AND r.board_time > %s
+      AND r.board_time < %s
+      AND r.run_number IN ({})
+    ORDER BY t.id
+""".format(", ".join(["%s"] * n_runs))
+
+
+def red_line_bounds(origin, destination):
+    """
+    (end, start) parameters for the candidate queries' segment prefilter. Two trips with both ends
+    on the Red Line share track only if their Red Line segments overlap; a rider with a station
+    elsewhere can share Red Line track with any trip, so the bounds then admit every segment.
+    """
+    o_idx, d_idx = INDEX_MAP.get(origin), INDEX_MAP.get(destination)
+    if o_idx is None or d_idx is None:
+        return len(STATION_LIST), -1
+    start, end = sorted([o_idx, d_idx])
+    return end, start
+
+
+def record_trip_runs(db_conn, trip_id, runs):
+    """Stores the runs (cta_api.candidate_runs) a trip can board. The caller commits."""
+    cursor = db_conn.cursor()
+    cursor.executemany(
+        "INSERT INTO trip_runs (trip_id, run_number, direction, board_time, alight_time) VALUES (%s, %s, %s, %s, %s)",
+        [(trip_id, r['run_number'], RUN_DIRECTION[r['trdr']], r['board_time'], r['alight_time']) for r in runs]
+    )
+    cursor.close()
+
+
+def lock_open_trips(cursor, trip_ids, chunk=1000):
+    """
+    Locks the still-open trips among `trip_ids` for the current transaction and returns their ids.
+
+    SKIP LOCKED leaves out rows another matcher holds right now instead of waiting for it, so
+    concurrent claimers never block each other: a busy trip simply counts as taken.
+    """
+    ids = sorted(set(trip_ids))
+    locked = set()
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        # Locks are taken in id order, so two claimers can never wait on each other in a cycle
+        cursor.execute(
+            "SELECT id FROM trips WHERE matched = FALSE AND id IN ({}) ORDER BY id FOR UPDATE SKIP LOCKED"
+            .format(", ".join(["%s"] * len(part))),
+            part
+        )
+        locked.update(row[0] if isinstance(row, tuple) else row['id'] for row in cursor.fetchall())
+    return locked
+
+
+def claim_match(db_conn, trip_id, partner_id, departure, arrival, score):
+    """
+    Atomically pairs two open trips: locks both, records the match and flags both as matched in one
+    short transaction. Returns False (and changes nothing) if either trip is already matched or
+    being claimed by someone else.
+    """
+    cursor = db_conn.cursor()
+    try:
+        if len(lock_open_trips(cursor, [trip_id, partner_id])) < 2:
+            db_conn.rollback()
+            return False
+        cursor.execute(
+            "INSERT INTO matches (trip_a, trip_b, departure, arrival, score) VALUES (%s, %s, %s, %s, %s)",
+            (trip_id, partner_id, departure, arrival, score)
+        )
+        cursor.execute("UPDATE trips SET matched = TRUE WHERE id IN (%s, %s)", (trip_id, partner_id))
+        db_conn.commit()
+        return True
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def claim_best(db_conn, trip_id, matches, on_taken=None, rescore=None):
+    """
+    Claims the best still-available partner among `matches` (find_matches results). Returns it, or None.
+
+    A partner someone else claimed first is passed to on_taken (e.g. LiveMatcher.remove, so it is not
+    offered again). Once every offered partner is taken, rescore() supplies the next list to try (e.g.
+    the refilled LiveMatcher.matches, then find_matches over MySQL); partners already tried are skipped.
+    """
+    tried = set()
+    while matches:
+        for m in matches:
+            tried.add(m['trip_id'])
+            if claim_match(db_conn, trip_id, m['trip_id'], m['departure'], m['arrival'], m['score']):
+                return m
+            if not _is_open(db_conn, trip_id):
+                # This trip was claimed by another rider; the partner may still be free
+                return None
+            if on_taken is not None:
+                on_taken(m['trip_id'])
+        matches = [m for m in rescore() if m['trip_id'] not in tried] if rescore is not None else []
+    return None
+
+
+def _is_open(db_conn, trip_id):
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute("SELECT matched FROM trips WHERE id = %s", (trip_id,))
+        row = cursor.fetchone()
+        return row is not None and not (row[0] if isinstance(row, tuple) else row['matched'])
+    finally:
+        cursor.close()
+
 
-def find_matches(db_conn, trip_id, origin, destination, earliest, latest, fastest, interests, verbose=False):
+def find_matches(db_conn, trip_id, origin, destination, earliest, latest, fastest, interests, verbose=False,
+                 index=None, check_consistency=False, stats=None, shared_only=False, profile=None):
     """
-    Finds matching riders whose travel windows and route segments overlap, using each trip's stored origin/destination.
+    Finds matching riders whose travel windows overlap and whose routes share track, using each trip's stored
+    origin/destination.
 
     Parameters:
       db_conn: MySQL connection
       trip_id: ID of the new trip
-      origin, destination: station names for the new trip
+      origin, destination: station names for the new trip (any station in network.NETWORK)
       earliest, latest: datetime bounds
       fastest: fastest travel time in seconds for new trip
       interests: comma-separated string of interests for new trip
-      verbose: if True, prints debug info to console
+      verbose: if True, scores every candidate and logs each one's outcome (INFO on this module's logger)
+      index: optional OpenTripIndex of open trips; when given, candidates come from it instead of MySQL
+      check_consistency: if True (with index), cross-checks the index against MySQL and reloads it on drift
+      stats: optional dict, filled with candidate counts (candidates, valid, scored, pruned)
+      shared_only: if True, only riders sharing at least one interest (similarity > 0) are returned
+      profile: optional profiler.Profiler; the call's db_query and scoring stages are recorded in it
 
     Returns:
-      List of up to 3 best match dicts with keys: email, interests, departure, arrival, score
+      List of up to 3 best match dicts with keys: trip_id, email, interests, departure, arrival, score
     """
-    # Map indices for the new trip
-    o_idx = INDEX_MAP.get(origin)
-    d_idx = INDEX_MAP.get(destination)
-    if o_idx is None or d_idx is None:
-        raise ValueError(f"Unknown station: {origin} or {destination}")
-    start1, end1 = sorted([o_idx, d_idx])
+    with profile if profile is not None else nullcontext():
+        return _find_matches(db_conn, trip_id, origin, destination, earliest, latest, fastest, interests, verbose,
+                             index, check_consistency, stats, shared_only)
+
+
+def _find_matches(db_conn, trip_id, origin, destination, earliest, latest, fastest, interests, verbose, index,
+                  check_consistency, stats, shared_only):
+    # Route bitmap for the new trip (ValueError for a station outside the network)
+    route = NETWORK.route_mask(origin, destination)
 
     # Fetch candidates
-    cursor = db_conn.cursor(dictionary=True)
-    cursor.execute(
-        """
-        SELECT t.id,
-               t.origin AS cand_origin, t.destination AS cand_dest,
-               t.earliest, t.latest, t.fastest_seconds,
-               p.email, p.interests
-        FROM trips t
-        JOIN profiles p ON t.profile_id = p.id
-        WHERE t.matched = FALSE
-          AND t.id != %s
-          AND t.earliest < %s
-          AND t.latest > %s
-        """,
-        (trip_id, latest, earliest)
-    )
-    candidates = cursor.fetchall()
-    cursor.close()
+    if index is not None:
+        if check_consistency:
+            missing, extra = index.verify(db_conn, trip_id, origin, destination, earliest, latest)
+            if missing or extra:
+                log.warning("Trip index out of sync (missing=%s, extra=%s); reloading from MySQL", missing, extra)
+                index.load(db_conn)
+        candidates = index.candidates(trip_id, origin, destination, earliest, latest)
+    elif shared_only and is_canonical(interests):
+        # Exact for registry-only interests: no common topic bit means no common interest
+        candidates = fetch_all(db_conn, SHARED_CANDIDATE_SQL,
+                               (trip_id, latest, earliest, *red_line_bounds(origin, destination),
+                                interest_mask(interests)))
+    else:
+        candidates = fetch_all(db_conn, CANDIDATE_SQL,
+                               (trip_id, latest, earliest, *red_line_bounds(origin, destination)))
 
-    topics_a = set(i.strip() for i in interests.split(','))
-    scored = []
+    if not verbose:
+        # Visit candidates by their overlap-only score bound and stop once none can make the top 3
+        with span('scoring'):
+            batch = CandidateBatch(candidates, network=NETWORK)
+            best, scores = bounded_top_k(batch, earliest, latest, fastest, interests, 3, route=route, stats=stats)
+        return [_match(candidates[i], earliest, latest, score) for i, score in zip(best, scores)
+                if score > 0 or not shared_only]
 
-    for cand in candidates:
+    # Verbose: score all candidates at once so every one can be reported
+    with span('scoring'):
+        batch = CandidateBatch(candidates, network=NETWORK)
+        res = score_batch(batch, earliest, latest, fastest, interests, route=route)
+    for i, cand in enumerate(candidates):
         bo = cand['cand_origin']; bd = cand['cand_dest']
-        b_o = INDEX_MAP.get(bo); b_d = INDEX_MAP.get(bd)
-        if b_o is None or b_d is None:
-            if verbose:
-                print(f"Skipping {cand['email']}: unknown station {bo} or {bd}")
-            continue
-        start2, end2 = sorted([b_o, b_d])
-
-        # Segment overlap check
-        if end1 <= start2 or end2 <= start1:
-            if verbose:
-                print(f"No segment overlap: {origin}->{destination} vs {bo}->{bd}")
-            continue
-        if verbose:
-            print(f"Segment overlap ok for {cand['email']}")
-
-        # Time overlap
-        overlap = min(latest, cand['latest']) - max(earliest, cand['earliest'])
-        ov_sec = overlap.total_seconds()
-        if ov_sec <= 0:
-            if verbose:
-                print(f"No time overlap with {cand['email']}")
-            continue
-        if verbose:
-            print(f"Time overlap {ov_sec}s with {cand['email']}")
-
-        # Fastest check
-        bf = cand['fastest_seconds']
-        if not fastest or not bf:
-            if verbose:
-                print(f"Skipping {cand['email']}: missing fastest_seconds")
-            continue
-
-        # Compute metrics
-        closeness = ov_sec / max(fastest, bf)
-        topics_b = set(i.strip() for i in cand['interests'].split(','))
-        sim = (len(topics_a & topics_b) / sqrt(len(topics_a) * len(topics_b))) if topics_a and topics_b else 0
-        score = ov_sec * closeness * sim
-        depart = max(earliest, cand['earliest'])
-        arr = min(latest, cand['latest'])
-
-        if verbose:
-            print(f"Candidate {cand['email']}: closeness={closeness:.3f}, sim={sim:.3f}, score={score:.3f}")
-
-        scored.append({
-            'email': cand['email'],
-            'interests': cand['interests'],
-            'departure': depart,
-            'arrival': arr,
-            'score': score
-        })
-
-    scored.sort(key=lambda x: x['score'], reverse=True)
-    return scored[:3]
+        skip = res['skip'][i]
+        if skip == SKIP_UNKNOWN_STATION:
+            log.info("Skipping %s: unknown station %s or %s", cand['email'], bo, bd)
+        elif skip == SKIP_NO_SEGMENT_OVERLAP:
+            log.info("No shared track: %s->%s vs %s->%s", origin, destination, bo, bd)
+        elif skip == SKIP_NO_TIME_OVERLAP:
+            log.info("No time overlap with %s", cand['email'])
+        elif skip == SKIP_NO_FASTEST:
+            log.info("Skipping %s: missing fastest_seconds", cand['email'])
+        else:
+            log.info("Candidate %s: overlap=%ss, closeness=%.3f, sim=%.3f, score=%.3f", cand['email'],
+                     res['overlap'][i], res['closeness'][i], res['similarity'][i], res['score'][i])
+
+    valid = res['skip'] == SKIP_NONE
+    best = top_k(res['score'], valid, 3)
+    if stats is not None:
+        stats.update(candidates=len(candidates), valid=int(valid.sum()), scored=int(valid.sum()), pruned=0)
+    return [_match(candidates[i], earliest, latest, res['score'][i]) for i in best
+            if res['score'][i] > 0 or not shared_only]
+
+
+def _match(cand, earliest, latest, score):
+    return {
+        'trip_id': cand['id'],
+        'email': cand['email'],
+        'interests': cand['interests'],
+        'departure': max(earliest, cand['earliest']),
+        'arrival': min(latest, cand['latest']),
+        'score': float(score)
+    }
+
+
+def find_run_matches(db_conn, trip_id, origin, destination, fastest, interests, runs, stats=None):
+    """
+    Finds riders who can board the same train, in the same direction, as the new trip.
+
+    Instead of intersecting time windows, candidates are the open trips sharing one of the rider's
+    candidate runs (a join on trip_runs.run_number). For each shared run the pair rides together
+    from the later boarding to the earlier alighting, and that interval is scored with the
+    find_matches formula; a trip's run without a predicted alighting time is assumed to take its
+    fastest_seconds. Each candidate counts once, on its best shared run.
+
+    Parameters:
+      db_conn: MySQL connection
+      trip_id: ID of the new trip (its own trip_runs rows are ignored)
+      origin, destination: station names for the new trip
+      fastest: fastest travel time in seconds for new trip
+      interests: comma-separated string of interests for new trip
+      runs: the trip's runs, as returned by cta_api.candidate_runs
+      stats: optional dict, filled with candidates (joined rows) and valid counts
+
+    Returns:
+      List of up to 3 best match dicts with keys: trip_id, email, interests, departure, arrival, score,
+      run_number
+    """
+    route = NETWORK.route_mask(origin, destination)
+    if not runs:
+        if stats is not None:
+            stats.update(candidates=0, valid=0)
+        return []
+
+    # Runs are Red Line trains, so the SQL prefilter can use the stored Red Line segments
+    o_idx, d_idx = INDEX_MAP[origin], INDEX_MAP[destination]
+    mine = {r['run_number']: (r['board_time'], _alight(r['board_time'], r['alight_time'], fastest)) for r in runs}
+    boards = [r['board_time'] for r in runs]
+    start1, end1 = sorted([o_idx, d_idx])
+    rows = fetch_all(db_conn, run_candidate_sql(len(mine)),
+                     (trip_id, end1, start1, RUN_DIRECTION[runs[0]['trdr']], min(boards) - RUN_SPAN, max(boards) + RUN_SPAN,
+                      *mine))
+
+    # Hash join on run number: group the rows by the rider's run they share
+    by_run = {}
+    for row in rows:
+        board, _ = mine[row['run_number']]
+        if abs(row['board_time'] - board) < RUN_SPAN:
+            by_run.setdefault(row['run_number'], []).append(
+                dict(row, earliest=row['board_time'],
+                     latest=_alight(row['board_time'], row['alight_time'], row['fastest_seconds'])))
+
+    best = {}
+    valid = 0
+    with span('scoring'):
+        for run_number, cands in by_run.items():
+            board, alight = mine[run_number]
+            res = score_batch(CandidateBatch(cands, network=NETWORK), board, alight, fastest, interests, route=route)
+            for cand, score, skip in zip(cands, res['score'], res['skip']):
+                if skip != SKIP_NONE:
+                    continue
+                valid += 1
+                if cand['id'] not in best or score > best[cand['id']][0]:
+                    best[cand['id']] = (float(score), cand, board, alight)
+    if stats is not None:
+        stats.update(candidates=len(rows), valid=valid)
+
+    # Best first, lower trip id on ties (as in find_matches)
+    ranked = sorted(best.values(), key=lambda b: (-b[0], b[1]['id']))[:3]
+    return [dict(_match(cand, board, alight, score), run_number=cand['run_number'])
+            for score, cand, board, alight in ranked]
+
+
+def _alight(board, alight, fastest):
+    return alight if alight is not None else board + timedelta(seconds=fastest or 0)
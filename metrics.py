@@ -0,0 +1,294 @@
+"""
+In-process instrumentation: a registry of counters, gauges and latency histograms, timing spans
+for the request stages, and logging setup.
+
+Everything records into the module-level REGISTRY. Dump it with to_json() / to_prometheus(), or
+serve both over HTTP for a local scraper:
+
+    server = MetricsServer(port=9108).start()
+    curl http://127.0.0.1:9108/metrics        # Prometheus text format
+    curl http://127.0.0.1:9108/metrics.json
+
+Request stages are timed with span():
+
+    with span('db_query'):
+        rows = cursor.fetchall()
+
+which observes the elapsed seconds in the `stage_seconds` histogram under stage="db_query".
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Seconds; spans everything from an in-memory scoring pass to a slow CTA round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(key):
+    pairs = list(key)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help=''):
+        self.name, self.help = name, help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return {_label_text(key) or '': value for key, value in sorted(self._values.items())}
+
+
+class Gauge:
+    """Current value read from a callback at dump time (e.g. a queue depth)."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, fn, help=''):
+        self.name, self.help, self.fn = name, help, fn
+
+    def samples(self):
+        try:
+            return [(self.name, (), self.fn())]
+        except Exception:
+            log.exception("Gauge %s failed", self.name)
+            return []
+
+    def snapshot(self):
+        samples = self.samples()
+        return {'': samples[0][2]} if samples else {}
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label key -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_key(labels))
+            return sum(series[0]) if series else 0
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                running = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    running += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append((self.name + '_bucket', key + (('le', le),), running))
+                out.append((self.name + '_sum', key, total))
+                out.append((self.name + '_count', key, running))
+        return out
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for key, (counts, total) in sorted(self._series.items()):
+                n = sum(counts)
+                out[_label_text(key) or ''] = {'count': n, 'sum': total, 'mean': total / n if n else None,
+                                               'buckets': dict(zip([repr(b) for b in self.buckets] + ['+Inf'],
+                                                                   counts))}
+            return out
+
+
+class Registry:
+    """Named metrics; asking for an existing name returns the same metric."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(name, lambda: Counter(name, help))
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._get(name, lambda: Histogram(name, help, buckets))
+
+    def gauge(self, name, fn, help=''):
+        """Registers (or re-points) a gauge read from fn()."""
+        with self._lock:
+            metric = self._metrics[name] = Gauge(name, fn, help)
+            return metric
+
+    def to_json(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return json.dumps({m.name: {'type': m.kind, 'values': m.snapshot()} for m in metrics}, sort_keys=True,
+                          default=str)
+
+    def to_prometheus(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for m in metrics:
+            if m.help:
+                lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, key, value in m.samples():
+                lines.append(f"{name}{_label_text(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('stage_seconds', 'Wall time per request stage')
+
+
+def counter(name, help=''):
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name, help='', buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def gauge(name, fn, help=''):
+    return REGISTRY.gauge(name, fn, help)
+
+
+# Callbacks (path, wall seconds, thread CPU seconds) run after every span, e.g. a profiler.Profiler
+_span_listeners = []
+_local = threading.local()
+
+
+def add_span_listener(fn):
+    _span_listeners.append(fn)
+
+
+def remove_span_listener(fn):
+    _span_listeners.remove(fn)
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block into stage_seconds{stage=...} (also when it raises)."""
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(stage)
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        path = tuple(stack)
+        stack.pop()
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        log.debug("%s took %.2f ms", stage, elapsed * 1000)
+        if _span_listeners:
+            cpu = time.thread_time() - cpu_start
+            for fn in list(_span_listeners):
+                fn(path, elapsed, cpu)
+
+
+# Loggers of this project's modules; third-party libraries (urllib3, streamlit, ...) stay at WARNING
+PROJECT_LOGGERS = ('cta_api', 'cta_client', 'live_matcher', 'mailer', 'matching', 'metrics', 'profiler',
+                   'station_poller', 'travel_matrix')
+
+
+def configure_logging(level=None):
+    """
+    Logging for the app and CLIs: the root logger at WARNING, the project loggers at `level`
+    (default $LOG_LEVEL, else WARNING).
+    """
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    level = (level or os.getenv('LOG_LEVEL', 'WARNING')).upper()
+    for name in PROJECT_LOGGERS:
+        logging.getLogger(name).setLevel(level)
+
+
+class MetricsServer:
+    """Serves REGISTRY at /metrics (Prometheus text) and /metrics.json on a background thread."""
+
+    def __init__(self, registry=None, host='127.0.0.1', port=0):
+        # Imported here: most processes never serve metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry = registry or REGISTRY
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, ctype = registry.to_json().encode(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, ctype = registry.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
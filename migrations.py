@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the ride-match database.
+
+db.init_db creates the original tables; the migrations below bring an existing database up to
+date in place. Applied versions are recorded in `schema_migrations`, and a MySQL named lock keeps
+two app processes from migrating at the same time.
+
+  1. trips.origin / trips.destination (backfilled from the rider's profile)
+  2. trips.seg_start / seg_end / direction, generated from the station positions
+  3. composite indexes for the candidate window and segment filters
+  4. profiles.interest_mask, the registry topics (topics.TOPIC_BITS) generated from the text
+  5. trip_runs, the CTA runs each trip can board (run-based matching joins on run_number)
+  6. ride_groups / ride_group_members, parties formed by group_match.py
+  7. archive tables that retention.py moves finished trips (and their matches) into
+  8. ride_groups_archive, for parties whose members have all been archived
+  9. drops trips.direction and idx_trips_open_segment again (no query filters on them)
+
+check_query_plans() EXPLAINs the hot queries and reports any that fall back to a full scan.
+
+Usage:
+    python migrations.py migrate
+    python migrations.py status
+    python migrations.py explain     # exits 1 if a hot query does a full table scan
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from cta_api import red_line_stations
+from topics import TOPIC_BITS
+
+STATION_LIST = list(red_line_stations.keys())
+SOUTHBOUND, NORTHBOUND = 0, 1   # same encoding as travel_matrix.py
+LOCK_NAME = 'ridematch_schema_migrations'
+
+
+def _station_field(column):
+    """1-based position of `column` in the Red Line station list, 0 for an unknown station."""
+    names = ", ".join("'" + name.replace("'", "''") + "'" for name in STATION_LIST)
+    return f"FIELD({column}, {names})"
+
+
+def interest_mask_sql(column='interests', sqlite=False):
+    """SQL for topics.interest_mask(column): one bit per registry topic found in the lowercased, space-free list."""
+    text = f"LOWER(REPLACE(COALESCE({column}, ''), ' ', ''))"
+    if sqlite:
+        found = "(instr(',' || {text} || ',', ',{topic},') > 0)"
+    else:
+        found = "(FIND_IN_SET('{topic}', {text}) > 0)"
+    return " | ".join(f"({found.format(text=text, topic=topic)} << {bit})" for topic, bit in TOPIC_BITS.items())
+
+
+def _has_column(cursor, table, column):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def _has_index(cursor, table, index):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index)
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def add_trip_stations(cursor):
+    # app.py has always written these; databases created by init_db lack them
+    for column in ('origin', 'destination'):
+        if not _has_column(cursor, 'trips', column):
+            cursor.execute(f"ALTER TABLE trips ADD COLUMN {column} VARCHAR(50)")
+    cursor.execute(
+        """
+        UPDATE trips t JOIN profiles p ON t.profile_id = p.id
+        SET t.origin = p.origin, t.destination = p.destination
+        WHERE t.origin IS NULL AND t.destination IS NULL
+        """
+    )
+
+
+def add_segment_columns(cursor):
+    # Stored generated columns: always consistent with origin/destination, and indexable.
+    # NULL when either station is unknown, matching the -1 "unknown" convention in scoring.py.
+    o, d = _station_field('origin'), _station_field('destination')
+    known = f"{o} > 0 AND {d} > 0"
+    columns = {
+        'seg_start': f"CASE WHEN {known} THEN LEAST({o}, {d}) - 1 END",
+        'seg_end': f"CASE WHEN {known} THEN GREATEST({o}, {d}) - 1 END",
+        'direction': f"CASE WHEN {known} AND {d} > {o} THEN {SOUTHBOUND} "
+                     f"WHEN {known} AND {d} < {o} THEN {NORTHBOUND} END",
+    }
+    for column, expr in columns.items():
+        if not _has_column(cursor, 'trips', column):
+            cursor.execute(f"ALTER TABLE trips ADD COLUMN {column} TINYINT AS ({expr}) STORED")
+
+
+def add_trip_indexes(cursor):
+    indexes = {
+        # find_matches / batch_match: open trips in a time window, segment checked from the index
+        'idx_trips_open_window': "(matched, earliest, latest, seg_start, seg_end)",
+        # direction-aware lookups over a station range
+        'idx_trips_open_segment': "(matched, direction, seg_start, seg_end)",
+    }
+    for name, columns in indexes.items():
+        if not _has_index(cursor, 'trips', name):
+            cursor.execute(f"CREATE INDEX {name} ON trips {columns}")
+
+
+def add_interest_mask(cursor):
+    # Generated, so it can never drift from the text; candidate queries prefilter on it with BIT_COUNT
+    if not _has_column(cursor, 'profiles', 'interest_mask'):
+        cursor.execute(f"ALTER TABLE profiles ADD COLUMN interest_mask BIGINT UNSIGNED AS ({interest_mask_sql()}) STORED")
+
+
+def add_trip_runs(cursor):
+    # One row per train run a trip could catch; matching.find_run_matches joins trips on run_number
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trip_runs (
+            trip_id INT NOT NULL,
+            run_number VARCHAR(8) NOT NULL,
+            direction TINYINT NOT NULL,
+            board_time DATETIME NOT NULL,
+            alight_time DATETIME NULL,
+            PRIMARY KEY (trip_id, run_number, board_time),
+            INDEX idx_trip_runs_run (run_number, direction, board_time),
+            FOREIGN KEY (trip_id) REFERENCES trips(id) ON DELETE CASCADE
+        )"""
+    )
+
+
+def add_ride_groups(cursor):
+    # A party of two or more trips; `matches` stays the pairwise record
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ride_groups (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            departure DATETIME,
+            arrival DATETIME,
+            score FLOAT,
+            size TINYINT NOT NULL
+        )"""
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ride_group_members (
+            group_id INT NOT NULL,
+            trip_id INT NOT NULL,
+            PRIMARY KEY (group_id, trip_id),
+            INDEX idx_ride_group_members_trip (trip_id),
+            FOREIGN KEY (group_id) REFERENCES ride_groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (trip_id) REFERENCES trips(id)
+        )"""
+    )
+
+
+def add_archive_tables(cursor):
+    # Plain copies of the hot rows (no generated columns or foreign keys), filled by retention.py
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trips_archive (
+            id INT PRIMARY KEY,
+            profile_id INT,
+            origin VARCHAR(50),
+            destination VARCHAR(50),
+            earliest DATETIME,
+            latest DATETIME,
+            matched BOOLEAN,
+            fastest_seconds INT,
+            archived_at DATETIME,
+            INDEX idx_trips_archive_latest (latest)
+        )"""
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS matches_archive (
+            id INT PRIMARY KEY,
+            trip_a INT,
+            trip_b INT,
+            departure DATETIME,
+            arrival DATETIME,
+            score FLOAT,
+            archived_at DATETIME
+        )"""
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ride_group_members_archive (
+            group_id INT NOT NULL,
+            trip_id INT NOT NULL,
+            archived_at DATETIME,
+            PRIMARY KEY (group_id, trip_id)
+        )"""
+    )
+
+
+def add_group_archive(cursor):
+    # retention.py moves a party here once its last member is archived
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ride_groups_archive (
+            id INT PRIMARY KEY,
+            departure DATETIME,
+            arrival DATETIME,
+            score FLOAT,
+            size TINYINT NOT NULL,
+            archived_at DATETIME
+        )"""
+    )
+    # Parties emptied by retention runs before this migration
+    orphaned = "NOT EXISTS (SELECT 1 FROM ride_group_members m WHERE m.group_id = g.id)"
+    cursor.execute(
+        "INSERT INTO ride_groups_archive (id, departure, arrival, score, size, archived_at) "
+        f"SELECT g.id, g.departure, g.arrival, g.score, g.size, NOW() FROM ride_groups g WHERE {orphaned}"
+    )
+    cursor.execute(f"DELETE g FROM ride_groups g WHERE {orphaned}")
+
+
+def drop_trip_direction(cursor):
+    # Window matching pairs riders whose routes share track in either direction, and run matching
+    # reads trip_runs.direction, so nothing filters on trips.direction; the index only slowed writes
+    if _has_index(cursor, 'trips', 'idx_trips_open_segment'):
+        cursor.execute("DROP INDEX idx_trips_open_segment ON trips")
+    if _has_column(cursor, 'trips', 'direction'):
+        cursor.execute("ALTER TABLE trips DROP COLUMN direction")
+
+
+# (version, name, function(cursor)); append only, never renumber
+MIGRATIONS = [
+    (1, 'trip origin/destination columns', add_trip_stations),
+    (2, 'trip segment and direction columns', add_segment_columns),
+    (3, 'trip window and segment indexes', add_trip_indexes),
+    (4, 'profile interest bitmask', add_interest_mask),
+    (5, 'trip candidate runs', add_trip_runs),
+    (6, 'ride groups', add_ride_groups),
+    (7, 'archive tables', add_archive_tables),
+    (8, 'ride group archive', add_group_archive),
+    (9, 'drop trip direction', drop_trip_direction),
+]
+
+
+def applied_versions(db_conn):
+    cursor = db_conn.cursor()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100),
+            applied_at DATETIME
+        )"""
+    )
+    cursor.execute("SELECT version FROM schema_migrations")
+    versions = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return versions
+
+
+def migrate(db_conn, verbose=False):
+    """Applies pending migrations in order. Returns the list of versions applied."""
+    cursor = db_conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, 60)", (LOCK_NAME,))
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        raise RuntimeError("Timed out waiting for another process to finish migrating")
+    applied = []
+    try:
+        done = applied_versions(db_conn)
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            if verbose:
+                print(f"Applying migration {version}: {name}")
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                (version, name, datetime.now())
+            )
+            db_conn.commit()
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchall()
+        cursor.close()
+    return applied
+
+
+def hot_queries():
+    """Queries on the request path, as {label: (sql, params(now))} with representative parameters."""
+    from batch_match import OPEN_TRIPS_SQL
+    from matching import CANDIDATE_SQL, SHARED_CANDIDATE_SQL, run_candidate_sql
+    from retention import EXPIRED_SQL, lock_expired_sql
+    return {
+        'find_matches candidates': (CANDIDATE_SQL, lambda now: (0, now, now, len(STATION_LIST), 0)),
+        'find_matches shared-interest candidates': (SHARED_CANDIDATE_SQL,
+                                                    lambda now: (0, now, now, len(STATION_LIST), 0, 1)),
+        'batch open trips': (OPEN_TRIPS_SQL, lambda now: (now, now)),
+        'run-matching candidates': (run_candidate_sql(1),
+                                    lambda now: (0, len(STATION_LIST), 0, SOUTHBOUND, now, now, '000')),
+        'retention batch': (EXPIRED_SQL, lambda now: (now, now, 500)),
+        'retention lock': (lock_expired_sql(3), lambda now: (1, 2, 3, now)),
+    }
+
+
+def check_query_plans(db_conn, now=None, min_rows=1000):
+    """
+    EXPLAINs each hot query and returns a list of (query, table, access type) for every full scan
+    of `trips`; an empty list means all of them use an index. A scan counts when no index could
+    serve the query at all, or when the optimizer expects to read at least `min_rows` rows (on a
+    near-empty table MySQL legitimately prefers scanning).
+    """
+    now = now or datetime.now()
+    problems = []
+    cursor = db_conn.cursor(dictionary=True)
+    for label, (sql, params) in hot_queries().items():
+        cursor.execute("EXPLAIN " + sql, params(now))
+        for row in cursor.fetchall():
+            if row.get('table') not in ('t', 'trips') or row.get('type') not in ('ALL', 'index'):
+                continue
+            if not row.get('possible_keys') or (row.get('rows') or 0) >= min_rows:
+                problems.append((label, row['table'], row['type']))
+    cursor.close()
+    return problems
+
+
+def main():
+    from dotenv import load_dotenv
+    from db import config_from_env, get_db_connection
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Apply and inspect schema migrations.")
+    parser.add_argument('command', choices=['migrate', 'status', 'explain'])
+    args = parser.parse_args()
+
+    conn = get_db_connection(config_from_env())
+    try:
+        if args.command == 'migrate':
+            applied = migrate(conn, verbose=True)
+            print(f"Applied {len(applied)} migration(s)")
+        elif args.command == 'status':
+            done = applied_versions(conn)
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:3d}  {'applied' if version in done else 'pending':8s} {name}")
+        else:
+            problems = check_query_plans(conn)
+            for label, table, access in problems:
+                print(f"FULL SCAN: {label} ({table}: type={access})")
+            if problems:
+                sys.exit(1)
+            print("All hot queries use an index")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+The CTA 'L' network, loaded from a data file (cta_network.json) instead of one hard-coded line.
+
+Every pair of consecutive stations on a line is one track edge, numbered in file order; a line's
+branches share the edges of its trunk because edges belong to the route code, not the branch. A
+rider between two stations takes the route with the fewest transfers, then the fewest stops, and
+that route is kept as a bitmap over the edges (a row of uint64 words). All pairs are computed
+together on first use, so two trips ride some stretch of track together exactly when the AND of
+their bitmaps is non-zero, on one line or across transfers.
+
+Trips with origin == destination ride no track and overlap nothing.
+"""
+import heapq
+import json
+import os
+
+import numpy as np
+
+DEFAULT_PATH = os.getenv('CTA_NETWORK_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cta_network.json'))
+# Rough running time per track edge, and per change of line, for routes live planning does not cover
+HOP_SECONDS = 110
+TRANSFER_SECONDS = 300
+
+
+class Network:
+    """
+    Stations, lines and all-pairs route bitmaps.
+
+    Attributes:
+      stations: station name -> CTA map id, in first-listed order
+      index: station name -> row in `masks`
+      lines: list of (name, rt, [station names])
+      edges: list of (rt, station a, station b), one per bit
+      masks: uint64 array [origin, destination, word] of route bitmaps
+      transfers: [origin, destination] number of line changes on the route
+    """
+
+    def __init__(self, lines, transfers=()):
+        self.lines = []
+        self.stations = {}
+        for name, rt, stops in lines:
+            for station, map_id in stops:
+                if self.stations.setdefault(station, map_id) != map_id:
+                    raise ValueError(f"Station {station!r} listed with map ids {self.stations[station]} and {map_id}")
+            self.lines.append((name, rt, [station for station, _ in stops]))
+        self.index = {name: i for i, name in enumerate(self.stations)}
+        self.names = list(self.stations)
+        for a, b in transfers:
+            if a not in self.index or b not in self.index:
+                raise ValueError(f"Transfer between unknown stations {a!r} and {b!r}")
+        self.walks = [tuple(pair) for pair in transfers]
+
+        self.edges = []
+        edge_ids = {}
+        for _, rt, stops in self.lines:
+            for a, b in zip(stops, stops[1:]):
+                key = (rt, frozenset((a, b)))
+                if a != b and key not in edge_ids:
+                    edge_ids[key] = len(self.edges)
+                    self.edges.append((rt, a, b))
+        self._edge_ids = edge_ids
+        self.words = max(1, (len(self.edges) + 63) // 64)
+        self._masks = self._transfers = None
+        self._edge_lists = {}
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        return cls([(line['name'], line['rt'], line['stations']) for line in data['lines']],
+                   data.get('transfers', ()))
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, station):
+        return station in self.index
+
+    @property
+    def masks(self):
+        # All pairs are routed on first use (about 0.2s for the full 'L'), not at import
+        if self._masks is None:
+            self._masks, self._transfers = self._all_routes()
+        return self._masks
+
+    @property
+    def transfers(self):
+        self.masks
+        return self._transfers
+
+    def line_stations(self, name):
+        """{station name: map id} along one line, in order (e.g. 'Red')."""
+        for line, _, stops in self.lines:
+            if line == name:
+                return {station: self.stations[station] for station in stops}
+        raise KeyError(name)
+
+    def route_mask(self, origin, destination):
+        """Edge bitmap (uint64 words) of the route between two stations; ValueError if either is unknown."""
+        o, d = self.index.get(origin), self.index.get(destination)
+        if o is None or d is None:
+            raise ValueError(f"Unknown station: {origin} or {destination}")
+        return self.masks[o, d]
+
+    def route_masks(self, origins, destinations):
+        """
+        Bitmaps for many (origin, destination) pairs at once.
+
+        Returns:
+          (masks, known): uint64 [n, words] rows (zero where a station is unknown) and a bool array
+        """
+        n = len(origins)
+        o = np.fromiter((self.index.get(s, -1) for s in origins), dtype=np.int64, count=n)
+        d = np.fromiter((self.index.get(s, -1) for s in destinations), dtype=np.int64, count=n)
+        known = (o >= 0) & (d >= 0)
+        masks = self.masks[np.where(known, o, 0), np.where(known, d, 0)]
+        masks[~known] = 0
+        return masks, known
+
+    def route_edges(self, origin, destination):
+        """Edge ids (bit positions) of the route, ascending; ValueError if a station is unknown."""
+        key = (origin, destination)
+        edges = self._edge_lists.get(key)
+        if edges is None:
+            bits = np.unpackbits(self.route_mask(origin, destination).view(np.uint8), bitorder='little')
+            edges = self._edge_lists[key] = tuple(np.flatnonzero(bits).tolist())
+        return edges
+
+    def estimate_seconds(self, origin, destination):
+        """Travel time estimate from the route's length and line changes; None if a station is unknown or equal."""
+        o, d = self.index.get(origin), self.index.get(destination)
+        if o is None or d is None or o == d:
+            return None
+        hops = len(self.route_edges(origin, destination))
+        return hops * HOP_SECONDS + int(self.transfers[o, d]) * TRANSFER_SECONDS
+
+    def overlaps(self, a, b):
+        """True if routes a and b ((origin, destination) pairs) share a track edge."""
+        return bool((self.route_mask(*a) & self.route_mask(*b)).any())
+
+    def _all_routes(self):
+        """Route bitmaps and transfer counts for every station pair, one search per origin."""
+        n = len(self.stations)
+        # Riding states are (station, rt); rt None means on foot at the station (start, or changing lines)
+        rides = {}
+        for _, rt, stops in self.lines:
+            for a, b in zip(stops, stops[1:]):
+                if a != b:
+                    bit = 1 << self._edge_ids[(rt, frozenset((a, b)))]
+                    rides.setdefault((self.index[a], rt), []).append((self.index[b], bit))
+                    rides.setdefault((self.index[b], rt), []).append((self.index[a], bit))
+        boards = {}
+        for s, rt in rides:
+            boards.setdefault(s, []).append(rt)
+        walks = {}
+        for a, b in self.walks:
+            walks.setdefault(self.index[a], []).append(self.index[b])
+            walks.setdefault(self.index[b], []).append(self.index[a])
+        rt_order = {rt: i for i, rt in enumerate(dict.fromkeys(rt for _, rt, _ in self.lines))}
+
+        masks = np.zeros((n, n, self.words), dtype=np.uint64)
+        transfers = np.zeros((n, n), dtype=np.int16)
+        for origin in range(n):
+            best = self._routes_from(origin, rides, boards, walks, rt_order)
+            for dest, (changes, bits) in best.items():
+                transfers[origin, dest] = changes
+                masks[origin, dest] = np.frombuffer(bits.to_bytes(self.words * 8, 'little'), dtype=np.uint64)
+        return masks, transfers
+
+    @staticmethod
+    def _routes_from(origin, rides, boards, walks, rt_order):
+        """
+        Dijkstra over riding states by (transfers, stops), ties broken by station and line order.
+        Returns {station: (transfers, edge bitmap as an int)} for every reachable station.
+        """
+        heap = [(0, 0, origin, -1, None, 0)]
+        settled = set()
+        best = {}
+        while heap:
+            changes, stops, s, order, rt, bits = heapq.heappop(heap)
+            if (s, rt) in settled:
+                continue
+            settled.add((s, rt))
+            # The first state settled at a station is the best way to reach it
+            best.setdefault(s, (changes, bits))
+            if rt is None:
+                for line in boards.get(s, ()):
+                    heapq.heappush(heap, (changes, stops, s, rt_order[line], line, bits))
+                for t in walks.get(s, ()):
+                    heapq.heappush(heap, (changes, stops, t, -1, None, bits))
+            else:
+                for t, bit in rides[(s, rt)]:
+                    heapq.heappush(heap, (changes, stops + 1, t, order, rt, bits | bit))
+                # Changing lines (or walking on) counts one transfer, unless it is the first boarding
+                heapq.heappush(heap, (changes + 1, stops, s, -1, None, bits))
+        best[origin] = (0, 0)
+        return best
+
+
+NETWORK = Network.load()
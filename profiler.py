@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Profiling for one match request: a per-stage wall/CPU breakdown, an optional cProfile dump,
+and recorded CTA responses so a slow request can be replayed offline.
+
+A Profiler collects every metrics.span() closed on its thread while it is active, keyed by the
+nesting path (e.g. plan_trip/cta_fetch), so the time of a request splits into the CTA round
+trips, the MySQL queries and the scoring:
+
+    with Profiler(cprofile=True) as prof:
+        find_matches(...)               # or find_matches(..., profile=prof)
+    print(prof.format_report())
+    prof.save('trace.json')             # comparable with `python profiler.py diff`
+    prof.dump_cprofile('trace.prof')    # python -m pstats trace.prof
+
+A CTARecording captures what cta_api.get_arrivals returned, together with the time it was read,
+and serves those exact arrivals back in replay mode (cta_api.use_recording).
+
+Usage:
+    python cli_match.py ... --profile [--trace trace.json] [--cprofile trace.prof] [--record-cta cta.json]
+    python cli_match.py ... --profile --replay-cta cta.json --trace replay.json
+    python profiler.py show trace.json
+    python profiler.py diff before.json after.json
+"""
+import argparse
+import cProfile
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """Per-stage wall and thread-CPU totals for the spans closed on the entering thread."""
+
+    def __init__(self, cprofile=False, label=''):
+        self.label = label
+        self.stages = {}        # 'parent/child' -> [calls, wall seconds, cpu seconds]
+        self.wall = self.cpu = 0.0
+        self._cprofile = cProfile.Profile() if cprofile else None
+        self._thread = None
+        self._depth = 0
+
+    def __enter__(self):
+        # Re-entrant: find_matches(profile=...) inside a CLI-wide profile records once
+        self._depth += 1
+        if self._depth == 1:
+            self._thread = threading.get_ident()
+            metrics.add_span_listener(self._on_span)
+            self._start, self._cpu_start = time.perf_counter(), time.process_time()
+            if self._cprofile is not None:
+                self._cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if self._cprofile is not None:
+                self._cprofile.disable()
+            self.wall += time.perf_counter() - self._start
+            self.cpu += time.process_time() - self._cpu_start
+            metrics.remove_span_listener(self._on_span)
+
+    def _on_span(self, path, wall, cpu):
+        if threading.get_ident() != self._thread:
+            return
+        entry = self.stages.setdefault('/'.join(path), [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+
+    def report(self):
+        """JSON-ready trace: totals, per-stage calls/wall/cpu, and the wall time outside any stage."""
+        top = sum(wall for name, (_, wall, _) in self.stages.items() if '/' not in name)
+        return {
+            'label': self.label,
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'unattributed': max(self.wall - top, 0.0),
+            'stages': {name: {'calls': calls, 'wall': wall, 'cpu': cpu}
+                       for name, (calls, wall, cpu) in sorted(self.stages.items())},
+        }
+
+    def format_report(self):
+        return format_trace(self.report())
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def dump_cprofile(self, path):
+        if self._cprofile is None:
+            raise ValueError("Profiler was created without cprofile=True")
+        self._cprofile.dump_stats(path)
+
+
+def format_trace(trace):
+    """Fixed-width stage table; nested stages are indented under their parent."""
+    total = trace['wall'] or 1e-12
+    lines = [f"Profile {trace['label']}".rstrip() + f": wall {trace['wall'] * 1000:.1f} ms, "
+             f"cpu {trace['cpu'] * 1000:.1f} ms",
+             f"  {'stage':<28} {'calls':>6} {'wall ms':>10} {'cpu ms':>10} {'% wall':>7}"]
+    rows = list(trace['stages'].items()) + [('(unattributed)', {'calls': '', 'wall': trace['unattributed'],
+                                                                'cpu': None})]
+    for name, s in rows:
+        parts = name.split('/')
+        label = '  ' * (len(parts) - 1) + parts[-1]
+        cpu = '' if s['cpu'] is None else f"{s['cpu'] * 1000:.1f}"
+        lines.append(f"  {label:<28} {s['calls']:>6} {s['wall'] * 1000:>10.1f} {cpu:>10} "
+                     f"{100 * s['wall'] / total:>6.1f}%")
+    return "\n".join(lines)
+
+
+def format_diff(before, after):
+    """Per-stage wall time of two traces side by side, with the change."""
+    lines = [f"  {'stage':<28} {'before ms':>10} {'after ms':>10} {'change':>8}"]
+    names = sorted(set(before['stages']) | set(after['stages']))
+    rows = [(n, before['stages'].get(n, {}).get('wall'), after['stages'].get(n, {}).get('wall')) for n in names]
+    rows.append(('(total)', before['wall'], after['wall']))
+    for name, a, b in rows:
+        change = f"{100 * (b - a) / a:+.0f}%" if a and b is not None else ''
+        fmt = lambda v: '-' if v is None else f"{v * 1000:.1f}"
+        lines.append(f"  {name:<28} {fmt(a):>10} {fmt(b):>10} {change:>8}")
+    return "\n".join(lines)
+
+
+class CTARecording:
+    """
+    Arrivals per station map_id, as returned to the app, plus the moment they were read.
+
+    In record mode get_arrivals() stores each station's first answer; in replay mode every lookup
+    is answered from the file (no HTTP, no cache, no live timetable). Replays should plan against
+    `recorded_at`, since the arrivals are absolute times.
+    """
+
+    def __init__(self, recorded_at=None, responses=None, replaying=False):
+        self.recorded_at = recorded_at
+        self.responses = responses if responses is not None else {}
+        self.replaying = replaying
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(datetime.fromisoformat(data['recorded_at']), data['responses'], replaying=True)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'recorded_at': self.recorded_at.isoformat(), 'responses': self.responses}, f, indent=1)
+
+    def add(self, map_id, etas):
+        with self._lock:
+            self.responses.setdefault(map_id, list(etas))
+
+    def arrivals(self, map_id):
+        etas = self.responses.get(map_id)
+        if etas is None:
+            log.warning("No recorded arrivals for map_id %s; replaying an empty response", map_id)
+            return []
+        return etas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compare saved profile traces.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('show', help='Print one trace')
+    show.add_argument('trace')
+    diff = sub.add_parser('diff', help='Compare the stage times of two traces')
+    diff.add_argument('before')
+    diff.add_argument('after')
+    args = parser.parse_args()
+
+    def read(path):
+        with open(path) as f:
+            return json.load(f)
+    if args.command == 'show':
+        print(format_trace(read(args.trace)))
+    else:
+        print(format_diff(read(args.before), read(args.after)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Retention: moves finished trips out of the hot `trips` table so the candidate query and its
+indexes only ever cover live and recent rows.
+
+A trip is finished once its window ended before the cutoff (default: an hour ago), matched or
+not. Each batch is one short transaction: the trips are copied to trips_archive, their matches
+to matches_archive and their group memberships to ride_group_members_archive, parties left with
+no members to ride_groups_archive, their trip_runs are dropped, and the hot rows are deleted. Candidates are read without locks and then locked by
+primary key, so a batch locks only the rows it moves; rows a matcher is claiming right now are
+skipped (SKIP LOCKED) and picked up by a later run, so retention never waits on the request path.
+
+Run it from a scheduler, e.g. every 15 minutes from cron:
+    python retention.py [--cutoff 2025-04-28T00:00] [--batch-size 500] [--pause 0.05] [--dry-run]
+"""
+import argparse
+import time as _time
+from datetime import datetime, timedelta
+
+# Trips whose window ended less than this long ago stay hot (late claims, same-day lookups)
+RETENTION_GRACE = timedelta(hours=1)
+# Trips moved per transaction; keeps each batch's locks and undo log small
+RETENTION_BATCH = 500
+
+# Finished trips, read without locks. latest >= earliest, so the earliest bound lets a range scan
+# on idx_trips_open_window (matched, earliest, latest, ...) serve it for both matched values; with
+# no ORDER BY the scan stops after LIMIT index entries instead of reading the whole backlog.
+EXPIRED_SQL = """
+    SELECT id FROM trips
+    WHERE matched IN (FALSE, TRUE)
+      AND earliest < %s
+      AND latest < %s
+    LIMIT %s
+"""
+
+
+def lock_expired_sql(n):
+    """
+    Locks `n` candidate ids by primary key, so a batch only ever locks the rows it moves. Rows a
+    matcher holds right now are skipped; the latest check re-reads each row under its lock.
+    """
+    return (f"SELECT id FROM trips WHERE id IN ({', '.join(['%s'] * n)}) AND latest < %s "
+            "ORDER BY id FOR UPDATE SKIP LOCKED")
+
+TRIP_COLUMNS = "id, profile_id, origin, destination, earliest, latest, matched, fastest_seconds"
+MATCH_COLUMNS = "id, trip_a, trip_b, departure, arrival, score"
+GROUP_COLUMNS = "id, departure, arrival, score, size"
+
+
+def _in(ids):
+    return "({})".format(", ".join(["%s"] * len(ids)))
+
+
+def count_trips(db_conn, cutoff=None):
+    """Rows in the hot table, and how many of them are finished as of `cutoff`."""
+    cursor = db_conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM trips")
+    total = cursor.fetchone()[0]
+    expired = 0
+    if cutoff is not None:
+        cursor.execute("SELECT COUNT(*) FROM trips WHERE latest < %s", (cutoff,))
+        expired = cursor.fetchone()[0]
+    cursor.close()
+    return total, expired
+
+
+def archive_batch(db_conn, cutoff, batch_size=RETENTION_BATCH, now=None):
+    """
+    Moves up to `batch_size` finished trips (and their dependent rows) to the archive tables in
+    one transaction.
+
+    Returns:
+      dict of rows moved: trips, matches, group_members, groups, runs (trip_runs deleted)
+    """
+    now = now or datetime.now()
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(EXPIRED_SQL, (cutoff, cutoff, batch_size))
+        candidates = [row[0] for row in cursor.fetchall()]
+        ids = []
+        if candidates:
+            cursor.execute(lock_expired_sql(len(candidates)), candidates + [cutoff])
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            db_conn.rollback()
+            return {'trips': 0, 'matches': 0, 'group_members': 0, 'groups': 0, 'runs': 0}
+        pair = ids + ids
+        cursor.execute(
+            f"INSERT INTO matches_archive ({MATCH_COLUMNS}, archived_at) "
+            f"SELECT {MATCH_COLUMNS}, %s FROM matches WHERE trip_a IN {_in(ids)} OR trip_b IN {_in(ids)}",
+            [now] + pair
+        )
+        matches = cursor.rowcount
+        cursor.execute(f"DELETE FROM matches WHERE trip_a IN {_in(ids)} OR trip_b IN {_in(ids)}", pair)
+        cursor.execute(
+            f"INSERT INTO ride_group_members_archive (group_id, trip_id, archived_at) "
+            f"SELECT group_id, trip_id, %s FROM ride_group_members WHERE trip_id IN {_in(ids)}",
+            [now] + ids
+        )
+        members = cursor.rowcount
+        cursor.execute(f"SELECT DISTINCT group_id FROM ride_group_members WHERE trip_id IN {_in(ids)}", ids)
+        group_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"DELETE FROM ride_group_members WHERE trip_id IN {_in(ids)}", ids)
+        groups = 0
+        if group_ids:
+            # A party leaves the hot table with its last member; one spanning batches waits for the later one
+            cursor.execute(
+                f"SELECT id FROM ride_groups WHERE id IN {_in(group_ids)} "
+                f"AND NOT EXISTS (SELECT 1 FROM ride_group_members m WHERE m.group_id = ride_groups.id)",
+                group_ids
+            )
+            emptied = [row[0] for row in cursor.fetchall()]
+            if emptied:
+                cursor.execute(
+                    f"INSERT INTO ride_groups_archive ({GROUP_COLUMNS}, archived_at) "
+                    f"SELECT {GROUP_COLUMNS}, %s FROM ride_groups WHERE id IN {_in(emptied)}",
+                    [now] + emptied
+                )
+                groups = cursor.rowcount
+                cursor.execute(f"DELETE FROM ride_groups WHERE id IN {_in(emptied)}", emptied)
+        cursor.execute(f"DELETE FROM trip_runs WHERE trip_id IN {_in(ids)}", ids)
+        runs = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO trips_archive ({TRIP_COLUMNS}, archived_at) "
+            f"SELECT {TRIP_COLUMNS}, %s FROM trips WHERE id IN {_in(ids)}",
+            [now] + ids
+        )
+        cursor.execute(f"DELETE FROM trips WHERE id IN {_in(ids)}", ids)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return {'trips': len(ids), 'matches': matches, 'group_members': members, 'groups': groups, 'runs': runs}
+
+
+def run_retention(db_conn, cutoff=None, batch_size=RETENTION_BATCH, max_batches=None, pause=0.0, dry_run=False):
+    """
+    Archives finished trips in batches until none are left (or `max_batches` ran), sleeping `pause`
+    seconds between batches to leave the database to request traffic.
+
+    Returns:
+      compaction report: cutoff, before, after (rows in trips), expired (finished rows found at the
+      start), archived (dict of rows moved per table), batches, seconds
+    """
+    cutoff = cutoff or datetime.now() - RETENTION_GRACE
+    t0 = _time.perf_counter()
+    before, expired = count_trips(db_conn, cutoff)
+    archived = {'trips': 0, 'matches': 0, 'group_members': 0, 'groups': 0, 'runs': 0}
+    batches = 0
+    while not dry_run and (max_batches is None or batches < max_batches):
+        moved = archive_batch(db_conn, cutoff, batch_size)
+        if not moved['trips']:
+            break
+        batches += 1
+        for key, n in moved.items():
+            archived[key] += n
+        if pause:
+            _time.sleep(pause)
+    after = count_trips(db_conn)[0] if not dry_run else before
+    return {
+        'cutoff': cutoff,
+        'before': before,
+        'after': after,
+        'expired': expired,
+        'archived': archived,
+        'batches': batches,
+        'seconds': _time.perf_counter() - t0,
+    }
+
+
+def format_report(report):
+    archived = report['archived']
+    moved = report['before'] - report['after']
+    share = moved / report['before'] if report['before'] else 0.0
+    return (f"Retention before {report['cutoff']}: trips {report['before']} -> {report['after']} rows "
+            f"({share:.1%} compacted, {report['expired']} finished), archived {archived['trips']} trips, "
+            f"{archived['matches']} matches, {archived['group_members']} group members, "
+            f"{archived['groups']} groups, dropped "
+            f"{archived['runs']} trip runs in {report['batches']} batches ({report['seconds']:.2f}s)")
+
+
+def main():
+    from dotenv import load_dotenv
+    from db import config_from_env, get_db_connection
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Archive finished trips out of the hot trips table.")
+    parser.add_argument('--cutoff', help='Archive trips that ended before this time (YYYY-MM-DDTHH:MM)')
+    parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH, help='Trips moved per transaction')
+    parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+    parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+    parser.add_argument('--dry-run', action='store_true', help='Only report how many trips would move')
+    args = parser.parse_args()
+
+    conn = get_db_connection(config_from_env())
+    try:
+        report = run_retention(conn, datetime.fromisoformat(args.cutoff) if args.cutoff else None,
+                               args.batch_size, args.max_batches, args.pause, args.dry_run)
+    finally:
+        conn.close()
+    print(format_report(report) + (" [dry run]" if args.dry_run else ""))
+
+
+if __name__ == '__main__':
+    main()
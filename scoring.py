@@ -0,0 +1,300 @@
+from datetime import datetime, timedelta
+import numpy as np
+
+from topics import TOPIC_BITS, topic_tokens
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+# Reasons a candidate is dropped before scoring (SKIP_NONE means it was scored)
+SKIP_NONE = 0
+SKIP_UNKNOWN_STATION = 1
+SKIP_NO_SEGMENT_OVERLAP = 2
+SKIP_NO_TIME_OVERLAP = 3
+SKIP_NO_FASTEST = 4
+
+# Candidates scored per step of bounded_top_k
+BOUND_BLOCK = 256
+
+
+def epoch_us(dt):
+    """Microseconds since the Unix epoch for a naive datetime (exact, so overlaps match timedelta math)."""
+    return (dt - _EPOCH) // _ONE_US
+
+
+def split_interests(interests):
+    """Interest tokens of a comma-separated string, normalized as everywhere else (topics.topic_tokens)."""
+    return topic_tokens(interests)
+
+
+class TopicVocabulary:
+    """
+    Maps interest tokens to bit positions. Seeded with the topic registry, so registry topics take the
+    same bits as in profiles.interest_mask; unseen tokens get fresh bits so free-form interests still
+    count exactly as they do with Python sets.
+    """
+
+    def __init__(self, topics=TOPIC_BITS):
+        self.bits = {}
+        self._token_sets = {}
+        for t in topics:
+            self.bit(t)
+
+    def bit(self, token):
+        if token not in self.bits:
+            self.bits[token] = len(self.bits)
+        return self.bits[token]
+
+    def tokens(self, interests):
+        """split_interests, memoized per interests string (riders often share the exact same list)."""
+        tokens = self._token_sets.get(interests)
+        if tokens is None:
+            tokens = self._token_sets[interests] = split_interests(interests)
+        return tokens
+
+    @property
+    def words(self):
+        return max(1, (len(self.bits) + 63) // 64)
+
+    def mask(self, tokens, words=None):
+        """Packs a set of tokens into a row of uint64 words."""
+        out = np.zeros(words or self.words, dtype=np.uint64)
+        for t in tokens:
+            b = self.bit(t)
+            out[b // 64] |= np.uint64(1) << np.uint64(b % 64)
+        return out
+
+
+class CandidateBatch:
+    """
+    Column-array form of candidate rows (the dicts returned by the candidate queries).
+
+    Columns: start/end (int64 epoch microseconds), fastest (int64 seconds, 0 when missing),
+    routes (uint64 route bitmap words from network.Network, zero when a station is unknown),
+    known (both stations in the network), masks (uint64 topic bitmask words).
+    """
+
+    def __init__(self, rows, network=None, vocab=None):
+        self.rows = rows
+        self.vocab = vocab or TopicVocabulary()
+        n = len(rows)
+        self.start = np.fromiter((epoch_us(r['earliest']) for r in rows), dtype=np.int64, count=n)
+        self.end = np.fromiter((epoch_us(r['latest']) for r in rows), dtype=np.int64, count=n)
+        self.fastest = np.fromiter((r['fastest_seconds'] or 0 for r in rows), dtype=np.int64, count=n)
+
+        if network is not None:
+            self.routes, self.known = network.route_masks([r['cand_origin'] for r in rows],
+                                                          [r['cand_dest'] for r in rows])
+        else:
+            self.routes = self.known = None
+
+        # Topic masks are the costly column; built on first use (or per row with masks_for)
+        self._masks = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def masks(self):
+        if self._masks is None:
+            self._masks = self.masks_for(range(len(self.rows)))
+        return self._masks
+
+    @masks.setter
+    def masks(self, value):
+        self._masks = value
+
+    def masks_for(self, idx):
+        """Topic masks of rows `idx` only, as wide as the vocabulary once their tokens are registered."""
+        # Register every token first so all masks share one width
+        token_sets = [self.vocab.tokens(self.rows[i]['interests']) for i in idx]
+        for tokens in token_sets:
+            for t in tokens:
+                self.vocab.bit(t)
+        words = self.vocab.words
+        out = np.zeros((len(token_sets), words), dtype=np.uint64)
+        for j, tokens in enumerate(token_sets):
+            out[j] = self.vocab.mask(tokens, words)
+        return out
+
+    @property
+    def sizes(self):
+        """Number of distinct interest tokens per row (popcount of its mask)."""
+        return np.bitwise_count(self.masks).sum(axis=1, dtype=np.int64)
+
+    def query_mask(self, interests):
+        """Bitmask for the requesting rider, widened to the batch's word count."""
+        mask = self.vocab.mask(self.vocab.tokens(interests))
+        if len(mask) > self.masks.shape[1]:
+            # The query introduced new tokens; they cannot intersect, so just pad the batch
+            pad = np.zeros((len(self.rows), len(mask) - self.masks.shape[1]), dtype=np.uint64)
+            self.masks = np.hstack([self.masks, pad])
+        return mask
+
+
+def score_batch(batch, earliest, latest, fastest, interests, route=None, require_fastest=True):
+    """
+    Scores every candidate in `batch` against one rider with array operations.
+
+    Parameters:
+      batch: CandidateBatch of candidate rows
+      earliest, latest: datetime bounds of the rider's window
+      fastest: rider's fastest travel time in seconds
+      interests: rider's comma-separated interests
+      route: the rider's route bitmap (network.Network.route_mask); None skips the route check
+      require_fastest: drop candidates when either fastest time is missing (find_matches rule)
+
+    Returns:
+      dict of arrays: overlap, closeness, similarity, score, skip (SKIP_* code per candidate)
+    """
+    n = len(batch)
+    if n == 0:
+        empty = np.zeros(0)
+        return {'overlap': empty, 'closeness': empty, 'similarity': empty, 'score': empty,
+                'skip': np.zeros(0, dtype=np.int8)}
+    skip, overlap, closeness = _prefilter(batch, earliest, latest, fastest, route, require_fastest)
+
+    qmask = batch.query_mask(interests)
+    shared = np.bitwise_count(batch.masks & qmask).sum(axis=1, dtype=np.int64)
+    size_b = batch.sizes
+    size_a = int(np.bitwise_count(qmask).sum())
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = np.where(size_b > 0, shared / np.sqrt(size_a * size_b), 0.0) if size_a else np.zeros(n)
+        score = overlap * closeness * similarity
+    return {'overlap': overlap, 'closeness': closeness, 'similarity': similarity, 'score': score, 'skip': skip}
+
+
+def _prefilter(batch, earliest, latest, fastest, route, require_fastest):
+    """Skip codes, overlap seconds and closeness for every candidate (no interest work)."""
+    n = len(batch)
+    skip = np.zeros(n, dtype=np.int8)
+    if route is not None:
+        # Routes overlap when they share a track edge: one AND over the bitmap words
+        shared = (batch.routes & route).any(axis=1)
+        skip[~batch.known] = SKIP_UNKNOWN_STATION
+        skip[(skip == 0) & ~shared] = SKIP_NO_SEGMENT_OVERLAP
+
+    # Same arithmetic as timedelta.total_seconds() on min(latest) - max(earliest)
+    overlap_us = np.minimum(epoch_us(latest), batch.end) - np.maximum(epoch_us(earliest), batch.start)
+    overlap = overlap_us / 1e6
+    skip[(skip == 0) & (overlap <= 0)] = SKIP_NO_TIME_OVERLAP
+
+    longest = np.maximum(fastest or 0, batch.fastest)
+    if require_fastest:
+        missing = (batch.fastest == 0) if fastest else np.ones(n, dtype=bool)
+        skip[(skip == 0) & missing] = SKIP_NO_FASTEST
+    else:
+        # Both sides missing would be a division by zero in the per-row formula
+        skip[(skip == 0) & (longest == 0)] = SKIP_NO_FASTEST
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closeness = overlap / longest
+    return skip, overlap, closeness
+
+
+def bounded_top_k(batch, earliest, latest, fastest, interests, k, route=None, require_fastest=True,
+                  block=BOUND_BLOCK, stats=None):
+    """
+    The k best candidates by score_batch's score without scoring all of them.
+
+    similarity is at most 1, so overlap * closeness bounds each score. Valid candidates are visited
+    in decreasing order of that bound, a block at a time (interest masks are only built for visited
+    rows), keeping the best k so far; the search stops once the next bound is below the k-th score.
+    Ties resolve like top_k (lower index first), so the result equals
+    top_k(score_batch(...)['score'], skip == SKIP_NONE, k).
+
+    Returns:
+      (indices, scores) of the selected candidates, best first
+    stats: optional dict, filled with candidates, valid, scored and pruned counts
+    """
+    n = len(batch)
+    if n == 0 or k <= 0:
+        if stats is not None:
+            stats.update(candidates=n, valid=0, scored=0, pruned=0)
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    skip, overlap, closeness = _prefilter(batch, earliest, latest, fastest, route, require_fastest)
+    bound = overlap * closeness
+    valid = np.flatnonzero(skip == SKIP_NONE)
+    order = valid[np.argsort(-bound[valid], kind='stable')]
+
+    query = batch.vocab.tokens(interests)
+    qmask = batch.vocab.mask(query)
+    size_a = len(query)
+    best_idx, best_score = np.zeros(0, dtype=np.int64), np.zeros(0)
+    scored = 0
+    while scored < len(order):
+        if len(best_idx) == k and bound[order[scored]] < best_score[-1]:
+            break
+        idx = order[scored:scored + block]
+        scored += len(idx)
+        if size_a:
+            masks = batch.masks_for(idx)
+            q = np.zeros(masks.shape[1], dtype=np.uint64)
+            q[:len(qmask)] = qmask
+            shared = np.bitwise_count(masks & q).sum(axis=1, dtype=np.int64)
+            size_b = np.bitwise_count(masks).sum(axis=1, dtype=np.int64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                similarity = np.where(size_b > 0, shared / np.sqrt(size_a * size_b), 0.0)
+        else:
+            similarity = np.zeros(len(idx))
+        score = bound[idx] * similarity
+
+        # Merge with the best so far in index order so top_k breaks ties by index
+        cand_idx = np.concatenate([best_idx, idx])
+        cand_score = np.concatenate([best_score, score])
+        by_index = np.argsort(cand_idx, kind='stable')
+        cand_idx, cand_score = cand_idx[by_index], cand_score[by_index]
+        keep = top_k(cand_score, np.ones(len(cand_idx), dtype=bool), k)
+        best_idx, best_score = cand_idx[keep], cand_score[keep]
+
+    if stats is not None:
+        stats.update(candidates=n, valid=len(valid), scored=scored, pruned=len(valid) - scored)
+    return best_idx, best_score
+
+
+def top_k(score, valid, k):
+    """
+    Indices of the k best valid scores, highest first; ties keep input order, exactly like a stable
+    list.sort(reverse=True) followed by [:k].
+    """
+    idx = np.flatnonzero(valid)
+    if len(idx) == 0 or k <= 0:
+        return idx[:0]
+    neg = -score[idx]
+    if len(idx) > k:
+        kth = np.partition(neg, k - 1)[k - 1]
+        keep = neg <= kth
+        idx, neg = idx[keep], neg[keep]
+    order = np.argsort(neg, kind='stable')
+    return idx[order[:k]]
+
+
+def pair_scores(batch, a, b, require_fastest=True, sizes=None):
+    """
+    Scores pairs of candidates within one batch (rows a[k] and b[k]) with the find_matches formula.
+    The score is symmetric, so each unordered pair only needs scoring once.
+
+    Returns:
+      dict of arrays: overlap_us, score, valid (time overlap, shared track when known, fastest present)
+    """
+    overlap_us = np.minimum(batch.end[a], batch.end[b]) - np.maximum(batch.start[a], batch.start[b])
+    valid = overlap_us > 0
+    if batch.routes is not None:
+        valid &= batch.known[a] & batch.known[b]
+        valid &= (batch.routes[a] & batch.routes[b]).any(axis=1)
+    fa, fb = batch.fastest[a], batch.fastest[b]
+    valid &= ((fa > 0) & (fb > 0)) if require_fastest else (np.maximum(fa, fb) > 0)
+
+    # Only compatible pairs pay for the popcount and float math
+    idx = np.flatnonzero(valid)
+    a, b = a[idx], b[idx]
+    sizes = batch.sizes if sizes is None else sizes
+    shared = np.bitwise_count(batch.masks[a] & batch.masks[b]).sum(axis=1, dtype=np.int64)
+    overlap = overlap_us[idx] / 1e6
+    score = np.zeros(len(valid))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closeness = overlap / np.maximum(fa[idx], fb[idx])
+        similarity = shared / np.sqrt(sizes[a] * sizes[b])
+        score[idx] = overlap * closeness * similarity
+    return {'overlap_us': overlap_us, 'score': score, 'valid': valid}
@@ -0,0 +1,230 @@
+"""
+In-process SQLite stand-in for the ride-match MySQL database.
+
+Wraps sqlite3 so code written against mysql.connector (`%s` placeholders, dictionary cursors,
+DATETIME values) runs unchanged against a file or :memory: database: the benchmark suite and
+tests use it to exercise find_matches, the CLI scoring path and the batch matcher without a
+MySQL server. The schema mirrors db.init_db plus the migrations in migrations.py, including the
+generated seg_start/seg_end columns, trip_runs, the ride group tables and the archive tables.
+"""
+import sqlite3
+from datetime import datetime
+
+from matching import STATION_LIST
+from migrations import interest_mask_sql
+
+sqlite3.register_adapter(datetime, lambda dt: dt.isoformat(' '))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.fromisoformat(raw.decode()))
+
+
+def _position(column):
+    """Station position of `column` (NULL when unknown); SQLite's counterpart of FIELD() - 1."""
+    cases = " ".join("WHEN '{}' THEN {}".format(name.replace("'", "''"), pos) for pos, name in enumerate(STATION_LIST))
+    return f"(CASE {column} {cases} END)"
+
+
+_O, _D = _position('origin'), _position('destination')
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS profiles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email VARCHAR(255) UNIQUE,
+        origin VARCHAR(50),
+        destination VARCHAR(50),
+        interests TEXT,
+        interest_mask INTEGER GENERATED ALWAYS AS ({mask}) STORED
+    )""".format(mask=interest_mask_sql(sqlite=True)),
+    """
+    CREATE TABLE IF NOT EXISTS trips (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        profile_id INT REFERENCES profiles(id),
+        origin VARCHAR(50),
+        destination VARCHAR(50),
+        earliest DATETIME,
+        latest DATETIME,
+        matched BOOLEAN DEFAULT FALSE,
+        fastest_seconds INT,
+        seg_start TINYINT GENERATED ALWAYS AS (min({o}, {d})) STORED,
+        seg_end TINYINT GENERATED ALWAYS AS (max({o}, {d})) STORED
+    )""".format(o=_O, d=_D),
+    """
+    CREATE TABLE IF NOT EXISTS matches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trip_a INT REFERENCES trips(id),
+        trip_b INT REFERENCES trips(id),
+        departure DATETIME,
+        arrival DATETIME,
+        score FLOAT
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS trip_runs (
+        trip_id INT NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+        run_number VARCHAR(8) NOT NULL,
+        direction TINYINT NOT NULL,
+        board_time DATETIME NOT NULL,
+        alight_time DATETIME,
+        PRIMARY KEY (trip_id, run_number, board_time)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ride_groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        departure DATETIME,
+        arrival DATETIME,
+        score FLOAT,
+        size TINYINT NOT NULL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ride_group_members (
+        group_id INT NOT NULL REFERENCES ride_groups(id) ON DELETE CASCADE,
+        trip_id INT NOT NULL REFERENCES trips(id),
+        PRIMARY KEY (group_id, trip_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS trips_archive (
+        id INTEGER PRIMARY KEY,
+        profile_id INT,
+        origin VARCHAR(50),
+        destination VARCHAR(50),
+        earliest DATETIME,
+        latest DATETIME,
+        matched BOOLEAN,
+        fastest_seconds INT,
+        archived_at DATETIME
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_trips_archive_latest ON trips_archive (latest)",
+    """
+    CREATE TABLE IF NOT EXISTS matches_archive (
+        id INTEGER PRIMARY KEY,
+        trip_a INT,
+        trip_b INT,
+        departure DATETIME,
+        arrival DATETIME,
+        score FLOAT,
+        archived_at DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ride_group_members_archive (
+        group_id INT NOT NULL,
+        trip_id INT NOT NULL,
+        archived_at DATETIME,
+        PRIMARY KEY (group_id, trip_id)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ride_groups_archive (
+        id INTEGER PRIMARY KEY,
+        departure DATETIME,
+        arrival DATETIME,
+        score FLOAT,
+        size TINYINT NOT NULL,
+        archived_at DATETIME
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_ride_group_members_trip ON ride_group_members (trip_id)",
+    "CREATE INDEX IF NOT EXISTS idx_trip_runs_run ON trip_runs (run_number, direction, board_time)",
+    "CREATE INDEX IF NOT EXISTS idx_trips_open_window ON trips (matched, earliest, latest, seg_start, seg_end)",
+]
+
+
+class Cursor:
+    """mysql.connector-style cursor over a sqlite3 cursor."""
+
+    def __init__(self, conn, dictionary=False):
+        self.conn = conn
+        self.dictionary = dictionary
+        self._cur = conn.raw.cursor()
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def execute(self, sql, params=()):
+        if 'FOR UPDATE' in sql:
+            # No row locks in SQLite: take the database write lock up front instead, so a locking
+            # read still excludes every other writer until commit/rollback (they wait, not skip)
+            sql = sql[:sql.index('FOR UPDATE')]
+            if not self.conn.raw.in_transaction:
+                self._cur.execute("BEGIN IMMEDIATE")
+        self._cur.execute(sql.replace('%s', '?'), tuple(params))
+
+    def executemany(self, sql, rows):
+        self._cur.executemany(sql.replace('%s', '?'), [tuple(r) for r in rows])
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {col[0]: value for col, value in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            self.conn.rows_fetched += 1
+        return self._row(row)
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        self.conn.rows_fetched += len(rows)
+        return [self._row(r) for r in rows]
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    """mysql.connector-style connection; rows_fetched counts rows handed back to callers."""
+
+    def __init__(self, path=':memory:', timeout=5.0):
+        self.raw = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                                   timeout=timeout)
+        self.raw.create_function('BIT_COUNT', 1, lambda v: None if v is None else int(v).bit_count(),
+                                 deterministic=True)
+        self.rows_fetched = 0
+
+    def cursor(self, dictionary=False, **kwargs):
+        return Cursor(self, dictionary)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+
+def connect(path=':memory:', timeout=5.0):
+    """Opens a SQLite database with the ride-match schema; `timeout` is how long a writer waits for the lock."""
+    conn = Connection(path, timeout)
+    for statement in SCHEMA:
+        conn.raw.execute(statement)
+    conn.commit()
+    return conn
+
+
+def insert_riders(conn, riders):
+    """
+    Bulk-inserts riders as one profile and one open trip each.
+
+    riders: dicts with email, origin, destination, interests, earliest, latest, fastest_seconds
+    Returns the new trip ids in order.
+    """
+    cur = conn.raw.cursor()
+    first_profile = (cur.execute("SELECT COALESCE(MAX(id), 0) FROM profiles").fetchone()[0]) + 1
+    cur.executemany(
+        "INSERT INTO profiles (email, origin, destination, interests) VALUES (?, ?, ?, ?)",
+        [(r['email'], r['origin'], r['destination'], r['interests']) for r in riders]
+    )
+    first_trip = (cur.execute("SELECT COALESCE(MAX(id), 0) FROM trips").fetchone()[0]) + 1
+    cur.executemany(
+        "INSERT INTO trips (profile_id, origin, destination, earliest, latest, fastest_seconds) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(first_profile + i, r['origin'], r['destination'], r['earliest'], r['latest'], r['fastest_seconds'])
+         for i, r in enumerate(riders)]
+    )
+    conn.commit()
+    cur.close()
+    return list(range(first_trip, first_trip + len(riders)))
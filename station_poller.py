@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cta_api
+from cta_api import red_line_stations
+
+log = logging.getLogger(__name__)
+
+
+class LiveTimetable:
+    """
+    In-memory view of the latest CTA arrivals for every polled station.
+
+    Indexed two ways:
+      - by station map_id: the ETA list exactly as the API returned it
+      - by run number (rn): map_id -> ETA entry for that run at each station
+    """
+
+    def __init__(self, max_age=90.0, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self._by_station = {}
+        self._by_run = {}
+        self._updated = {}
+        self._lock = threading.Lock()
+
+    def update(self, map_id, etas):
+        """Replaces one station's arrivals and re-indexes its runs."""
+        with self._lock:
+            for eta in self._by_station.get(map_id, []):
+                stops = self._by_run.get(eta.get('rn'))
+                if stops is not None:
+                    stops.pop(map_id, None)
+                    if not stops:
+                        del self._by_run[eta.get('rn')]
+            self._by_station[map_id] = list(etas)
+            for eta in etas:
+                # Keep the first (soonest) entry when a run is listed twice at one station
+                self._by_run.setdefault(eta.get('rn'), {}).setdefault(map_id, eta)
+            self._updated[map_id] = self.clock()
+
+    def is_fresh(self, map_id):
+        with self._lock:
+            at = self._updated.get(map_id)
+        return at is not None and self.clock() - at <= self.max_age
+
+    def arrivals(self, map_id):
+        """ETA list for a station, or None if it has not been polled recently."""
+        if not self.is_fresh(map_id):
+            return None
+        with self._lock:
+            return self._by_station.get(map_id, [])
+
+    def run_arrival(self, run_number, map_id):
+        """ETA entry for one run at one station, or None if the run is not listed there."""
+        with self._lock:
+            return self._by_run.get(run_number, {}).get(map_id)
+
+    def runs(self):
+        with self._lock:
+            return {rn: dict(stops) for rn, stops in self._by_run.items()}
+
+
+class StationPoller:
+    """
+    Background worker that polls every Red Line station on a fixed interval over pooled
+    keep-alive connections and publishes the results to a LiveTimetable (and the shared
+    arrivals cache), so request handlers never wait on the CTA API.
+    """
+
+    def __init__(self, api_key, timetable=None, stations=red_line_stations, interval=30.0, workers=4,
+                 url=None, cache=None, on_update=None):
+        self.api_key = api_key
+        self.timetable = timetable or LiveTimetable(max_age=interval * 3)
+        self.stations = dict(stations)
+        self.interval = interval
+        self.url = url
+        self.cache = cache if cache is not None else cta_api.ARRIVALS_CACHE
+        # Optional callback(map_id, etas), e.g. to record observations for travel_matrix.py
+        self.on_update = on_update
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cta-poll')
+        self._stop = threading.Event()
+        self._thread = None
+        # Updated from the pool threads and the poll loop, read from request threads
+        self._lock = threading.Lock()
+        self._counters = {'polls': 0, 'errors': 0}
+        self._last_poll_seconds = None
+
+    @property
+    def polls(self):
+        with self._lock:
+            return self._counters['polls']
+
+    @property
+    def errors(self):
+        with self._lock:
+            return self._counters['errors']
+
+    @property
+    def last_poll_seconds(self):
+        with self._lock:
+            return self._last_poll_seconds
+
+    def stats(self):
+        """Snapshot of the poll round and error counters."""
+        with self._lock:
+            return dict(self._counters, last_poll_seconds=self._last_poll_seconds)
+
+    def poll_station(self, map_id):
+        # A hung station must not hold up the next poll round
+        etas = cta_api._fetch_arrivals(map_id, self.api_key, session=self.session, url=self.url,
+                                       timeout=self.interval)
+        if etas is None:
+            self._count('errors')
+            return False
+        self.timetable.update(map_id, etas)
+        if self.cache is not None:
+            self.cache.put(map_id, etas)
+        if self.on_update is not None:
+            self.on_update(map_id, etas)
+        return True
+
+    def poll_once(self):
+        """Polls all stations concurrently. Returns the number of stations refreshed."""
+        start = time.perf_counter()
+        ok = sum(self._pool.map(self._safe_poll, self.stations.values()))
+        with self._lock:
+            self._counters['polls'] += 1
+            self._last_poll_seconds = time.perf_counter() - start
+        return ok
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='cta-poller', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+    def _safe_poll(self, map_id):
+        try:
+            return self.poll_station(map_id)
+        except requests.RequestException as e:
+            self._count('errors')
+            log.warning("Polling map_id %s failed: %s", map_id, e)
+            return False
+        except Exception:
+            # e.g. a 200 whose JSON is not an object, or a failing on_update; must not end the round
+            self._count('errors')
+            log.exception("Polling map_id %s failed", map_id)
+            return False
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll_once()
+            except Exception:
+                # One bad round must not end polling; requests would silently fall back to fetching
+                log.exception("Station poll round failed")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
@@ -0,0 +1,28 @@
+"""
+test_app_benchmark.py
+
+Runs the Streamlit app benchmark on a small database: a planner-page rerun borrows no database
+connection and makes no CTA call, the first "Find Matches" (while the live matcher loads in the
+background) is reported on its own, and repeating it for the same minute reuses the cached trip
+plan instead of asking CTA again.
+
+Usage:
+    python -m pytest test_app_benchmark.py
+"""
+import app_benchmark
+
+
+def test_reruns_skip_database_and_cta():
+    results = {r['scenario']: r for r in app_benchmark.run(trips=200, reruns=3, finds=2, cold_runs=0)}
+    assert set(results) == {'rerun', 'first_find', 'find_matches'}
+    assert results['rerun']['db_checkouts_per_run'] == 0
+    assert results['rerun']['cta_requests_per_run'] == 0
+    # The live matcher builds on its own thread and connection, never inside the press
+    assert results['first_find']['runs'] == 1 and results['first_find']['db_checkouts_per_run'] == 1
+    assert results['first_find']['cta_requests_per_run'] > 0
+    assert results['find_matches']['db_checkouts_per_run'] == 1
+    assert results['find_matches']['cta_requests_per_run'] == 0
+
+    baseline = {'results': [dict(r, p50_ms=r['p50_ms'] / 2) for r in results.values()]}
+    assert [s for s, _, _ in app_benchmark.compare(baseline, {'results': list(results.values())})] == [
+        'rerun', 'first_find', 'find_matches']
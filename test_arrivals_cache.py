@@ -0,0 +1,90 @@
+"""
+test_arrivals_cache.py
+
+Checks the shared CTA arrivals cache: TTL expiry, stale-while-revalidate and coalescing
+of concurrent misses into one upstream call.
+
+Usage:
+    python -m pytest test_arrivals_cache.py
+"""
+import threading
+import time
+
+from arrivals_cache import ArrivalsCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fresh_hit_then_expiry():
+    clock = FakeClock()
+    cache = ArrivalsCache(ttl=10, stale_ttl=0, clock=clock)
+    calls = []
+    fetch = lambda: calls.append(1) or ['eta']
+    assert cache.get('40900', fetch) == ['eta']
+    clock.now = 5
+    assert cache.get('40900', fetch) == ['eta']
+    assert len(calls) == 1
+    clock.now = 11
+    cache.get('40900', fetch)
+    assert len(calls) == 2
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['fetches'] == 2
+
+
+def test_stale_while_revalidate():
+    clock = FakeClock()
+    cache = ArrivalsCache(ttl=10, stale_ttl=30, clock=clock)
+    cache.get('40900', lambda: ['old'])
+    clock.now = 15
+    refreshed = threading.Event()
+
+    def slow_fetch():
+        refreshed.wait(2)
+        return ['new']
+
+    start = time.perf_counter()
+    assert cache.get('40900', slow_fetch) == ['old']
+    assert time.perf_counter() - start < 0.5
+    refreshed.set()
+    for _ in range(100):
+        if cache.peek('40900') == ['new']:
+            break
+        time.sleep(0.01)
+    assert cache.get('40900', slow_fetch) == ['new']
+    assert cache.stats()['stale_hits'] == 1 and cache.stats()['refreshes'] == 1
+
+
+def test_concurrent_misses_are_coalesced():
+    cache = ArrivalsCache(ttl=10)
+    calls = []
+    gate = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        gate.wait(2)
+        return ['eta']
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('41300', fetch))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == [['eta']] * 8
+    assert cache.stats()['coalesced'] == 7
+
+
+def test_failed_fetch_is_not_cached():
+    cache = ArrivalsCache(ttl=10)
+    assert cache.get('40900', lambda: None) is None
+    assert cache.get('40900', lambda: ['eta']) == ['eta']
+    assert cache.stats()['errors'] == 1
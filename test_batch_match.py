@@ -0,0 +1,72 @@
+"""
+test_batch_match.py
+
+Checks the global batch matcher: sort-and-sweep finds exactly the compatible pairs that
+brute-force enumeration finds, and the matching never promises a rider twice.
+
+Usage:
+    python -m pytest test_batch_match.py
+"""
+import numpy as np
+
+from batch_match import candidate_pairs, solve_matching, match_trips, _prune_degree
+from network import NETWORK
+from scoring import CandidateBatch, pair_scores
+from test_trip_index import make_trips
+
+
+def test_sweep_finds_all_compatible_pairs():
+    trips = make_trips(300, seed=2)
+    batch = CandidateBatch(trips, network=NETWORK)
+    a, b, w = candidate_pairs(batch)
+    got = {(min(i, j), max(i, j)): s for i, j, s in zip(a.tolist(), b.tolist(), w.tolist())}
+
+    n = len(trips)
+    ii, jj = np.triu_indices(n, k=1)
+    res = pair_scores(batch, ii, jj)
+    keep = res['valid'] & (res['score'] > 0)
+    expected = dict(zip(zip(ii[keep].tolist(), jj[keep].tolist()), res['score'][keep].tolist()))
+    assert got == expected
+
+
+def test_matching_is_disjoint_and_compatible():
+    trips = make_trips(500, seed=4)
+    results = match_trips(trips, max_degree=10)
+    assert results
+    ids = [r['trip_a'] for r in results] + [r['trip_b'] for r in results]
+    assert len(ids) == len(set(ids))
+    by_id = {t['id']: t for t in trips}
+    for r in results:
+        a, b = by_id[r['trip_a']], by_id[r['trip_b']]
+        assert r['departure'] < r['arrival']
+        assert a['earliest'] < b['latest'] and b['earliest'] < a['latest']
+        assert r['score'] > 0
+
+
+def test_solver_beats_greedy():
+    trips = make_trips(400, seed=6)
+    batch = CandidateBatch(trips, network=NETWORK)
+    a, b, w = candidate_pairs(batch)
+    weight = {(min(i, j), max(i, j)): s for i, j, s in zip(a.tolist(), b.tolist(), w.tolist())}
+    solved = sum(weight[p] for p in solve_matching(len(trips), a, b, w))
+
+    used, greedy = set(), 0
+    for (i, j), s in sorted(weight.items(), key=lambda kv: kv[1], reverse=True):
+        if i not in used and j not in used:
+            used.update((i, j))
+            greedy += s
+    assert solved >= greedy
+
+
+def test_prune_keeps_each_trips_heaviest_edges():
+    rng = np.random.default_rng(1)
+    n, m = 40, 500
+    a = rng.integers(0, n, m)
+    b = (a + rng.integers(1, n, m)) % n
+    w = rng.random(m)
+    _, _, kept = _prune_degree(n, a, b, w, 3)
+    expected = set()
+    for v in range(n):
+        incident = [e for e in np.argsort(-w) if a[e] == v or b[e] == v]
+        expected.update(incident[:3])
+    assert sorted(kept.tolist()) == sorted(w[sorted(expected)].tolist())
@@ -0,0 +1,46 @@
+"""
+test_benchmark.py
+
+Smoke test for the synthetic-load benchmark: the generator is deterministic, the SQLite and
+in-memory index backends return the same matches, the CLI backend has candidates to score,
+and the result/regression bookkeeping works.
+
+Usage:
+    python -m pytest test_benchmark.py
+"""
+import benchmark
+from matching import find_matches
+
+
+def test_generator_is_seeded():
+    a = list(benchmark.generate_riders(50, seed=3))
+    assert a == list(benchmark.generate_riders(50, seed=3))
+    assert a != list(benchmark.generate_riders(50, seed=4))
+    assert all(r['origin'] != r['destination'] and r['latest'] > r['earliest'] for r in a)
+
+
+def test_sqlite_and_index_backends_agree():
+    conn, _ = benchmark.build_backend('sqlite', 2000, seed=5)
+    index, _ = benchmark.build_backend('index', 2000, seed=5)
+    for rider in benchmark.generate_riders(30, seed=6):
+        args = (0, rider['origin'], rider['destination'], rider['earliest'], rider['latest'],
+                rider['fastest_seconds'], rider['interests'])
+        assert find_matches(conn, *args) == find_matches(None, *args, index=index)
+    assert conn.rows_fetched == index.rows
+    conn.close()
+
+
+def test_bench_result_and_compare():
+    result = benchmark.bench('sqlite', 500, requests=10, seed=1)
+    assert result['trips'] == 500 and result['requests'] == 10
+    assert 0 < result['p50_ms'] <= result['p99_ms']
+
+    baseline = {'results': [dict(result, p50_ms=result['p50_ms'] / 2)]}
+    assert benchmark.compare(baseline, {'results': [result]}, threshold=0.2) == [
+        ('sqlite', 500, result['p50_ms'] / 2, result['p50_ms'])]
+    assert benchmark.compare({'results': [result]}, {'results': [result]}) == []
+
+
+def test_cli_backend_scores_real_candidates():
+    result = benchmark.bench('cli', 500, requests=10, seed=2)
+    assert result['rows_per_request'] >= 1 and result['matched_fraction'] > 0
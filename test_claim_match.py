@@ -0,0 +1,128 @@
+"""
+test_claim_match.py
+
+Concurrency stress test for the match claim step against a file-backed SQLite stand-in: many
+threads, each with its own connection, claim partners for overlapping riders at once (and batch
+workers run over the same window), and no trip may ever end up in two matches.
+
+Usage:
+    python -m pytest test_claim_match.py
+"""
+import threading
+from collections import Counter
+from datetime import datetime
+
+import sqlite_store
+from batch_match import run_batch
+from benchmark import generate_riders
+from live_matcher import LiveMatcher
+from matching import claim_best, claim_match, find_matches
+
+WORKERS = 8
+
+
+def run_threads(target, n):
+    errors = []
+
+    def guarded(i):
+        try:
+            target(i)
+        except Exception as e:  # surfaced in the main thread below
+            errors.append(e)
+    threads = [threading.Thread(target=guarded, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def assert_no_double_booking(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT trip_a, trip_b FROM matches")
+    rows = cur.fetchall()
+    uses = Counter(tid for row in rows for tid in row)
+    assert all(count == 1 for count in uses.values())
+    cur.execute("SELECT id FROM trips WHERE matched")
+    assert {row[0] for row in cur.fetchall()} == set(uses)
+    cur.close()
+    return len(rows)
+
+
+def test_claim_match_is_single_use():
+    conn = sqlite_store.connect()
+    a, b, c = sqlite_store.insert_riders(conn, list(generate_riders(3, seed=2, days=1)))
+    when = datetime(2025, 4, 28, 8)
+    assert claim_match(conn, a, b, when, when, 1.0)
+    assert not claim_match(conn, c, b, when, when, 1.0)
+    assert not claim_match(conn, a, c, when, when, 1.0)
+    assert assert_no_double_booking(conn) == 1
+    conn.close()
+
+
+def test_claim_best_moves_past_partners_taken_elsewhere():
+    conn = sqlite_store.connect()
+    riders = list(generate_riders(400, seed=5, days=1))
+    trip_ids = sqlite_store.insert_riders(conn, riders)
+    matcher = LiveMatcher()
+    matcher.sync(conn)
+    tid = next(t for t in trip_ids if len(matcher.matches(t)) == 3)
+    offers = matcher.matches(tid)
+    # Another process pairs the whole cached top 3 with riders of its own; this matcher has not synced
+    taken = {m['trip_id'] for m in offers}
+    others = [t for t in trip_ids if t != tid and t not in taken]
+    when = datetime(2025, 4, 28, 8)
+    for partner, other in zip(sorted(taken), others):
+        assert claim_match(conn, partner, other, when, when, 1.0)
+    claimed = claim_best(conn, tid, offers, on_taken=matcher.remove, rescore=lambda: matcher.matches(tid))
+    assert claimed is not None and claimed['trip_id'] not in taken | set(others[:3])
+    assert not taken & set(matcher.index.trips)
+
+    # With nothing cached left, the caller's fallback (find_matches over MySQL) is tried
+    rider = next(t for t in others[3:] if t != claimed['trip_id'])
+    r = riders[trip_ids.index(rider)]
+    args = (rider, r['origin'], r['destination'], r['earliest'], r['latest'], r['fastest_seconds'], r['interests'])
+    fresh = find_matches(conn, *args)
+    assert fresh and claim_best(conn, rider, [claimed], rescore=lambda: find_matches(conn, *args)) == fresh[0]
+    assert_no_double_booking(conn)
+    conn.close()
+
+
+def test_concurrent_claims_never_double_book(tmp_path):
+    path = str(tmp_path / 'rides.db')
+    setup = sqlite_store.connect(path)
+    riders = list(generate_riders(600, seed=17, days=1))
+    trip_ids = sqlite_store.insert_riders(setup, riders)
+    # Every rider's current top 3, computed before anyone claims (as concurrent sessions would see it)
+    offers = {tid: find_matches(setup, tid, r['origin'], r['destination'], r['earliest'], r['latest'],
+                                r['fastest_seconds'], r['interests'])
+              for tid, r in zip(trip_ids, riders)}
+    claimed = Counter()
+
+    def worker(i):
+        conn = sqlite_store.connect(path, timeout=30)
+        for tid in trip_ids[i::WORKERS]:
+            if claim_best(conn, tid, offers[tid]):
+                claimed[i] += 1
+        conn.close()
+
+    run_threads(worker, WORKERS)
+    assert assert_no_double_booking(setup) == sum(claimed.values()) > 0
+    setup.close()
+
+
+def test_parallel_batch_workers_never_double_book(tmp_path):
+    path = str(tmp_path / 'rides.db')
+    setup = sqlite_store.connect(path)
+    sqlite_store.insert_riders(setup, list(generate_riders(1500, seed=19, days=1)))
+    start, end = datetime(2025, 4, 28, 6), datetime(2025, 4, 28, 12)
+    written = Counter()
+
+    def worker(i):
+        conn = sqlite_store.connect(path, timeout=30)
+        written[i] = run_batch(conn, start, end, max_degree=10)['written']
+        conn.close()
+
+    run_threads(worker, 4)
+    assert assert_no_double_booking(setup) == sum(written.values()) > 0
+    setup.close()
@@ -0,0 +1,60 @@
+"""
+test_cli_match.py
+
+Checks cli_match bulk ingestion against the SQLite stand-in: malformed lines are skipped,
+profiles are created once per email, and fastest_seconds is looked up once per
+(origin, destination, time bucket).
+
+Usage:
+    python -m pytest test_cli_match.py
+"""
+import io
+import json
+from datetime import datetime, timedelta
+
+import cli_match
+import sqlite_store
+from benchmark import generate_riders
+
+
+def test_read_requests_skips_bad_lines(capsys):
+    lines = io.StringIO(
+        '{"email": "a@uchicago.edu", "origin": "Howard", "destination": "Garfield", "interests": ["Food", "Art"],'
+        ' "earliest": "2025-04-26T08:00"}\n'
+        '\n'
+        'not json\n'
+        '{"email": "b@uchicago.edu", "origin": "Howard"}\n'
+    )
+    reqs = list(cli_match.read_requests(lines))
+    assert len(reqs) == 1
+    assert reqs[0]['interests'] == 'Food,Art'
+    assert reqs[0]['latest'] - reqs[0]['earliest'] == timedelta(minutes=30)
+    assert capsys.readouterr().err.count("Skipping line") == 2
+
+
+def test_bulk_ingest_batches_and_memoises(monkeypatch):
+    calls = []
+
+    def fake_fastest(orig, dest, api_key, user_time=None, estimate_only=False):
+        calls.append((orig, dest, user_time))
+        return 600, user_time, user_time + timedelta(seconds=600)
+    monkeypatch.setattr(cli_match, 'compute_fastest', fake_fastest)
+
+    riders = list(generate_riders(3000, seed=11, days=1))
+    # Every rider files a second request five minutes later
+    riders += [dict(r, earliest=r['earliest'] + timedelta(minutes=5), latest=r['latest'] + timedelta(minutes=5))
+               for r in riders]
+    lines = io.StringIO("\n".join(json.dumps(dict(r, earliest=r['earliest'].isoformat(),
+                                                  latest=r['latest'].isoformat())) for r in riders))
+    conn = sqlite_store.connect()
+    stats = cli_match.ingest_requests(conn, cli_match.read_requests(lines), 'key', chunk_size=1000,
+                                      now=datetime(2025, 1, 1))
+
+    assert stats['requests'] == 6000 and stats['profiles_created'] == 3000
+    buckets = {(r['origin'], r['destination'], r['earliest'].replace(minute=r['earliest'].minute // 15 * 15))
+               for r in riders}
+    assert len(calls) == stats['fastest_lookups'] == len(buckets) < len(riders)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), COUNT(DISTINCT profile_id), MIN(fastest_seconds) FROM trips")
+    assert cur.fetchone() == (6000, 3000, 600)
+    conn.close()
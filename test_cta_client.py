@@ -0,0 +1,110 @@
+"""
+test_cta_client.py
+
+Checks the request-path CTA client against the local fake endpoint with injected faults: a hung
+server is cut off at the deadline, a slow first attempt is hedged, connections are kept alive,
+and a failing API trips the circuit breaker while get_arrivals falls back to the last arrivals.
+
+Usage:
+    python -m pytest test_cta_client.py
+"""
+import time
+
+import pytest
+
+import cta_api
+from arrivals_cache import ArrivalsCache
+from cta_client import CircuitBreaker, CTAClient, Deadline
+from fake_cta import FakeCTA, FakeCTAServer
+
+HOWARD, GARFIELD = cta_api.red_line_stations['Howard'], cta_api.red_line_stations['Garfield']
+
+
+@pytest.fixture
+def server():
+    with FakeCTAServer(FakeCTA(horizon=3600)) as srv:
+        yield srv
+
+
+def make_client(server, **kwargs):
+    return CTAClient(lambda map_id, api_key, session, timeout: cta_api._fetch_arrivals(
+        map_id, api_key, session, url=server.url, timeout=timeout), **kwargs)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_deadline_cuts_off_a_hung_server(server):
+    server.fake.delay = 3.0
+    client = make_client(server, hedge=False)
+    start = time.perf_counter()
+    assert client.fetch(HOWARD, 'key', Deadline(0.3)) is None
+    assert time.perf_counter() - start < 1.0
+    client.close()
+
+
+def test_slow_attempt_is_hedged_over_kept_alive_connections(server):
+    client = make_client(server, hedge_after=0.1)
+    for _ in range(10):
+        assert client.fetch(HOWARD, 'key', Deadline(2.0))
+    assert server.fake.connections == 1
+
+    server.fake.slow_next, server.fake.slow_delay = 1, 1.5
+    start = time.perf_counter()
+    assert client.fetch(GARFIELD, 'key', Deadline(2.0))
+    assert time.perf_counter() - start < 1.0
+    assert server.fake.requests == 12
+    client.close()
+
+
+def test_breaker_fails_fast_then_probes(server):
+    clock = FakeClock()
+    client = make_client(server, hedge=False, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=30,
+                                                                     clock=clock))
+    server.fake.fail_next = 100
+    for _ in range(3):
+        assert client.fetch(HOWARD, 'key', Deadline(1.0)) is None
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client.fetch(HOWARD, 'key', Deadline(1.0)) is None
+    assert server.fake.requests == 3
+
+    # One probe after the reset timeout; while it fails the circuit stays open
+    clock.now = 31
+    assert client.fetch(HOWARD, 'key', Deadline(1.0)) is None
+    assert client.breaker.state == CircuitBreaker.OPEN and server.fake.requests == 4
+    server.fake.fail_next = 0
+    clock.now = 62
+    assert client.fetch(HOWARD, 'key', Deadline(1.0))
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_get_arrivals_falls_back_to_last_known(server, monkeypatch):
+    client = make_client(server, hedge=False, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    monkeypatch.setattr(cta_api, 'CTA_CLIENT', client)
+    monkeypatch.setattr(cta_api, 'ARRIVALS_CACHE', ArrivalsCache(ttl=0, stale_ttl=0))
+    monkeypatch.setattr(cta_api, 'LIVE_TIMETABLE', None)
+    fresh = cta_api.get_arrivals(HOWARD, 'key')
+    assert fresh
+
+    server.fake.delay = 3.0
+    start = time.perf_counter()
+    assert cta_api.get_arrivals(HOWARD, 'key', Deadline(0.3)) == fresh
+    assert cta_api.get_arrivals(HOWARD, 'key') == fresh      # circuit open: no call at all
+    assert time.perf_counter() - start < 1.0
+    assert server.fake.requests == 2
+
+    # With the circuit closed again and nothing known for the destination, plan_trip still gives up
+    # within its budget instead of hanging
+    client.breaker.record_success()
+    monkeypatch.setattr(cta_api, 'CTA_DEADLINE', 0.5)
+    start = time.perf_counter()
+    dep, arr = cta_api.plan_trip('Howard', 'Garfield', 'key')
+    assert dep is not None and arr is None
+    assert time.perf_counter() - start < 1.0
+    client.close()
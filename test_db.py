@@ -0,0 +1,91 @@
+"""
+test_db.py
+
+Exercises the pooled ConnectionProvider against an in-process stand-in for the MySQL pool:
+checkout/return bookkeeping, reconnect-on-checkout and the wait timeout.
+
+Usage:
+    python -m pytest test_db.py
+"""
+import pytest
+from mysql.connector import errors
+
+import db
+
+
+class FakePooledConn:
+    def __init__(self, pool):
+        self.pool = pool
+        self.alive = True
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self.alive:
+            if not reconnect:
+                raise errors.InterfaceError("Connection lost")
+            self.alive = True
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.pool.idle.append(self)
+
+    def cursor(self, dictionary=False):
+        return FakeCursor()
+
+
+class FakeCursor:
+    def execute(self, sql, params=()):
+        self.rows = [{'sql': sql, 'params': params}]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, pool_size, **kwargs):
+        self.idle = [FakePooledConn(self) for _ in range(pool_size)]
+
+    def get_connection(self):
+        return self.idle.pop()
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.setattr(db.pooling, 'MySQLConnectionPool', FakePool)
+    return db.ConnectionProvider({'host': 'h', 'user': 'u', 'password': 'p', 'database': 'd'}, size=2,
+                                 max_wait=0.05)
+
+
+def test_checkout_and_return(provider):
+    with provider.connection() as conn:
+        assert provider.stats()['in_use'] == 1
+        assert db.fetch_all(conn, "SELECT %s", (1,)) == [{'sql': "SELECT %s", 'params': (1,)}]
+        raw = conn._conn
+    stats = provider.stats()
+    assert stats['in_use'] == 0 and stats['checkouts'] == 1
+    # Returned connections end their transaction so the next borrower reads fresh data
+    assert raw.rollbacks == 1
+
+
+def test_reconnects_dead_connection(provider):
+    for conn in provider.pool.idle:
+        conn.alive = False
+    conn = provider.get()
+    assert conn.alive
+    conn.close()
+    assert provider.stats()['reconnects'] == 1
+
+
+def test_exhausted_pool_times_out(provider):
+    held = [provider.get(), provider.get()]
+    with pytest.raises(errors.PoolError):
+        provider.get()
+    assert provider.stats()['timeouts'] == 1
+    for conn in held:
+        conn.close()
+    provider.get().close()
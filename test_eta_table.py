@@ -0,0 +1,97 @@
+"""
+test_eta_table.py
+
+Checks that the columnar ETA decoder reproduces the original per-entry strptime/pytz loops of
+find_next_train and track_train_to_destination exactly, on fake timetables salted with missing,
+malformed and duplicate entries.
+
+Usage:
+    python -m pytest test_eta_table.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytz
+
+import cta_api
+from eta_table import MISSING, ArrivalsTable, arrivals_table, parse_arrivals, to_datetime
+from fake_cta import FakeCTA
+
+central = pytz.timezone('America/Chicago')
+BAD_ARRT = [None, '', 'soon', '2025-02-30T08:00:00', '2025-04-26T24:00:00', '2025-04-26 08:00:00',
+            '2025-04-26T08:00:00Z', '2025-4-26T8:05:00', '0000-01-01T00:00:00', ' 2025-04-26T08:00:0']
+
+
+def reference_next_train(arrivals, route, after_time=None):
+    """The original loop from cta_api.find_next_train."""
+    trains = []
+    for eta in arrivals:
+        if eta.get('rt') != route:
+            continue
+        try:
+            arr_raw = datetime.strptime(eta['arrT'], "%Y-%m-%dT%H:%M:%S")
+        except Exception:
+            continue
+        arr_central = central.localize(arr_raw).replace(tzinfo=None)
+        if after_time is None or arr_central >= after_time:
+            trains.append({'arrival': arr_central, 'run_number': eta['rn']})
+    return sorted(trains, key=lambda t: t['arrival'])[0] if trains else None
+
+
+def reference_track(arrivals, run_number):
+    """The original loop from cta_api.track_train_to_destination."""
+    for eta in arrivals:
+        if eta.get('rn') == run_number:
+            try:
+                arr_raw = datetime.strptime(eta['arrT'], "%Y-%m-%dT%H:%M:%S")
+            except Exception:
+                return None
+            return central.localize(arr_raw).replace(tzinfo=None)
+    return None
+
+
+def salted_etas(rng, now):
+    fake = FakeCTA(start=now - timedelta(minutes=rng.randint(0, 40)), headway=rng.choice([120, 300, 420]),
+                   clock=lambda: now, horizon=3600)
+    etas = fake.etas(rng.choice(list(cta_api.red_line_stations.values())))
+    for eta in rng.sample(etas, len(etas) // 5):
+        eta['arrT'] = rng.choice(BAD_ARRT)
+    for eta in rng.sample(etas, len(etas) // 10):
+        eta['rt'] = rng.choice(['Blue', None])
+    # Same-minute duplicates and repeated run numbers exercise the tie order
+    etas += [dict(e, rn=rng.choice(etas)['rn']) for e in rng.sample(etas, len(etas) // 10)]
+    rng.shuffle(etas)
+    return etas
+
+
+def test_parse_arrivals_matches_strptime():
+    values = BAD_ARRT + ['2025-04-26T08:00:00', '2024-02-29T23:59:59', '1969-12-31T23:59:59']
+    expected = []
+    for v in values:
+        try:
+            expected.append(datetime.strptime(v, "%Y-%m-%dT%H:%M:%S"))
+        except (TypeError, ValueError):
+            expected.append(None)
+    got = [None if s == MISSING else to_datetime(s) for s in parse_arrivals(values)]
+    assert got == expected
+
+
+def test_lookups_match_reference_loops():
+    rng = random.Random(22)
+    for _ in range(60):
+        now = datetime(2025, 4, 26, 8) + timedelta(seconds=rng.randint(0, 86400))
+        etas = salted_etas(rng, now)
+        table = ArrivalsTable(etas)
+        for after in (None, now, now + timedelta(minutes=rng.randint(1, 50), microseconds=rng.randint(0, 10**6))):
+            for route in ('Red', 'Blue', 'Green'):
+                assert cta_api.find_next_train(etas, route, after) == reference_next_train(etas, route, after)
+        for rn in {e['rn'] for e in etas} | {'nope'}:
+            assert cta_api.track_train_to_destination(etas, rn) == reference_track(etas, rn)
+        parsed = [to_datetime(s) for s in table.arrival if s != MISSING]
+        assert table.min_arrival() == min(parsed, default=None)
+
+
+def test_tables_are_decoded_once_per_payload():
+    etas = FakeCTA(clock=lambda: datetime(2025, 4, 26, 8)).etas('40900')
+    assert arrivals_table(etas) is arrivals_table(etas)
+    assert arrivals_table(list(etas)) is not arrivals_table(etas)
@@ -0,0 +1,70 @@
+"""
+test_group_match.py
+
+Checks the group matcher: the degeneracy order bounds each vertex's later neighbours, every
+group is a disjoint clique of compatible trips within the size limit, and groups are stored
+with their members.
+
+Usage:
+    python -m pytest test_group_match.py
+"""
+from datetime import datetime
+from itertools import combinations
+
+import numpy as np
+
+import sqlite_store
+from batch_match import candidate_pairs, fetch_open_trips
+from benchmark import generate_riders
+from group_match import build_graph, degeneracy_order, group_trips, run_groups
+from network import NETWORK
+from scoring import CandidateBatch
+from test_trip_index import make_trips
+
+
+def test_degeneracy_order_bounds_later_neighbours():
+    trips = make_trips(400, seed=8)
+    a, b, w = candidate_pairs(CandidateBatch(trips, network=NETWORK))
+    adj = build_graph(len(trips), a, b, w)
+    order, degeneracy = degeneracy_order(adj)
+    assert sorted(order) == list(range(len(trips)))
+    position = {v: p for p, v in enumerate(order)}
+    later = [sum(position[u] > position[v] for u in adj[v]) for v in range(len(adj))]
+    assert max(later) == degeneracy < max(len(n) for n in adj)
+
+
+def test_groups_are_disjoint_cliques():
+    trips = make_trips(600, seed=9)
+    batch = CandidateBatch(trips, network=NETWORK)
+    a, b, w = candidate_pairs(batch)
+    weight = {(min(i, j), max(i, j)): s for i, j, s in zip(a.tolist(), b.tolist(), w.tolist())}
+    row = {t['id']: i for i, t in enumerate(trips)}
+
+    groups = group_trips(trips, max_size=4)
+    assert any(len(g['trip_ids']) > 2 for g in groups)
+    members = [tid for g in groups for tid in g['trip_ids']]
+    assert len(members) == len(set(members))
+    for g in groups:
+        idx = sorted(row[tid] for tid in g['trip_ids'])
+        assert 2 <= len(idx) <= 4
+        assert all(p in weight for p in combinations(idx, 2))
+        assert np.isclose(g['score'], sum(weight[p] for p in combinations(idx, 2)))
+        assert g['departure'] < g['arrival']
+    assert [g['score'] for g in groups] == sorted((g['score'] for g in groups), reverse=True)
+
+
+def test_run_groups_writes_members():
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, list(generate_riders(2000, seed=3, days=1)))
+    start, end = datetime(2025, 4, 28, 7), datetime(2025, 4, 28, 10)
+    open_before = len(fetch_open_trips(conn, start, end))
+    summary = run_groups(conn, start, end, max_size=3, max_degree=10)
+    assert summary['groups'] and summary['riders'] <= 3 * summary['groups']
+
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), SUM(size) FROM ride_groups")
+    assert cur.fetchone() == (summary['groups'], summary['riders'])
+    cur.execute("SELECT COUNT(*) FROM ride_group_members m JOIN trips t ON m.trip_id = t.id WHERE t.matched")
+    assert cur.fetchone()[0] == summary['riders']
+    assert len(fetch_open_trips(conn, start, end)) == open_before - summary['riders']
+    conn.close()
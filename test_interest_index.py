@@ -0,0 +1,72 @@
+"""
+test_interest_index.py
+
+Checks the interest index behind topics.find_best_match: exact mode finds the same best users as
+the linear Jaccard scan, inserts, updates and deletes show up in queries, and the LSH mode keeps
+its recall while ranking only a fraction of the profiles.
+
+Usage:
+    python -m pytest test_interest_index.py
+"""
+import random
+
+from interest_index import InterestIndex
+from topics import TOPICS, find_best_match, jaccard_similarity
+
+FREE_FORM = ['Chess', 'Climbing', 'Jazz', 'Anime', 'Running', 'Poetry', 'Baking', 'Birding']
+
+
+def profiles(n, seed):
+    rng = random.Random(seed)
+    vocabulary = list(TOPICS) + FREE_FORM
+    out = {}
+    for i in range(1, n + 1):
+        picks = rng.sample(vocabulary, rng.randint(1, 4))
+        out[i] = [f"  {t.upper()} " if rng.random() < 0.1 else t for t in picks]
+    return out
+
+
+def scan(query, users):
+    scores = {u: jaccard_similarity(query, topics) for u, topics in users.items()}
+    best = max(scores.values())
+    return best, sorted(u for u, s in scores.items() if s == best)
+
+
+def test_exact_mode_matches_linear_scan():
+    users = profiles(500, seed=25)
+    index = InterestIndex()
+    for u, topics in users.items():
+        index.add(u, topics)
+    for query in list(profiles(80, seed=26).values()) + [['Atlantis'], []]:
+        best, ids = index.query(query, exact=True)
+        assert (best, ids) == scan(query, users)
+        assert find_best_match(query, index=index) in index.query(query)[1]
+
+
+def test_updates_and_deletes():
+    index = InterestIndex()
+    assert index.query(['Food']) == (None, []) and find_best_match(['Food'], index=index) is None
+    index.add(1, ['Food', 'Music'])
+    index.add(2, 'Tech,Art')
+    index.add(3, ['food', ' music '])
+    assert index.query(['Music', 'Food']) == (1.0, [1, 3])
+    index.add(3, ['Tech', 'Art'])
+    assert index.query(['Art', 'Tech']) == (1.0, [2, 3])
+    assert index.remove(2) and not index.remove(2) and 2 not in index
+    assert index.query(['Art', 'Tech']) == (1.0, [3])
+    # Nobody shares a topic: every user ties at zero, as with a full scan
+    assert index.query(['Chess']) == (0.0, [1, 3])
+    index.remove(3)
+    assert index.query(['Art', 'Tech'], exact=True) == (0.0, [1])
+    assert len(index) == 1 and index.bands[0] and not index.members.get(frozenset(['art', 'tech']))
+
+
+def test_lsh_recall():
+    index = InterestIndex()
+    for u, topics in profiles(3000, seed=27).items():
+        index.add(u, topics)
+    queries = list(profiles(200, seed=28).values())
+    assert index.recall(queries) >= 0.95
+    stats = {}
+    index.query(['Food', 'Music', 'Tech'], stats=stats)
+    assert stats['mode'] == 'lsh' and stats['candidates'] < len(index.members) / 2
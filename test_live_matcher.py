@@ -0,0 +1,134 @@
+"""
+test_live_matcher.py
+
+Checks that the incremental top-k heaps always equal a fresh find_matches over the same open
+trips, through inserts, matches/cancellations, expiry and syncs with the database, including the
+background sync thread.
+
+Usage:
+    python -m pytest test_live_matcher.py
+"""
+import random
+import time
+from datetime import timedelta
+
+import live_matcher
+import sqlite_store
+from live_matcher import LiveMatcher
+from matching import find_matches
+from test_trip_index import make_trips
+from trip_index import open_trips
+
+
+def fresh(matcher, tid):
+    trip = matcher.index.trips[tid][0]
+    return find_matches(None, tid, trip['cand_origin'], trip['cand_dest'], trip['earliest'], trip['latest'],
+                        trip['fastest_seconds'], trip['interests'], index=matcher.index)
+
+
+def assert_current(matcher):
+    for tid in matcher.index.trips:
+        assert matcher.matches(tid) == fresh(matcher, tid), tid
+
+
+def test_incremental_equals_find_matches():
+    trips = make_trips(400, seed=21)
+    rng = random.Random(5)
+    matcher = LiveMatcher()
+    for i, trip in enumerate(trips):
+        assert matcher.add(trip) == fresh(matcher, trip['id'])
+        if i % 10 == 9:
+            # A pair gets matched (or a rider cancels)
+            for tid in rng.sample(sorted(matcher.index.trips), 2):
+                matcher.remove(tid)
+    assert_current(matcher)
+
+    cutoff = min(t['latest'] for t in trips) + timedelta(minutes=60)
+    removed = matcher.expire(cutoff)
+    assert removed > 0
+    assert all(matcher.index.trips[tid][0]['latest'] > cutoff for tid in matcher.index.trips)
+    assert_current(matcher)
+
+
+def test_rebuild_from_loaded_index():
+    trips = make_trips(200, seed=4)
+    incremental = LiveMatcher()
+    for trip in trips:
+        incremental.add(trip)
+    rebuilt = LiveMatcher()
+    for trip in trips:
+        rebuilt.index.add(trip)
+    assert rebuilt.rebuild() == len(trips)
+    assert rebuilt.tops == incremental.tops
+
+
+def test_sync_picks_up_other_writers():
+    riders = [{'email': t['email'], 'origin': t['cand_origin'], 'destination': t['cand_dest'],
+               'interests': t['interests'], 'earliest': t['earliest'], 'latest': t['latest'],
+               'fastest_seconds': t['fastest_seconds']} for t in make_trips(150, seed=9)]
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, riders[:100])
+    matcher = LiveMatcher()
+    assert matcher.sync(conn) == (100, 0) and not matcher.sync_due(60)
+    # Another process imports riders and matches a pair behind this matcher's back
+    sqlite_store.insert_riders(conn, riders[100:])
+    conn.raw.execute("UPDATE trips SET matched = TRUE WHERE id IN (3, 40)")
+    conn.commit()
+    assert matcher.sync(conn) == (50, 2)
+    assert 3 not in matcher.index and 40 not in matcher.index and len(matcher) == 148
+    assert_current(matcher)
+    conn.close()
+
+
+def test_background_sync_builds_and_follows_the_database(tmp_path):
+    path = str(tmp_path / 'rides.db')
+    trips = make_trips(300, seed=13)
+    riders = [{'email': t['email'], 'origin': t['cand_origin'], 'destination': t['cand_dest'],
+               'interests': t['interests'], 'earliest': t['earliest'], 'latest': t['latest'],
+               'fastest_seconds': t['fastest_seconds']} for t in trips]
+    conn = sqlite_store.connect(path)
+    sqlite_store.insert_riders(conn, riders[:200])
+    # Trips that ended before the cutoff are filtered in SQL, not fetched and dropped
+    cutoff = sorted(t['latest'] for t in trips[:200])[50]
+    before = conn.rows_fetched
+    assert len(open_trips(conn, cutoff)) == conn.rows_fetched - before == sum(t['latest'] > cutoff for t in trips[:200])
+
+    matcher = LiveMatcher().start(lambda: sqlite_store.connect(path, timeout=30), interval=0.05)
+    try:
+        deadline = time.monotonic() + 10
+        while not matcher.ready and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(matcher) == 200
+        sqlite_store.insert_riders(conn, riders[200:])
+        synced = matcher.synced_at
+        while (matcher.synced_at == synced or len(matcher) < 300) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        matcher.stop()
+    assert len(matcher) == 300
+    assert_current(matcher)
+    conn.close()
+
+
+def test_sync_keeps_changes_made_by_requests_meanwhile(monkeypatch):
+    trips = make_trips(120, seed=17)
+    riders = [{'email': t['email'], 'origin': t['cand_origin'], 'destination': t['cand_dest'],
+               'interests': t['interests'], 'earliest': t['earliest'], 'latest': t['latest'],
+               'fastest_seconds': t['fastest_seconds']} for t in trips]
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, riders[:100])
+    matcher = LiveMatcher()
+    matcher.sync(conn)
+    sqlite_store.insert_riders(conn, riders[100:110])
+
+    def snapshot_then_race(db_conn, now=None):
+        rows = open_trips(db_conn, now)
+        # A request adds a trip MySQL had not shown yet, and claims one the snapshot still lists
+        matcher.add(dict(trips[110], id=999))
+        matcher.remove(105)
+        return rows
+    monkeypatch.setattr(live_matcher, 'open_trips', snapshot_then_race)
+    assert matcher.sync(conn) == (9, 0)
+    assert 999 in matcher.index and 105 not in matcher.index
+    assert_current(matcher)
+    conn.close()
@@ -0,0 +1,108 @@
+"""
+test_mailer.py
+
+Checks the outbound mailer against the local SMTP stand-in: one login serves many messages,
+transient failures are retried with backoff on a fresh connection, permanent ones are given up
+on, sends are rate limited, the queue/latency metrics add up, an unexpected error drops only its
+own message, and each SMTP account gets one shared mailer.
+
+Usage:
+    python -m pytest test_mailer.py
+"""
+import logging
+import time
+
+from fake_smtp import FakeSMTPServer
+from mailer import Mailer, shared_mailer, verification_message
+
+
+def make_mailer(server, **kwargs):
+    host, port = server.address
+    kwargs.setdefault('rate', 0)
+    return Mailer(host, port, 'sender@uchicago.edu', 'app-password', use_ssl=False, backoff=0.01, **kwargs)
+
+
+def test_one_login_for_many_messages():
+    with FakeSMTPServer() as server:
+        mailer = make_mailer(server, batch_size=8)
+        for i in range(30):
+            mailer.send(verification_message(f"rider{i}@uchicago.edu", f"{100000 + i}", 'sender@uchicago.edu'))
+        assert mailer.stats()['queued'] == 30
+        mailer.start()
+        assert mailer.flush(10)
+        mailer.stop()
+
+        assert len(server.fake.messages) == 30
+        assert server.fake.connections == server.fake.logins == 1
+        assert "100007" in server.fake.messages[7].get_payload()
+        stats = mailer.stats()
+        assert stats['queued'] == 0 and stats['sent'] == 30 and stats['failed'] == 0
+        assert 0 <= stats['latency_p50'] <= stats['latency_p95'] <= stats['latency_max']
+
+
+def test_transient_failures_are_retried():
+    with FakeSMTPServer() as server:
+        server.fake.fail_next = 2
+        server.fake.disconnect_next = 1
+        mailer = make_mailer(server).start()
+        for i in range(5):
+            mailer.send(verification_message(f"rider{i}@uchicago.edu", "123456", 'sender@uchicago.edu'))
+        assert mailer.flush(10)
+        mailer.stop()
+        assert len(server.fake.messages) == 5
+        stats = mailer.stats()
+        assert stats['retries'] == 3 and stats['failed'] == 0
+        # The dropped connection is replaced once; the 451s keep using it
+        assert stats['connections'] == server.fake.logins == 2
+
+
+def test_gives_up_after_max_retries(caplog):
+    with FakeSMTPServer() as server:
+        server.fake.fail_next = 100
+        mailer = make_mailer(server, max_retries=3).start()
+        with caplog.at_level(logging.WARNING, logger='mailer'):
+            mailer.send(verification_message("rider@uchicago.edu", "123456", 'sender@uchicago.edu'))
+            assert mailer.flush(10)
+        mailer.stop()
+        assert server.fake.messages == []
+        assert mailer.stats()['failed'] == 1 and mailer.stats()['retries'] == 2
+        # Every failed attempt is logged with its SMTP code and traceback
+        assert len(caplog.records) == 3 and all(r.exc_info and "SMTP code 451" in r.getMessage()
+                                                for r in caplog.records)
+        assert "failed on attempt 3" in caplog.records[-1].getMessage()
+
+
+def test_rate_limit_spaces_sends():
+    with FakeSMTPServer() as server:
+        mailer = make_mailer(server, rate=50)
+        for i in range(11):
+            mailer.send(verification_message(f"rider{i}@uchicago.edu", "123456", 'sender@uchicago.edu'))
+        start = time.monotonic()
+        mailer.start()
+        assert mailer.flush(10)
+        assert time.monotonic() - start >= 10 / 50
+        mailer.stop()
+        assert len(server.fake.messages) == 11
+
+
+def test_unexpected_errors_do_not_stop_the_worker(caplog):
+    with FakeSMTPServer() as server:
+        mailer = make_mailer(server).start()
+        # Not an EmailMessage: send_message raises something other than an SMTP or socket error
+        mailer.send("not a message")
+        mailer.send(verification_message("rider@uchicago.edu", "123456", 'sender@uchicago.edu'))
+        assert mailer.flush(10)
+        mailer.stop()
+        assert len(server.fake.messages) == 1
+        assert mailer.stats()['failed'] == 1 and mailer.stats()['sent'] == 1
+        assert any(r.exc_info for r in caplog.records if r.name == 'mailer')
+
+
+def test_shared_mailer_is_one_per_account():
+    with FakeSMTPServer() as server:
+        host, port = server.address
+        a = shared_mailer(host, port, 'sender@uchicago.edu', 'app-password', use_ssl=False)
+        try:
+            assert shared_mailer(host, port, 'sender@uchicago.edu', 'app-password', use_ssl=False) is a
+        finally:
+            a.stop()
@@ -11,9 +11,8 @@ Usage:
 Ensure the following environment variables are set (e.g. in a .env file):
     DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
 """
-import os
 from dotenv import load_dotenv
-import mysql.connector
+import db
 from datetime import datetime, timedelta
 from matching import find_matches
 
@@ -22,12 +21,8 @@ load_dotenv()
 
 # Database connection helper
 def get_db_connection():
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=os.getenv('DB_NAME')
-    )
+    # Pooled, validated connection shared with the app (see db.py)
+    return db.get_db_connection(db.config_from_env())
 
 # Initialize and clear tables
 def init_db(conn):
@@ -0,0 +1,93 @@
+"""
+test_metrics.py
+
+Checks the metrics registry's Prometheus and JSON output, stage timing spans, the HTTP endpoint,
+and that a real find_matches call on the SQLite stand-in records its db_query and scoring stages.
+
+Usage:
+    python -m pytest test_metrics.py
+"""
+import json
+import logging
+import urllib.request
+
+import pytest
+
+import sqlite_store
+from benchmark import generate_riders
+from matching import find_matches
+from metrics import PROJECT_LOGGERS, STAGE_SECONDS, MetricsServer, Registry, configure_logging, span
+
+
+def test_prometheus_text_format():
+    registry = Registry()
+    requests = registry.counter('cta_requests_total', 'CTA calls')
+    requests.inc(outcome='ok')
+    requests.inc(2, outcome='ok')
+    requests.inc(outcome='bad "json"')
+    latency = registry.histogram('query_seconds', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    registry.gauge('queue_depth', lambda: 7)
+
+    lines = registry.to_prometheus().splitlines()
+    assert '# HELP cta_requests_total CTA calls' in lines
+    assert '# TYPE cta_requests_total counter' in lines
+    assert 'cta_requests_total{outcome="ok"} 3' in lines
+    assert 'cta_requests_total{outcome="bad \\"json\\""} 1' in lines
+    assert 'query_seconds_bucket{le="0.1"} 1' in lines
+    assert 'query_seconds_bucket{le="1.0"} 2' in lines
+    assert 'query_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'query_seconds_count 3' in lines
+    assert 'queue_depth 7' in lines
+    assert json.loads(registry.to_json())['query_seconds']['values']['']['count'] == 3
+
+
+def test_span_records_even_when_raising():
+    before = STAGE_SECONDS.count(stage='test_stage')
+    with span('test_stage'):
+        pass
+    with pytest.raises(ValueError):
+        with span('test_stage'):
+            raise ValueError
+    assert STAGE_SECONDS.count(stage='test_stage') == before + 2
+
+
+def test_metrics_server_serves_both_formats():
+    registry = Registry()
+    registry.counter('hits_total').inc()
+    server = MetricsServer(registry).start()
+    try:
+        text = urllib.request.urlopen(server.url).read().decode()
+        assert 'hits_total 1' in text.splitlines()
+        payload = json.loads(urllib.request.urlopen(server.url + '.json').read())
+        assert payload['hits_total'] == {'type': 'counter', 'values': {'': 1}}
+    finally:
+        server.stop()
+
+
+def test_find_matches_records_stages():
+    conn = sqlite_store.connect()
+    riders = list(generate_riders(200, seed=5, days=1))
+    trip_ids = sqlite_store.insert_riders(conn, riders)
+    before = {stage: STAGE_SECONDS.count(stage=stage) for stage in ('db_query', 'scoring')}
+    r = riders[0]
+    find_matches(conn, trip_ids[0], r['origin'], r['destination'], r['earliest'], r['latest'],
+                 r['fastest_seconds'], r['interests'])
+    for stage, count in before.items():
+        assert STAGE_SECONDS.count(stage=stage) > count
+    conn.close()
+
+
+def test_debug_logging_is_project_only():
+    root = logging.getLogger()
+    saved = root.level, {name: logging.getLogger(name).level for name in PROJECT_LOGGERS}
+    try:
+        configure_logging('debug')
+        assert all(logging.getLogger(name).getEffectiveLevel() == logging.DEBUG for name in PROJECT_LOGGERS)
+        # Library loggers inherit from the root, which stays quiet
+        assert not logging.getLogger('urllib3').isEnabledFor(logging.DEBUG)
+    finally:
+        root.setLevel(saved[0])
+        for name, level in saved[1].items():
+            logging.getLogger(name).setLevel(level)
@@ -0,0 +1,113 @@
+"""
+test_migrations.py
+
+Checks the migration runner's bookkeeping and the EXPLAIN-based plan check against a recording
+stand-in for a MySQL connection, and that the generated segment columns agree with INDEX_MAP.
+
+Usage:
+    python -m pytest test_migrations.py
+"""
+import re
+
+import migrations
+from matching import INDEX_MAP
+
+
+class FakeCursor:
+    def __init__(self, conn, dictionary=False):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.result = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        self.conn.statements.append(sql)
+        if sql.startswith("SELECT GET_LOCK") or sql.startswith("SELECT RELEASE_LOCK"):
+            self.result = [(1,)]
+        elif sql.startswith("SELECT version FROM schema_migrations"):
+            self.result = [(v,) for v in sorted(self.conn.versions)]
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            self.conn.versions.add(params[0])
+        elif "information_schema" in sql:
+            self.result = [(1 if params[1] in self.conn.existing else 0,)]
+        elif sql.startswith("EXPLAIN"):
+            self.result = self.conn.plans.pop(0)
+        else:
+            self.result = []
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, existing=(), plans=None):
+        self.statements = []
+        self.versions = set()
+        self.existing = set(existing)
+        self.plans = plans or []
+        self.commits = 0
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self, dictionary)
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_migrate_applies_pending_once():
+    conn = FakeConn(existing={'origin', 'destination'})
+    assert migrations.migrate(conn) == [v for v, _, _ in migrations.MIGRATIONS]
+    alters = [s for s in conn.statements if s.startswith("ALTER TABLE")]
+    # origin/destination already present: only the generated columns are added
+    assert [re.search(r"ADD COLUMN (\w+)", s).group(1) for s in alters] == [
+        'seg_start', 'seg_end', 'direction', 'interest_mask']
+    assert sum(s.startswith("CREATE INDEX") for s in conn.statements) == 2
+
+    conn.statements.clear()
+    assert migrations.migrate(conn) == []
+    assert not any(s.startswith(("ALTER", "CREATE INDEX", "UPDATE")) for s in conn.statements)
+
+
+def test_unused_direction_is_dropped():
+    # A database migrated before version 9 still has the column and its index
+    conn = FakeConn(existing={'origin', 'destination', 'direction', 'idx_trips_open_segment'})
+    conn.versions.update(range(1, 9))
+    assert migrations.migrate(conn) == [9]
+    assert [s for s in conn.statements if s.startswith(("DROP", "ALTER"))] == [
+        "DROP INDEX idx_trips_open_segment ON trips", "ALTER TABLE trips DROP COLUMN direction"]
+
+
+def test_station_positions_match_index_map():
+    field = migrations._station_field('origin')
+    names = re.findall(r"'([^']*)'", field)
+    assert {name: pos for pos, name in enumerate(names)} == INDEX_MAP
+
+
+def test_plan_check_flags_full_scans():
+    ok = [{'table': 't', 'type': 'range', 'possible_keys': 'idx_trips_open_window', 'rows': 40},
+          {'table': 'p', 'type': 'eq_ref', 'possible_keys': 'PRIMARY', 'rows': 1}]
+    tiny = [{'table': 't', 'type': 'ALL', 'possible_keys': 'idx_trips_open_window', 'rows': 12}]
+    assert migrations.check_query_plans(FakeConn(plans=[ok, ok, tiny, ok, ok, ok])) == []
+
+    no_index = [{'table': 't', 'type': 'ALL', 'possible_keys': None, 'rows': 12}]
+    big_scan = [{'table': 't', 'type': 'ALL', 'possible_keys': 'idx_trips_open_window', 'rows': 50000}]
+    problems = migrations.check_query_plans(FakeConn(plans=[no_index, ok, big_scan, ok, ok, ok]))
+    assert [(label, access) for label, _, access in problems] == [
+        ('find_matches candidates', 'ALL'), ('batch open trips', 'ALL')]
+
+
+def test_plan_check_explains_the_code_paths_sql():
+    from batch_match import OPEN_TRIPS_SQL
+    from matching import CANDIDATE_SQL
+    from retention import EXPIRED_SQL
+    queries = migrations.hot_queries()
+    assert queries['batch open trips'][0] is OPEN_TRIPS_SQL
+    assert queries['find_matches candidates'][0] is CANDIDATE_SQL
+    assert queries['retention batch'][0] is EXPIRED_SQL and 'ORDER BY' not in EXPIRED_SQL
+    assert 'FOR UPDATE' not in EXPIRED_SQL and 'FOR UPDATE SKIP LOCKED' in queries['retention lock'][0]
@@ -0,0 +1,113 @@
+"""
+test_network.py
+
+Checks the data-driven 'L' network: on the Red Line the route bitmaps reduce to the old station
+index ranges, routes across transfers share track where they should, the matcher, index and
+group builder agree with a brute-force overlap check on trips from every line, and trips off the
+Red Line get a fastest time from their route so they can be matched.
+
+Usage:
+    python -m pytest test_network.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import cta_api
+from group_match import grow_clique
+from matching import INDEX_MAP, STATION_LIST, find_matches
+from network import HOP_SECONDS, NETWORK, TRANSFER_SECONDS, Network
+from test_trip_index import FakeConn
+from trip_index import OpenTripIndex
+
+
+def test_red_line_routes_are_index_ranges():
+    for a in STATION_LIST:
+        for b in STATION_LIST:
+            start, end = sorted([INDEX_MAP[a], INDEX_MAP[b]])
+            assert [NETWORK.edges[e] for e in NETWORK.route_edges(a, b)] == [
+                ('Red', STATION_LIST[i], STATION_LIST[i + 1]) for i in range(start, end)]
+
+
+def test_routes_share_track_across_transfers():
+    shared = NETWORK.overlaps
+    # O'Hare -> Garfield changes to the Red Line at Jackson
+    assert NETWORK.transfers[NETWORK.index["O'Hare"], NETWORK.index['Garfield']] == 1
+    assert shared(("O'Hare", 'Garfield'), ('Howard', 'Roosevelt'))
+    assert shared(("O'Hare", 'Garfield'), ('Logan Square', 'Clark/Lake'))
+    assert not shared(("O'Hare", 'Garfield'), ('Howard', 'Monroe'))
+    # Both Green Line branches ride the trunk; Loop stations on different lines are different track
+    assert shared(('Cottage Grove', 'Roosevelt'), ('Ashland/63rd', 'Clark/Lake'))
+    assert not shared(('Midway', 'Clark/Lake'), ('Kimball', 'Clark/Lake'))
+    # A trip that starts and ends at the same station rides no track
+    assert not shared(('Belmont', 'Belmont'), ('Howard', 'Roosevelt'))
+    with pytest.raises(ValueError):
+        NETWORK.route_mask('Howard', 'Atlantis')
+
+
+def test_conflicting_map_ids_are_rejected():
+    with pytest.raises(ValueError):
+        Network([('A', 'A', [['X', '1'], ['Y', '2']]), ('B', 'B', [['X', '3'], ['Z', '4']])])
+
+
+def network_trips(n, seed):
+    rng = random.Random(seed)
+    base = datetime(2025, 4, 26, 7, 0)
+    trips = []
+    for i in range(1, n + 1):
+        start = base + timedelta(minutes=rng.randrange(0, 120))
+        trips.append({
+            'id': i, 'cand_origin': rng.choice(NETWORK.names), 'cand_dest': rng.choice(NETWORK.names),
+            'earliest': start, 'latest': start + timedelta(minutes=15),
+            'fastest_seconds': rng.randrange(300, 2400), 'email': f"user{i}@uchicago.edu",
+            'interests': ",".join(rng.sample(['Food', 'Music', 'Tech', 'Art', 'Books'], 2)),
+        })
+    return trips
+
+
+def test_matcher_works_network_wide():
+    trips = network_trips(400, seed=24)
+    index = OpenTripIndex()
+    for t in trips:
+        index.add(t)
+    conn = FakeConn(trips)
+    for q in trips[:60]:
+        expected = [t['id'] for t in trips if t['id'] != q['id'] and t['earliest'] < q['latest']
+                    and t['latest'] > q['earliest']
+                    and NETWORK.overlaps((q['cand_origin'], q['cand_dest']), (t['cand_origin'], t['cand_dest']))]
+        got = index.candidates(q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'])
+        assert [r['id'] for r in got] == expected
+        args = (q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'], q['fastest_seconds'],
+                q['interests'])
+        assert find_matches(None, *args, index=index) == find_matches(conn, *args)
+
+
+def test_trips_off_the_red_line_get_a_fastest_time(monkeypatch):
+    # No travel matrix and no live planning off the Red Line: the route length is the estimate
+    monkeypatch.setattr(cta_api, 'TRAVEL_MATRIX', False)
+    blue = list(NETWORK.line_stations('Blue'))
+    fastest, dep, arr = cta_api.compute_fastest("O'Hare", 'Clark/Lake', 'key', datetime(2025, 4, 28, 8),
+                                                estimate_only=True)
+    assert fastest == (blue.index('Clark/Lake') - blue.index("O'Hare")) * HOP_SECONDS
+    assert arr - dep == timedelta(seconds=fastest)
+    assert NETWORK.estimate_seconds("O'Hare", 'Garfield') >= HOP_SECONDS + TRANSFER_SECONDS
+    assert NETWORK.estimate_seconds('Garfield', 'Garfield') is None
+    assert cta_api.compute_fastest('Nowhere', 'Garfield', 'key', estimate_only=True)[0] is None
+
+    # Two Blue Line riders with those estimates now score instead of being skipped for a missing time
+    start = datetime(2025, 4, 28, 8)
+    pairs = [("O'Hare", 'Clark/Lake'), ('Logan Square', 'UIC-Halsted')]
+    rows = [{'id': i, 'cand_origin': o, 'cand_dest': d, 'earliest': start, 'latest': start + timedelta(minutes=15),
+             'fastest_seconds': NETWORK.estimate_seconds(o, d), 'email': f"user{i}@uchicago.edu",
+             'interests': 'Food,Music'} for i, (o, d) in enumerate(pairs, 1)]
+    matches = find_matches(FakeConn(rows), 1, "O'Hare", 'Clark/Lake', start, start + timedelta(minutes=15), fastest,
+                           'Food')
+    assert [m['trip_id'] for m in matches] == [2] and matches[0]['score'] > 0
+
+
+def test_cliques_keep_a_common_edge():
+    # Three trips sharing track pairwise (edges 0-1, 1-2, 0-2) but with no edge common to all
+    adj = [{1: 1.0, 2: 1.0}, {0: 1.0, 2: 1.0}, {0: 1.0, 1: 1.0}]
+    assert grow_clique(0, adj, [1, 2], 4) == ([0, 1, 2], 3.0)
+    assert grow_clique(0, adj, [1, 2], 4, routes=[0b011, 0b110, 0b101]) == ([0, 1], 1.0)
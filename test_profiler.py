@@ -0,0 +1,101 @@
+"""
+test_profiler.py
+
+Checks the profiling hooks: find_matches(profile=...) attributes its time to the db_query and
+scoring stages, a pooled CTAClient lookup is recorded as plan_trip/cta_fetch, and a cli_match run recorded with --record-cta replays offline with the same plan
+and a comparable --trace.
+
+Usage:
+    python -m pytest test_profiler.py
+"""
+import json
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import cli_match
+import cta_api
+import sqlite_store
+from benchmark import generate_riders
+from cta_client import CTAClient, Deadline
+from fake_cta import FakeCTA, FakeCTAServer
+from matching import find_matches
+from metrics import span
+from profiler import Profiler, format_diff
+
+
+def test_find_matches_profile_hook():
+    conn = sqlite_store.connect()
+    riders = list(generate_riders(300, seed=8, days=1))
+    trip_ids = sqlite_store.insert_riders(conn, riders)
+    r = riders[0]
+    prof = Profiler()
+    with span('outside'):
+        pass
+    with prof:
+        with span('plan_trip'):
+            with span('cta_fetch'):
+                pass
+        find_matches(conn, trip_ids[0], r['origin'], r['destination'], r['earliest'], r['latest'],
+                     r['fastest_seconds'], r['interests'], profile=prof)
+    report = prof.report()
+    assert set(report['stages']) == {'plan_trip', 'plan_trip/cta_fetch', 'db_query', 'scoring'}
+    assert all(s['calls'] == 1 for s in report['stages'].values())
+    top = sum(s['wall'] for name, s in report['stages'].items() if '/' not in name)
+    assert top + report['unattributed'] == pytest.approx(report['wall'])
+    conn.close()
+
+
+def test_profiles_a_real_cta_fetch():
+    # The HTTP attempts run on the client's pool threads; the stage must still land under plan_trip
+    with FakeCTAServer(FakeCTA(horizon=3600)) as server:
+        client = CTAClient(lambda map_id, api_key, session, timeout: cta_api._fetch_arrivals(
+            map_id, api_key, session, url=server.url, timeout=timeout), hedge=False)
+        prof = Profiler()
+        with prof:
+            with span('plan_trip'):
+                assert client.fetch(cta_api.red_line_stations['Howard'], 'key', Deadline(2.0))
+        client.close()
+    stages = prof.report()['stages']
+    assert set(stages) == {'plan_trip', 'plan_trip/cta_fetch'} and stages['plan_trip/cta_fetch']['calls'] == 1
+    assert 0 < stages['plan_trip/cta_fetch']['wall'] <= stages['plan_trip']['wall']
+
+
+def test_cli_record_then_replay(tmp_path, monkeypatch, capsys):
+    # Real-time timetable: recording plans against the current time
+    fake = FakeCTA(start=datetime.now(cta_api.central).replace(tzinfo=None) - timedelta(minutes=10), runs=20,
+                   horizon=3600)
+    live_calls = []
+
+    def live(map_id, api_key, deadline=None):
+        live_calls.append(map_id)
+        return fake.etas(map_id)
+    monkeypatch.setattr(cta_api, '_get_arrivals', live)
+    path = str(tmp_path / 'rides.db')
+    monkeypatch.setattr(cli_match, 'get_db_connection', lambda: sqlite_store.connect(path))
+    sqlite_store.insert_riders(sqlite_store.connect(path), list(generate_riders(200, seed=3, days=1)))
+
+    def run(*extra):
+        monkeypatch.setattr(sys, 'argv', ['cli_match.py', '--email', 'a@uchicago.edu', '--origin', 'Howard',
+                                          '--destination', 'Garfield', '--interests', 'Food,Music',
+                                          '--log-level', 'WARNING', *extra])
+        cli_match.main()
+        out, err = capsys.readouterr()
+        return out.splitlines()[0], err
+
+    recording, before, after = (str(tmp_path / name) for name in ('cta.json', 'before.json', 'after.json'))
+    planned, _ = run('--record-cta', recording, '--trace', before)
+    assert planned.startswith('Fastest travel: ') and 'None' not in planned
+    assert len(live_calls) == 2
+
+    monkeypatch.setattr(cta_api, '_get_arrivals',
+                        lambda map_id, api_key, deadline=None: pytest.fail('replay went online'))
+    replayed, err = run('--replay-cta', recording, '--profile', '--trace', after)
+    assert replayed == planned
+    assert 'plan_trip' in err and 'scoring' in err
+
+    with open(before) as f, open(after) as g:
+        a, b = json.load(f), json.load(g)
+    assert {'plan_trip', 'db_write', 'db_query', 'scoring'} <= set(a['stages']) == set(b['stages'])
+    assert 'plan_trip' in format_diff(a, b)
@@ -0,0 +1,73 @@
+"""
+test_retention.py
+
+Checks retention against the SQLite stand-in: finished trips move to the archive with their
+matches and group memberships in bounded batches, nothing is lost or duplicated, and matching
+over the remaining trips is unchanged.
+
+Usage:
+    python -m pytest test_retention.py
+"""
+from datetime import datetime
+
+import sqlite_store
+from batch_match import run_batch
+from benchmark import generate_riders
+from group_match import run_groups
+from matching import find_matches
+from retention import format_report, run_retention
+
+CUTOFF = datetime(2025, 4, 30)
+
+
+def counts(conn, *tables):
+    cur = conn.cursor()
+    out = []
+    for table in tables:
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        out.append(cur.fetchone()[0])
+    cur.close()
+    return out
+
+
+def test_retention_moves_finished_trips():
+    conn = sqlite_store.connect()
+    riders = list(generate_riders(3000, seed=23, days=4))
+    sqlite_store.insert_riders(conn, riders)
+    run_batch(conn, datetime(2025, 4, 28, 6), datetime(2025, 4, 28, 12), max_degree=10)
+    run_groups(conn, datetime(2025, 4, 29, 6), datetime(2025, 4, 29, 12), max_size=3, max_degree=10)
+    run_batch(conn, datetime(2025, 5, 1, 6), datetime(2025, 5, 1, 12), max_degree=10)
+    trips, matches, members, groups = counts(conn, 'trips', 'matches', 'ride_group_members', 'ride_groups')
+    later = [r for r in riders if r['earliest'] >= CUTOFF][:20]
+
+    def later_matches():
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM trips WHERE earliest >= %s ORDER BY id LIMIT 20", (CUTOFF,))
+        ids = [row[0] for row in cur.fetchall()]
+        return [find_matches(conn, tid, r['origin'], r['destination'], r['earliest'], r['latest'],
+                             r['fastest_seconds'], r['interests']) for tid, r in zip(ids, later)]
+    before_matches = later_matches()
+
+    report = run_retention(conn, CUTOFF, batch_size=400)
+    finished = sum(r['latest'] < CUTOFF for r in riders)
+    assert report['before'] == trips and report['expired'] == finished
+    assert report['after'] == trips - finished
+    assert report['batches'] == -(-finished // 400)
+    assert "compacted" in format_report(report)
+
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM trips WHERE latest < %s", (CUTOFF,))
+    assert cur.fetchone()[0] == 0
+    cur.close()
+    assert counts(conn, 'trips_archive') == [finished]
+    left = counts(conn, 'matches', 'matches_archive', 'ride_group_members', 'ride_group_members_archive')
+    assert left[0] + left[1] == matches and left[1] > 0 and left[0] > 0
+    assert left[2] == 0 and left[3] == members
+    # Every party was formed before the cutoff, so none may stay behind without members
+    assert groups > 0 and counts(conn, 'ride_groups', 'ride_groups_archive') == [0, groups]
+    assert report['archived']['groups'] == groups
+    assert later_matches() == before_matches
+
+    # Nothing left to move
+    assert run_retention(conn, CUTOFF)['archived']['trips'] == 0
+    conn.close()
@@ -0,0 +1,110 @@
+"""
+test_run_matching.py
+
+Checks run-based matching against the SQLite stand-in and a simulated timetable: candidate_runs
+only returns trains heading towards the destination (alighting at a run's first arrival there),
+find_run_matches only pairs riders on a
+shared run in the same direction, and the run join reads far fewer rows than window matching.
+
+Usage:
+    python -m pytest test_run_matching.py
+"""
+from datetime import datetime, timedelta
+from functools import cache
+
+import pytest
+
+import cta_api
+import sqlite_store
+from benchmark import generate_riders
+from fake_cta import FakeCTA
+from matching import RUN_DIRECTION, find_matches, find_run_matches, record_trip_runs
+
+DAY = datetime(2025, 4, 28)
+
+
+@pytest.fixture
+def timetable(monkeypatch):
+    # A full day of runs every 5 minutes, all predicted (as if read just before the first run)
+    fake = FakeCTA(start=DAY + timedelta(hours=4), headway=300, runs=240, horizon=24 * 3600,
+                   clock=lambda: DAY)
+    monkeypatch.setattr(cta_api, 'get_arrivals', cache(lambda map_id, api_key: fake.etas(map_id)))
+    monkeypatch.setattr(cta_api, 'LIVE_TIMETABLE', None)
+    return fake
+
+
+def test_candidate_runs_follow_direction(timetable):
+    start = DAY + timedelta(hours=8)
+    south = cta_api.candidate_runs('Howard', 'Garfield', 'key', start, start + timedelta(minutes=15))
+    north = cta_api.candidate_runs('Garfield', 'Howard', 'key', start, start + timedelta(minutes=15))
+    assert len(south) == len(north) == 4
+    assert {r['trdr'] for r in south} == {'5'} and {r['trdr'] for r in north} == {'1'}
+    for r in south + north:
+        assert start <= r['board_time'] <= start + timedelta(minutes=15)
+        assert r['alight_time'] - r['board_time'] == timedelta(seconds=20 * timetable.hop)
+    assert cta_api.candidate_runs('Howard', 'Howard', 'key', start, start + timedelta(minutes=15)) == []
+
+
+def test_run_listed_twice_alights_at_first_arrival(timetable, monkeypatch):
+    # The destination lists one run twice (a repeated prediction further out); the rider gets off
+    # the first time it arrives, which is the first entry in arrival order
+    start = DAY + timedelta(hours=8)
+    garfield = cta_api.red_line_stations['Garfield']
+    expected = cta_api.candidate_runs('Howard', 'Garfield', 'key', start, start + timedelta(minutes=15))
+    run = expected[0]['run_number']
+
+    def etas(map_id, api_key):
+        out = timetable.etas(map_id)
+        if map_id == garfield:
+            first = next(e for e in out if e['rn'] == run and e['trDr'] == '5')
+            later = datetime.strptime(first['arrT'], "%Y-%m-%dT%H:%M:%S") + timedelta(minutes=10)
+            out.append(dict(first, arrT=later.strftime("%Y-%m-%dT%H:%M:%S")))
+            out.sort(key=lambda e: e['arrT'])
+        return out
+    monkeypatch.setattr(cta_api, 'get_arrivals', etas)
+    assert cta_api.candidate_runs('Howard', 'Garfield', 'key', start, start + timedelta(minutes=15)) == expected
+
+
+def test_run_join_pairs_riders_on_the_same_train(timetable):
+    conn = sqlite_store.connect()
+    riders = list(generate_riders(3000, seed=31, start=DAY, days=1))
+    ids = sqlite_store.insert_riders(conn, riders)
+    runs = {}
+    for tid, r in zip(ids, riders):
+        runs[tid] = cta_api.candidate_runs(r['origin'], r['destination'], 'key', r['earliest'], r['latest'])
+        record_trip_runs(conn, tid, runs[tid])
+    conn.commit()
+    by_email = dict(zip((r['email'] for r in riders), ids))
+
+    window_rows = run_rows = 0
+    for tid, r in list(zip(ids, riders))[:100]:
+        stats = {}
+        matches = find_run_matches(conn, tid, r['origin'], r['destination'], r['fastest_seconds'], r['interests'],
+                                   runs[tid], stats=stats)
+        run_rows += stats['candidates']
+        window = {}
+        find_matches(conn, tid, r['origin'], r['destination'], r['earliest'], r['latest'], r['fastest_seconds'],
+                     r['interests'], stats=window)
+        window_rows += window['candidates']
+
+        direction = RUN_DIRECTION[runs[tid][0]['trdr']] if runs[tid] else None
+        mine = {run['run_number'] for run in runs[tid]}
+        for m in matches:
+            other = by_email[m['email']]
+            # Same train, same direction, and they are actually aboard together
+            assert m['run_number'] in mine
+            assert m['run_number'] in {run['run_number'] for run in runs[other]}
+            assert {RUN_DIRECTION[run['trdr']] for run in runs[other]} == {direction}
+            assert m['departure'] < m['arrival'] and m['score'] >= 0
+        assert [m['score'] for m in matches] == sorted((m['score'] for m in matches), reverse=True)
+
+    assert run_rows < window_rows
+    conn.close()
+
+
+def test_unknown_station_and_no_runs():
+    with pytest.raises(ValueError):
+        find_run_matches(None, 1, 'Nowhere', 'Howard', 600, 'Food', [])
+    stats = {}
+    assert find_run_matches(None, 1, 'Howard', 'Garfield', 600, 'Food', [], stats=stats) == []
+    assert stats == {'candidates': 0, 'valid': 0}
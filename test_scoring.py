@@ -0,0 +1,134 @@
+"""
+test_scoring.py
+
+Checks that the vectorized scorer reproduces the per-row scoring formulas exactly,
+including tie order, free-form interests and sub-second CLI timestamps.
+
+Usage:
+    python -m pytest test_scoring.py
+"""
+import random
+from datetime import datetime, timedelta
+from math import sqrt
+
+from matching import STATION_LIST, INDEX_MAP, find_matches
+from network import NETWORK
+from scoring import CandidateBatch, score_batch, bounded_top_k, top_k, SKIP_NONE
+from cli_match import score_candidates
+from test_trip_index import FakeConn, make_trips
+
+
+def tokens(interests):
+    """Interest tokens as every scorer normalizes them: case and spaces ignored, empty tokens dropped."""
+    return {i.replace(' ', '').lower() for i in interests.split(',')} - {''}
+
+
+def reference_find_matches(candidates, origin, destination, earliest, latest, fastest, interests):
+    """The original per-row loop from matching.find_matches."""
+    start1, end1 = sorted([INDEX_MAP[origin], INDEX_MAP[destination]])
+    topics_a = tokens(interests)
+    scored = []
+    for cand in candidates:
+        b_o = INDEX_MAP.get(cand['cand_origin']); b_d = INDEX_MAP.get(cand['cand_dest'])
+        if b_o is None or b_d is None:
+            continue
+        start2, end2 = sorted([b_o, b_d])
+        # Overlap means sharing track, so a trip with origin == destination overlaps nothing
+        if end1 <= start2 or end2 <= start1 or start1 == end1 or start2 == end2:
+            continue
+        ov_sec = (min(latest, cand['latest']) - max(earliest, cand['earliest'])).total_seconds()
+        if ov_sec <= 0:
+            continue
+        bf = cand['fastest_seconds']
+        if not fastest or not bf:
+            continue
+        closeness = ov_sec / max(fastest, bf)
+        topics_b = tokens(cand['interests'])
+        sim = (len(topics_a & topics_b) / sqrt(len(topics_a) * len(topics_b))) if topics_a and topics_b else 0
+        scored.append({
+            'trip_id': cand['id'],
+            'email': cand['email'],
+            'interests': cand['interests'],
+            'departure': max(earliest, cand['earliest']),
+            'arrival': min(latest, cand['latest']),
+            'score': ov_sec * closeness * sim
+        })
+    scored.sort(key=lambda x: x['score'], reverse=True)
+    return scored[:3]
+
+
+def reference_compute_metrics(candidate, origin_earliest, origin_latest, origin_fastest, origin_interests):
+    """The original per-row cli_match.compute_metrics, with interests normalized as find_matches does."""
+    overlap_sec = (min(origin_latest, candidate['latest']) - max(origin_earliest, candidate['earliest'])).total_seconds()
+    if overlap_sec <= 0:
+        return None
+    closeness = overlap_sec / max(origin_fastest, candidate['fastest_seconds'])
+    set_a = tokens(origin_interests)
+    set_b = tokens(candidate['interests'])
+    sim = (len(set_a & set_b) / sqrt(len(set_a) * len(set_b))) if set_a and set_b else 0
+    return {'email': candidate['email'], 'score': overlap_sec * closeness * sim}
+
+
+def noisy_trips(n, seed):
+    """Trips with whitespace, free-form topics, missing fastest times and duplicate windows."""
+    rng = random.Random(seed)
+    trips = make_trips(n, seed)
+    words = ['Food', ' Music', 'Tech ', 'Chess', 'knitting', '', 'Art']
+    for t in trips:
+        t['interests'] = ",".join(rng.sample(words, rng.randrange(1, 4)))
+        if rng.random() < 0.1:
+            t['fastest_seconds'] = None if rng.random() < 0.5 else 0
+        if rng.random() < 0.2:
+            t['earliest'] = trips[0]['earliest']
+            t['latest'] = trips[0]['latest']
+    return trips
+
+
+def test_find_matches_equals_reference():
+    trips = noisy_trips(400, seed=3)
+    conn = FakeConn(trips)
+    for q in trips[:80]:
+        cands = [dict(r) for r in trips if r['id'] != q['id']
+                 and r['earliest'] < q['latest'] and r['latest'] > q['earliest']]
+        expected = reference_find_matches(cands, q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'],
+                                          q['fastest_seconds'], q['interests'])
+        got = find_matches(conn, q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'],
+                           q['fastest_seconds'], q['interests'])
+        assert got == expected
+
+
+def test_cli_scores_equal_reference():
+    trips = noisy_trips(300, seed=5)
+    for t in trips:
+        t['fastest_seconds'] = t['fastest_seconds'] or 600
+    now = datetime(2025, 4, 26, 8, 3, 17, 123456)
+    got = score_candidates(trips, now, now + timedelta(minutes=30), 900, 'Food,Music,Chess', k=5)
+    ref = [m for m in (reference_compute_metrics(t, now, now + timedelta(minutes=30), 900, 'Food,Music,Chess')
+                       for t in trips) if m]
+    ref.sort(key=lambda x: x['score'], reverse=True)
+    assert [(r['email'], r['score']) for r in got] == [(r['email'], r['score']) for r in ref[:5]]
+
+
+def test_bounded_top_k_prunes_and_matches_full_scoring():
+    trips = noisy_trips(600, seed=9)
+    batch = CandidateBatch(trips, network=NETWORK)
+    pruned = 0
+    for q in trips[:40]:
+        args = (q['earliest'], q['latest'], q['fastest_seconds'], q['interests'])
+        route = NETWORK.route_mask(q['cand_origin'], q['cand_dest'])
+        res = score_batch(batch, *args, route=route)
+        expected = top_k(res['score'], res['skip'] == SKIP_NONE, 3)
+        stats = {}
+        idx, scores = bounded_top_k(batch, *args, 3, route=route, block=8, stats=stats)
+        assert idx.tolist() == expected.tolist()
+        assert scores.tolist() == res['score'][expected].tolist()
+        assert stats['scored'] + stats['pruned'] == stats['valid'] == int((res['skip'] == SKIP_NONE).sum())
+        pruned += stats['pruned']
+    # The shared duplicate window gives plenty of candidates that cannot reach the top 3
+    assert pruned > 0
+
+    stats = {}
+    q = trips[0]
+    find_matches(FakeConn(trips), q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'],
+                 q['fastest_seconds'] or 600, q['interests'], stats=stats)
+    assert stats['candidates'] >= stats['valid'] >= stats['scored'] > 0
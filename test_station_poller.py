@@ -0,0 +1,116 @@
+"""
+test_station_poller.py
+
+Runs the background station poller against the local fake CTA endpoint and checks that
+compute_fastest answers from the live timetable without touching the network, and that
+unexpected errors are counted and logged without stopping the poller.
+
+Usage:
+    python -m pytest test_station_poller.py
+"""
+import time
+from datetime import timedelta
+
+import requests
+
+import cta_api
+from arrivals_cache import ArrivalsCache
+from fake_cta import FakeCTA, FakeCTAServer
+from station_poller import StationPoller, LiveTimetable
+
+
+def test_timetable_indexes_runs():
+    tt = LiveTimetable()
+    tt.update('40900', [{'rn': '801', 'arrT': '2025-04-26T08:00:00'}, {'rn': '802', 'arrT': '2025-04-26T08:05:00'}])
+    tt.update('41380', [{'rn': '801', 'arrT': '2025-04-26T08:08:00'}])
+    assert tt.run_arrival('801', '41380')['arrT'] == '2025-04-26T08:08:00'
+    tt.update('40900', [{'rn': '802', 'arrT': '2025-04-26T08:05:00'}])
+    assert tt.run_arrival('801', '40900') is None
+    assert set(tt.runs()) == {'801', '802'}
+
+
+def test_poller_serves_compute_fastest_offline(monkeypatch):
+    fake = FakeCTA(hop=120)
+    with FakeCTAServer(fake) as server:
+        poller = StationPoller('test-key', url=server.url, interval=60, cache=ArrivalsCache())
+        try:
+            assert poller.poll_once() == len(cta_api.red_line_stations)
+            assert fake.requests == len(cta_api.red_line_stations)
+
+            def no_network(*args, **kwargs):
+                raise AssertionError("request path must not call the CTA API")
+            monkeypatch.setattr(requests, 'get', no_network)
+            monkeypatch.setattr(cta_api, 'LIVE_TIMETABLE', poller.timetable)
+
+            # Howard -> Bryn Mawr is four hops southbound
+            fastest, dep, arr = cta_api.compute_fastest('Howard', 'Bryn Mawr', 'test-key', fake.start)
+            assert fastest == 4 * 120
+            assert arr - dep == timedelta(seconds=480)
+        finally:
+            poller.stop()
+
+
+def test_background_loop_refreshes():
+    fake = FakeCTA()
+    with FakeCTAServer(fake) as server:
+        poller = StationPoller('test-key', stations={'Howard': '40900'}, url=server.url, interval=0.05,
+                               cache=ArrivalsCache()).start()
+        try:
+            for _ in range(200):
+                if poller.polls >= 3:
+                    break
+                time.sleep(0.01)
+            assert poller.polls >= 3
+            assert poller.timetable.arrivals('40900')
+        finally:
+            poller.stop()
+
+
+def test_failures_are_counted_across_workers():
+    fake = FakeCTA()
+    fake.fail_next = len(cta_api.red_line_stations)
+    with FakeCTAServer(fake) as server:
+        poller = StationPoller('test-key', url=server.url, interval=60, workers=8, cache=ArrivalsCache())
+        try:
+            assert poller.poll_once() == 0
+            assert poller.poll_once() == len(cta_api.red_line_stations)
+            stats = poller.stats()
+            assert stats['polls'] == 2 and stats['errors'] == len(cta_api.red_line_stations)
+            assert stats['last_poll_seconds'] is not None
+        finally:
+            poller.stop()
+
+
+def test_unexpected_errors_do_not_stop_polling(caplog, monkeypatch):
+    fake = FakeCTA()
+    with FakeCTAServer(fake) as server:
+        def on_update(map_id, etas):
+            raise ValueError("bad update")
+        poller = StationPoller('test-key', stations={'Howard': '40900', 'Garfield': '41170'}, url=server.url,
+                               interval=0.02, cache=ArrivalsCache(), on_update=on_update)
+        # A non-object JSON body: _fetch_arrivals' payload.get raises AttributeError
+        fake.payload = lambda map_id: None
+        assert poller.poll_once() == 0 and poller.errors == 2
+        assert any(r.exc_info and r.exc_info[0] is AttributeError for r in caplog.records)
+        del fake.payload
+
+        # Even a round that raises as a whole is logged and the loop goes on
+        rounds = iter([RuntimeError("bad round")])
+        real = poller.poll_once
+
+        def flaky():
+            for error in rounds:
+                raise error
+            return real()
+        monkeypatch.setattr(poller, 'poll_once', flaky)
+        poller.start()
+        try:
+            for _ in range(300):
+                if poller.polls >= 3:
+                    break
+                time.sleep(0.01)
+            assert poller.polls >= 3 and poller.errors >= 2 + 2 * 2
+        finally:
+            poller.stop()
+        assert any("Station poll round failed" in r.getMessage() for r in caplog.records)
+        assert any(r.exc_info and r.exc_info[0] is ValueError for r in caplog.records)
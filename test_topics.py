@@ -0,0 +1,68 @@
+"""
+test_topics.py
+
+Checks the topic registry: the Python interest_mask agrees with the generated SQL column, the
+popcount similarities agree with the set-based ones, and the BIT_COUNT candidate prefilter
+never drops a rider that find_matches would score above zero.
+
+Usage:
+    python -m pytest test_topics.py
+"""
+from datetime import datetime
+
+import sqlite_store
+from benchmark import generate_riders
+from matching import find_matches
+from topics import TOPICS, interest_mask, is_canonical, jaccard_similarity, mask_cosine
+
+
+def test_mask_matches_generated_column():
+    samples = ['Food,Music', ' food , MUSIC ', 'Science Fiction,Art', '', 'Chess', 'Comedy,History,Tech,Fitness']
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, [
+        {'email': f"u{i}@uchicago.edu", 'origin': 'Howard', 'destination': 'Garfield', 'interests': s,
+         'earliest': None, 'latest': None, 'fastest_seconds': 600}
+        for i, s in enumerate(samples)])
+    cur = conn.cursor()
+    cur.execute("SELECT interests, interest_mask FROM profiles ORDER BY id")
+    assert cur.fetchall() == [(s, interest_mask(s)) for s in samples]
+    assert interest_mask(TOPICS) == (1 << len(TOPICS)) - 1
+    assert is_canonical(' food , MUSIC ') and not is_canonical('Chess,Food') and not is_canonical('')
+    conn.close()
+
+
+def test_popcount_similarities():
+    a, b = ['Food', 'Music', 'Art'], ['music', 'Art ', 'Books']
+    assert jaccard_similarity(a, b) == 2 / 4
+    assert mask_cosine(interest_mask(a), interest_mask(b)) == 2 / 3
+    # Free-form topics fall back to sets
+    assert jaccard_similarity(['Chess', 'Food'], ['chess']) == 1 / 2
+
+
+def test_shared_only_prefilter_is_exact():
+    riders = list(generate_riders(3000, seed=13, days=1))
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, riders)
+    for q in generate_riders(60, seed=14, days=1):
+        args = (0, q['origin'], q['destination'], q['earliest'], q['latest'], q['fastest_seconds'], q['interests'])
+        before = conn.rows_fetched
+        everyone = find_matches(conn, *args)
+        middle = conn.rows_fetched
+        shared = find_matches(conn, *args, shared_only=True)
+        assert conn.rows_fetched - middle <= middle - before
+        assert shared == [m for m in everyone if m['score'] > 0]
+    conn.close()
+
+
+def test_scorer_and_prefilter_share_one_normalization():
+    # The stored mask ignores case and spaces, so the scorer must too, or the prefilter keeps zero scores
+    rider = {'email': 'a@uchicago.edu', 'origin': 'Howard', 'destination': 'Garfield', 'interests': 'food, science',
+             'earliest': datetime(2025, 4, 28, 8, 0), 'latest': datetime(2025, 4, 28, 8, 15), 'fastest_seconds': 900}
+    conn = sqlite_store.connect()
+    sqlite_store.insert_riders(conn, [rider])
+    args = (0, 'Howard', 'Garfield', rider['earliest'], rider['latest'], 900, 'Food,Science,')
+    everyone = find_matches(conn, *args)
+    assert len(everyone) == 1 and everyone[0]['score'] > 0
+    assert find_matches(conn, *args, shared_only=True) == everyone
+    assert jaccard_similarity('Food,', 'food') == 1.0
+    conn.close()
@@ -0,0 +1,109 @@
+"""
+test_travel_matrix.py
+
+Builds the travel-time matrix from simulated run observations and checks estimates,
+incremental rebuilds, the memory-mapped round trip, the compute_fastest fallback and the
+poller hook that records arrivals.
+
+Usage:
+    python -m pytest test_travel_matrix.py
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import cta_api
+from fake_cta import FakeCTA, STATIONS
+from travel_matrix import TravelMatrix, schedule_recorder
+
+
+def observations(fake, runs):
+    rows = []
+    for k in runs:
+        for direction in ('5', '1'):
+            for _, map_id in STATIONS:
+                rows.append((int(map_id), int(fake.run_number(k, direction)), fake.arrival(k, direction, map_id)))
+    return rows
+
+
+def test_estimates_follow_observed_runs():
+    fake = FakeCTA(start=datetime(2025, 4, 26, 8, 0), hop=120)
+    matrix = TravelMatrix()
+    assert matrix.add_observations(observations(fake, range(4))) > 0
+    assert matrix.estimate('Howard', 'Bryn Mawr', datetime(2025, 4, 26, 8, 5)) == 4 * 120
+    assert matrix.estimate('Bryn Mawr', 'Howard', datetime(2025, 4, 26, 8, 5)) == 4 * 120
+    # No samples at 3am: falls back to the all-day average
+    assert matrix.estimate('Howard', '95th/Dan Ryan', datetime(2025, 4, 26, 3, 0)) == 25 * 120
+    assert matrix.estimate('Howard', 'Howard') == 0
+
+
+def test_incremental_rebuild_matches_full_build(tmp_path):
+    fake = FakeCTA(start=datetime(2025, 4, 26, 8, 0), hop=120)
+    rows = observations(fake, range(6))
+    cutoff = datetime(2025, 4, 26, 8, 40)
+
+    full = TravelMatrix()
+    full.add_observations(rows)
+
+    inc = TravelMatrix()
+    inc.add_observations([r for r in rows if r[2] <= cutoff])
+    path = str(tmp_path / 'travel_matrix.npy')
+    inc.save(path)
+    inc = TravelMatrix.load(path)
+    since = inc.watermark - timedelta(hours=2)
+    inc.add_observations([r for r in rows if r[2] > since], after=inc.watermark)
+    assert np.array_equal(np.asarray(inc.data), full.data)
+
+
+def test_load_is_memory_mapped(tmp_path):
+    path = str(tmp_path / 'travel_matrix.npy')
+    TravelMatrix().save(path)
+    assert isinstance(TravelMatrix.load(path).data, np.memmap)
+    assert TravelMatrix.load(str(tmp_path / 'missing.npy')) is None
+
+
+def test_compute_fastest_falls_back_to_matrix(monkeypatch):
+    fake = FakeCTA(start=datetime(2025, 4, 26, 8, 0), hop=120)
+    matrix = TravelMatrix()
+    matrix.add_observations(observations(fake, range(4)))
+    monkeypatch.setattr(cta_api, 'TRAVEL_MATRIX', matrix)
+    monkeypatch.setattr(cta_api, 'plan_trip', lambda *args, **kwargs: (None, None))
+    when = datetime(2025, 4, 26, 8, 10)
+    assert cta_api.compute_fastest('Howard', 'Loyola', 'key', when) == (360, when, when + timedelta(seconds=360))
+    assert cta_api.compute_fastest('Howard', 'Loyola', 'key', when, estimate_only=True)[0] == 360
+
+
+class RecordingConn:
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def executemany(self, sql, rows):
+        self.rows.extend(rows)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_schedule_recorder_feeds_poller_updates():
+    rows, conns = [], []
+
+    def connect():
+        conns.append(RecordingConn(rows))
+        return conns[-1]
+    on_update = schedule_recorder(connect)
+    etas = [{'staId': '40900', 'rn': '801', 'arrT': '2025-04-26T08:00:00', 'isApp': '1'},
+            {'staId': '40900', 'rn': '802', 'arrT': '2025-04-26T08:05:00', 'isApp': '0'}]
+    assert on_update('40900', etas) == 1
+    assert rows == [('40900', '801', datetime(2025, 4, 26, 8, 0))] and conns[0].closed
+
+    def broken():
+        raise ConnectionError("database down")
+    # A failed write is logged, not raised into the poller's pool threads
+    assert schedule_recorder(broken)('40900', etas) == 0
@@ -0,0 +1,136 @@
+"""
+test_trip_index.py
+
+Checks that OpenTripIndex answers the find_matches candidate query exactly like the
+MySQL query + Python segment check, using randomly generated open trips.
+
+Usage:
+    python -m pytest test_trip_index.py
+"""
+import random
+from datetime import datetime, timedelta
+
+from matching import STATION_LIST, INDEX_MAP, find_matches
+from trip_index import OpenTripIndex
+
+
+class FakeCursor:
+    """Evaluates the find_matches candidate query over an in-memory list of rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def execute(self, sql, params=()):
+        trip_id, latest, earliest = params[:3]
+        self.result = [dict(r) for r in self.rows
+                       if r['id'] != trip_id and r['earliest'] < latest and r['latest'] > earliest]
+        if len(params) == 5:
+            # Segment prefilter on the generated seg_start/seg_end columns (NULL off the Red Line)
+            end1, start1 = params[3:]
+            self.result = [r for r in self.result
+                           if _segment(r) is None or (_segment(r)[0] < end1 and _segment(r)[1] > start1)]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def _segment(row):
+    b_o, b_d = INDEX_MAP.get(row['cand_origin']), INDEX_MAP.get(row['cand_dest'])
+    return None if b_o is None or b_d is None else sorted([b_o, b_d])
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self.rows)
+
+
+def make_trips(n, seed=7):
+    rng = random.Random(seed)
+    base = datetime(2025, 4, 26, 7, 0)
+    trips = []
+    for i in range(1, n + 1):
+        start = base + timedelta(minutes=rng.randrange(0, 180))
+        trips.append({
+            'id': i,
+            'cand_origin': rng.choice(STATION_LIST),
+            'cand_dest': rng.choice(STATION_LIST),
+            'earliest': start,
+            'latest': start + timedelta(minutes=15),
+            'fastest_seconds': rng.randrange(300, 1800),
+            'email': f"user{i}@uchicago.edu",
+            'interests': ",".join(rng.sample(['Food', 'Music', 'Tech', 'Art', 'Books'], 2)),
+        })
+    return trips
+
+
+def brute_force(trips, trip_id, origin, destination, earliest, latest):
+    start1, end1 = sorted([INDEX_MAP[origin], INDEX_MAP[destination]])
+    ids = []
+    for t in trips:
+        if t['id'] == trip_id or not (t['earliest'] < latest and t['latest'] > earliest):
+            continue
+        start2, end2 = sorted([INDEX_MAP[t['cand_origin']], INDEX_MAP[t['cand_dest']]])
+        # Sharing track: a trip with origin == destination overlaps nothing
+        if not (end1 <= start2 or end2 <= start1 or start1 == end1 or start2 == end2):
+            ids.append(t['id'])
+    return ids
+
+
+def test_candidates_match_brute_force():
+    trips = make_trips(500)
+    index = OpenTripIndex()
+    for t in trips:
+        index.add(t)
+    for q in trips[:100]:
+        got = [r['id'] for r in index.candidates(q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'])]
+        assert got == brute_force(trips, q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'])
+
+
+def test_find_matches_from_index_equals_sql_path():
+    trips = make_trips(300, seed=11)
+    index = OpenTripIndex()
+    for t in trips:
+        index.add(t)
+    conn = FakeConn(trips)
+    for q in trips[:50]:
+        args = (q['id'], q['cand_origin'], q['cand_dest'], q['earliest'], q['latest'],
+                q['fastest_seconds'], q['interests'])
+        assert find_matches(None, *args, index=index) == find_matches(conn, *args)
+
+
+def test_remove_and_expire():
+    trips = make_trips(50)
+    index = OpenTripIndex()
+    for t in trips:
+        index.add(t)
+    assert index.remove(trips[0]['id'])
+    assert trips[0]['id'] not in index
+    cutoff = datetime(2025, 4, 26, 8, 0)
+    expected = sum(1 for t in trips[1:] if t['latest'] <= cutoff)
+    assert index.expire(cutoff) == expected
+    assert all(index.trips[tid][0]['latest'] > cutoff for tid in index.trips)
+    assert not any(tid not in index.trips for ids in index.timeline.values() for tid in ids)
+
+
+def test_verify_reports_drift():
+    trips = make_trips(100)
+    base = datetime(2025, 4, 26, 8, 0)
+    q = dict(trips[0], cand_origin='Howard', cand_dest='Garfield', earliest=base, latest=base + timedelta(minutes=15))
+    # Trip 101 was inserted elsewhere (MySQL only); trip 102 was matched elsewhere (index only)
+    inserted = dict(q, id=101, email="user101@uchicago.edu")
+    matched = dict(q, id=102, email="user102@uchicago.edu")
+    index = OpenTripIndex()
+    for t in trips + [matched]:
+        index.add(t)
+    conn = FakeConn(trips + [inserted])
+    assert index.verify(conn, -1, q['cand_origin'], q['cand_dest'], q['earliest'], q['latest']) == ([101], [102])
+    index.add(inserted)
+    index.remove(102)
+    assert index.verify(conn, -1, q['cand_origin'], q['cand_dest'], q['earliest'], q['latest']) == ([], [])
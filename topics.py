@@ -1,21 +1,76 @@
 import random
+from math import sqrt
+
+# Fixed topic vocabulary offered at onboarding
+TOPICS = ['Food', 'Sports', 'Music', 'Tech', 'Art', 'Movies', 'Books', 'Travel', 'Fitness', 'Gaming',
+          'Photography', 'Science', 'Politics', 'History', 'Comedy']
+
+def normalize_topic(topic):
+    """The one token normalization, shared with the generated interest_mask column: lowercase, spaces removed."""
+    return topic.replace(' ', '').lower()
+
+# Canonical registry: normalized topic -> bit of profiles.interest_mask. Positions are stored in
+# the database, so only ever append to TOPICS.
+TOPIC_BITS = {topic: bit for bit, topic in enumerate(normalize_topic(t) for t in TOPICS)}
 
 def normalize_topics(topics):
-    """Lowercase and strip whitespace from topics."""
-    return [topic.strip().lower() for topic in topics]
+    """Normalizes each topic (see normalize_topic)."""
+    return [normalize_topic(topic) for topic in topics]
+
+def _tokens(interests):
+    if isinstance(interests, str):
+        interests = interests.split(',')
+    return normalize_topics(interests)
+
+def topic_tokens(interests):
+    """Set of normalized, non-empty topics in a comma-separated string or list; what every similarity compares."""
+    return {t for t in _tokens(interests or '') if t}
+
+def interest_mask(interests):
+    """Bitmask of the registry topics in a comma-separated string or list; other tokens are ignored."""
+    mask = 0
+    for t in _tokens(interests):
+        if t in TOPIC_BITS:
+            mask |= 1 << TOPIC_BITS[t]
+    return mask
+
+def is_canonical(interests):
+    """True if every topic is a registry topic (modulo case and spaces), i.e. interest_mask loses nothing."""
+    return all(t in TOPIC_BITS for t in _tokens(interests))
+
+def mask_cosine(a, b):
+    """Cosine similarity of two topic bitmasks, from popcounts."""
+    na, nb = a.bit_count(), b.bit_count()
+    return (a & b).bit_count() / sqrt(na * nb) if na and nb else 0
+
+def mask_jaccard(a, b):
+    """Jaccard similarity of two topic bitmasks, from popcounts."""
+    union = (a | b).bit_count()
+    return (a & b).bit_count() / union if union else 0
 
 def jaccard_similarity(list1, list2):
     """Calculates Jaccard similarity between two lists."""
-    set1 = set(normalize_topics(list1))
-    set2 = set(normalize_topics(list2))
+    if is_canonical(list1) and is_canonical(list2):
+        return mask_jaccard(interest_mask(list1), interest_mask(list2))
+    set1 = topic_tokens(list1)
+    set2 = topic_tokens(list2)
     intersection = set1.intersection(set2)
     union = set1.union(set2)
     if not union:
         return 0
     return len(intersection) / len(union)
 
-def find_best_match(new_user_topics, existing_users_topics):
-    """Finds the best match for a new user based on topic similarity."""
+def find_best_match(new_user_topics, existing_users_topics=None, index=None):
+    """
+    Finds the best match for a new user based on topic similarity.
+
+    With `index` (an interest_index.InterestIndex) the best users come from a nearest-neighbour
+    query instead of scanning `existing_users_topics`.
+    """
+    if index is not None:
+        _, best_matches = index.query(new_user_topics)
+        return random.choice(best_matches) if best_matches else None
+
     best_matches = []
     best_score = -1
 
@@ -30,4 +85,4 @@ def find_best_match(new_user_topics, existing_users_topics):
     if best_matches:
         return random.choice(best_matches)
     else:
-        return None
\ No newline at end of file
+        return None
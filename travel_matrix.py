@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Offline station-to-station travel-time matrix learned from recorded arrivals.
+
+Observations are (station map_id, run number, arrival time) rows, as stored in the
+`schedule` table. For every run, each pair of stations it served gives one travel-time
+sample, bucketed by direction and by hour of departure. The matrix is saved as a single
+.npy file (sums and counts) and read back memory-mapped, so an estimate is one array lookup.
+
+Usage:
+    python travel_matrix.py rebuild [--path travel_matrix.npy] [--full]
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from cta_api import red_line_stations
+
+log = logging.getLogger(__name__)
+STATIONS = list(red_line_stations.keys())
+POSITION = {map_id: pos for pos, map_id in enumerate(red_line_stations.values())}
+NAME_POSITION = {name: pos for pos, name in enumerate(STATIONS)}
+
+SOUTHBOUND, NORTHBOUND = 0, 1   # CTA trDr 5 and 1 on the Red Line
+HOURS = 24
+DEFAULT_PATH = os.getenv('TRAVEL_MATRIX_PATH', 'travel_matrix.npy')
+# A run number seen again after this gap is a different trip (run numbers are reused)
+RUN_GAP = timedelta(hours=2)
+
+
+class TravelMatrix:
+    """
+    Travel-time samples indexed [direction, hour, from_station, to_station].
+
+    data[0] holds the sum of observed seconds and data[1] the number of samples; the mean
+    is derived on lookup so the matrix can be refreshed incrementally.
+    """
+
+    def __init__(self, data=None, watermark=None):
+        n = len(STATIONS)
+        self.data = data if data is not None else np.zeros((2, 2, HOURS, n, n), dtype=np.float64)
+        self.watermark = watermark
+
+    def add_observations(self, rows, after=None):
+        """
+        Adds samples from (station_id, run_id, arrival_time) rows.
+
+        after: only pairs whose later arrival is past this time are counted, so re-reading a
+               window that overlaps earlier rebuilds does not double count.
+        Returns the number of samples added.
+        """
+        if self.data.flags.writeable is False:
+            self.data = np.array(self.data)
+        trips = {}
+        for station_id, run_id, arrival in rows:
+            pos = POSITION.get(str(station_id))
+            if pos is None or arrival is None:
+                continue
+            trips.setdefault(str(run_id), []).append((arrival, pos))
+
+        added = 0
+        newest = self.watermark
+        sums, counts = self.data[0], self.data[1]
+        for stops in trips.values():
+            stops.sort()
+            for trip in _split_trips(stops):
+                for i in range(len(trip)):
+                    t_i, p_i = trip[i]
+                    for j in range(i + 1, len(trip)):
+                        t_j, p_j = trip[j]
+                        if p_i == p_j or (after is not None and t_j <= after):
+                            continue
+                        seconds = (t_j - t_i).total_seconds()
+                        if seconds <= 0:
+                            continue
+                        direction = SOUTHBOUND if p_j > p_i else NORTHBOUND
+                        sums[direction, t_i.hour, p_i, p_j] += seconds
+                        counts[direction, t_i.hour, p_i, p_j] += 1
+                        added += 1
+                last = trip[-1][0]
+                if newest is None or last > newest:
+                    newest = last
+        self.watermark = newest
+        return added
+
+    def estimate(self, orig, dest, when=None):
+        """
+        Expected seconds from station `orig` to `dest` (names) departing around `when`.
+        Falls back to the all-day average for that direction; None if never observed.
+        """
+        p_o, p_d = NAME_POSITION.get(orig), NAME_POSITION.get(dest)
+        if p_o is None or p_d is None:
+            return None
+        if p_o == p_d:
+            return 0
+        direction = SOUTHBOUND if p_d > p_o else NORTHBOUND
+        hour = (when or datetime.now()).hour
+        total, count = self.data[0, direction, hour, p_o, p_d], self.data[1, direction, hour, p_o, p_d]
+        if count == 0:
+            total = self.data[0, direction, :, p_o, p_d].sum()
+            count = self.data[1, direction, :, p_o, p_d].sum()
+        if count == 0:
+            return None
+        return int(round(total / count))
+
+    def save(self, path=DEFAULT_PATH):
+        np.save(path, self.data)
+        with open(_meta_path(path), 'w') as f:
+            json.dump({'watermark': self.watermark.isoformat() if self.watermark else None}, f)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH, mmap=True):
+        """Opens a saved matrix (memory-mapped read-only by default); returns None if absent."""
+        if not os.path.exists(path):
+            return None
+        data = np.load(path, mmap_mode='r' if mmap else None)
+        watermark = None
+        if os.path.exists(_meta_path(path)):
+            with open(_meta_path(path)) as f:
+                raw = json.load(f).get('watermark')
+            watermark = datetime.fromisoformat(raw) if raw else None
+        return cls(data, watermark)
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _split_trips(stops):
+    """Splits one run's time-sorted stops into separate trips and keeps the last sighting per station."""
+    trips, current = [], []
+    for arrival, pos in stops:
+        if current and arrival - current[-1][0] > RUN_GAP:
+            trips.append(current)
+            current = []
+        current.append((arrival, pos))
+    if current:
+        trips.append(current)
+    out = []
+    for trip in trips:
+        last = {}
+        for arrival, pos in trip:
+            last[pos] = arrival
+        out.append(sorted((arrival, pos) for pos, arrival in last.items()))
+    return out
+
+
+def record_etas(db_conn, etas):
+    """
+    Records arrivals for trains that are approaching a station (isApp = 1), which is as close to
+    an observed arrival as the Train Tracker API gets. Returns the number of rows written.
+    Wrap it with schedule_recorder to feed it from a StationPoller.
+    """
+    rows = [(eta['staId'], eta['rn'], datetime.strptime(eta['arrT'], "%Y-%m-%dT%H:%M:%S"))
+            for eta in etas if eta.get('isApp') == '1' and eta.get('arrT')]
+    if not rows:
+        return 0
+    cursor = db_conn.cursor()
+    cursor.executemany("INSERT IGNORE INTO schedule (station_id, run_id, arrival_time) VALUES (%s, %s, %s)", rows)
+    db_conn.commit()
+    cursor.close()
+    return len(rows)
+
+
+def schedule_recorder(connect):
+    """
+    StationPoller on_update hook (map_id, etas) that stores each polled station with record_etas.
+
+    connect: zero-argument callable returning a connection, e.g. db.ConnectionProvider.get. The
+             poller calls the hook from its pool threads, so each update borrows its own connection.
+    A failed write is logged and skipped; it never stops the poller.
+    """
+    def on_update(map_id, etas):
+        try:
+            conn = connect()
+            try:
+                return record_etas(conn, etas)
+            finally:
+                conn.close()
+        except Exception:
+            log.warning("Could not record arrivals for map_id %s", map_id, exc_info=True)
+            return 0
+    return on_update
+
+
+def load_observations(db_conn, since=None):
+    """Reads (station_id, run_id, arrival_time) rows from `schedule`, optionally only after `since`."""
+    cursor = db_conn.cursor()
+    if since is None:
+        cursor.execute("SELECT station_id, run_id, arrival_time FROM schedule")
+    else:
+        cursor.execute("SELECT station_id, run_id, arrival_time FROM schedule WHERE arrival_time > %s", (since,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def rebuild(db_conn, path=DEFAULT_PATH, full=False):
+    """
+    Refreshes the saved matrix from new observations. Incremental by default: rows since the
+    last watermark (minus one run gap, so runs in progress pair with their earlier stops) are read,
+    and only pairs ending after the watermark are added. Returns the number of samples added.
+    """
+    matrix = None if full else TravelMatrix.load(path, mmap=False)
+    if matrix is None:
+        matrix = TravelMatrix()
+    since = matrix.watermark - RUN_GAP if matrix.watermark else None
+    added = matrix.add_observations(load_observations(db_conn, since), after=matrix.watermark)
+    matrix.save(path)
+    return added
+
+
+def main():
+    from dotenv import load_dotenv
+    from db import config_from_env, get_db_connection
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the station-to-station travel-time matrix.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Output .npy file')
+    parser.add_argument('--full', action='store_true', help='Rebuild from every observation')
+    args = parser.parse_args()
+
+    conn = get_db_connection(config_from_env())
+    added = rebuild(conn, args.path, full=args.full)
+    conn.close()
+    print(f"Added {added} travel-time samples to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
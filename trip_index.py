@@ -0,0 +1,201 @@
+import threading
+from datetime import datetime
+from network import NETWORK
+
+# Width of one timeline bucket; trip windows are 15 minutes so a trip lands in a handful of buckets
+BUCKET_SECONDS = 300
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _bucket(dt, width=BUCKET_SECONDS):
+    return int((dt - _EPOCH).total_seconds()) // width
+
+
+def open_trips(db_conn, now=None):
+    """Unmatched trips in MySQL (candidate-row shape), skipping those already over by `now` if given."""
+    sql = """
+        SELECT t.id,
+               t.origin AS cand_origin, t.destination AS cand_dest,
+               t.earliest, t.latest, t.fastest_seconds,
+               p.email, p.interests
+        FROM trips t
+        JOIN profiles p ON t.profile_id = p.id
+        WHERE t.matched = FALSE
+    """
+    cursor = db_conn.cursor(dictionary=True)
+    if now is None:
+        cursor.execute(sql)
+    else:
+        # Finished windows are left in MySQL rather than transferred and dropped here
+        cursor.execute(sql + " AND t.latest > %s", (now,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+class OpenTripIndex:
+    """
+    Resident index of unmatched trips, answering the find_matches candidate query without a table scan.
+
+    Trips are kept in two structures:
+      - a bucketed timeline: bucket -> ids of trips whose [earliest, latest] window touches the bucket
+      - a route structure over network.NETWORK track edges: edge id -> ids of trips riding that
+        edge, plus the ids of trips with an unknown station (find_matches reports and skips them)
+
+    A lookup only touches the buckets spanned by the query window and the edges of the query
+    route, then applies the same window predicates as the SQL query in find_matches.
+    """
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.trips = {}
+        self.timeline = {}
+        self.edges = {}
+        self.unknown = set()
+        # Streamlit serves sessions from several threads that share one index
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.trips)
+
+    def __contains__(self, trip_id):
+        return trip_id in self.trips
+
+    def add(self, trip):
+        """
+        Adds or replaces an open trip.
+
+        trip: dict with keys id, cand_origin, cand_dest, earliest, latest, fastest_seconds, email, interests
+              (the row shape returned by the find_matches candidate query)
+        """
+        with self._lock:
+            tid = trip['id']
+            if tid in self.trips:
+                self.remove(tid)
+            # Trips with unknown stations are still candidates (find_matches reports and skips them)
+            known = trip['cand_origin'] in NETWORK and trip['cand_dest'] in NETWORK
+            route = NETWORK.route_edges(trip['cand_origin'], trip['cand_dest']) if known else None
+            self.trips[tid] = (dict(trip), route)
+
+            for b in self._buckets(trip['earliest'], trip['latest']):
+                self.timeline.setdefault(b, set()).add(tid)
+            if route is None:
+                self.unknown.add(tid)
+            for e in route or ():
+                self.edges.setdefault(e, set()).add(tid)
+
+    def remove(self, trip_id):
+        """Drops a trip (matched or cancelled). Returns True if it was indexed."""
+        with self._lock:
+            entry = self.trips.pop(trip_id, None)
+            if entry is None:
+                return False
+            trip, route = entry
+            for b in self._buckets(trip['earliest'], trip['latest']):
+                self._discard(self.timeline, b, trip_id)
+            self.unknown.discard(trip_id)
+            for e in route or ():
+                self._discard(self.edges, e, trip_id)
+            return True
+
+    def expired(self, now=None):
+        """Ids of trips whose latest bound is not after `now`, in id order."""
+        with self._lock:
+            now = now or datetime.now()
+            last = _bucket(now, self.bucket_seconds)
+            stale = set()
+            for b in [b for b in self.timeline if b <= last]:
+                for tid in self.timeline[b]:
+                    if self.trips[tid][0]['latest'] <= now:
+                        stale.add(tid)
+            return sorted(stale)
+
+    def expire(self, now=None):
+        """Drops every trip whose latest bound is not after `now`. Returns the number removed."""
+        with self._lock:
+            stale = self.expired(now)
+            for tid in stale:
+                self.remove(tid)
+            return len(stale)
+
+    def candidates(self, trip_id, origin, destination, earliest, latest):
+        """
+        Returns candidate rows for a new trip: unmatched, not `trip_id`, time windows overlapping
+        and routes sharing a track edge. Rows are copies in the find_matches candidate-query shape.
+        """
+        with self._lock:
+            route = NETWORK.route_edges(origin, destination)
+
+            in_window = set()
+            for b in self._buckets(earliest, latest):
+                in_window |= self.timeline.get(b, set())
+            on_route = set()
+            for e in route:
+                on_route |= self.edges.get(e, set())
+
+            out = []
+            # Trips with unknown stations never pass the route check; the unknown set is small
+            for tid in in_window & (on_route | self.unknown):
+                trip = self.trips[tid][0]
+                if tid == trip_id:
+                    continue
+                if trip['earliest'] < latest and trip['latest'] > earliest:
+                    out.append(dict(trip))
+            out.sort(key=lambda r: r['id'])
+            return out
+
+    def load(self, db_conn, now=None):
+        """Rebuilds the index from the unmatched trips in MySQL, skipping those already over by `now` if given."""
+        with self._lock:
+            self.trips.clear()
+            self.timeline.clear()
+            self.edges.clear()
+            self.unknown.clear()
+            for row in open_trips(db_conn, now):
+                self.add(row)
+            return len(self.trips)
+
+    def verify(self, db_conn, trip_id, origin, destination, earliest, latest):
+        """
+        Consistency check: compares the index answer with the MySQL candidate query.
+        Returns (missing, extra): ids MySQL returned that the index did not, and vice versa.
+        """
+        cursor = db_conn.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT t.id, t.origin AS cand_origin, t.destination AS cand_dest
+            FROM trips t
+            JOIN profiles p ON t.profile_id = p.id
+            WHERE t.matched = FALSE
+              AND t.id != %s
+              AND t.earliest < %s
+              AND t.latest > %s
+            """,
+            (trip_id, latest, earliest)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+
+        expected = set()
+        for row in rows:
+            if row['cand_origin'] not in NETWORK or row['cand_dest'] not in NETWORK:
+                expected.add(row['id'])
+            elif NETWORK.overlaps((origin, destination), (row['cand_origin'], row['cand_dest'])):
+                expected.add(row['id'])
+        got = {r['id'] for r in self.candidates(trip_id, origin, destination, earliest, latest)}
+        return sorted(expected - got), sorted(got - expected)
+
+    # Internal helpers
+
+    def _buckets(self, earliest, latest):
+        first = _bucket(earliest, self.bucket_seconds)
+        last = _bucket(latest, self.bucket_seconds)
+        return range(first, last + 1)
+
+    @staticmethod
+    def _discard(table, key, trip_id):
+        ids = table.get(key)
+        if ids is not None:
+            ids.discard(trip_id)
+            if not ids:
+                del table[key]